@@ -2,8 +2,13 @@
 
 from cobraa.load import *
 from cobraa.io_operations import *
+from cobraa.planning import *
+from cobraa.runner import *
+from cobraa.synthesize import *
 from cobraa.coincidence import *
 from cobraa.sensitivity import *
+from cobraa.results import *
+from cobraa.adaptive import *
 from cobraa.globals import *
 from cobraa.extras import *
 
@@ -21,21 +26,39 @@ if __name__ == '__main__':
 #     print defaultValues
     print('')
 
+    if arguments['--plan']:
+        planEvents()
+
     if arguments['-m']:
         generateMacros()
 
     if arguments['-j']:
         generateJobs()
 
+    if arguments['--run-jobs']:
+        runJobs()
+
+    if arguments['--synthesize']:
+        synthesize()
+
     if arguments['-M']:
         mergeRootFiles()
 
+    if arguments['--pairs']:
+        pairTables()
+
     if arguments['--coincidences']:
         coincidenceMap()
 
+    if arguments['--adaptive']:
+        adaptiveOptimisation()
+
     if arguments['--sensitivity']:
         calculateSensitivity()
 
+    if arguments['--query']:
+        queryResults()
+
     if arguments['--triggers']:
         triggers()
 
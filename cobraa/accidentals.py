@@ -0,0 +1,175 @@
+from itertools import product
+from ROOT import TH2D,gDirectory
+from .globals import *
+from .columns import *
+from .pairs import *
+
+# Analytic accidental-coincidence maps. Instead of pairing the events of the
+# singles_ALL_singles simulation, the accidental rate in each cut cell is
+# built from the prompt-like and delayed-like selection efficiencies of the
+# individual radioactive (*_NA) and RADIOGENIC samples, weighted by their
+# rates:
+#   R_acc = R_prompt * R_delayed * (dT - 1us) * f_dR
+# where f_dR is the fraction of uncorrelated prompt/delayed pairs within the
+# dR cut. The maps are written under the singles_ALL_singles names so that
+# --sensitivity picks them up unchanged.
+
+accidentalsTag = 'singles_ALL_singles'
+# prompt-like and delayed-like events sampled for the dR fraction
+dRSample = 2000
+
+def singlesComponents():
+
+    # the (merged file, tag) of each radioactive sample. These are simulated
+    # with --singles, so are read from the _singles directories.
+    singlesString = testEnabledCondition(dict(arguments,**{'--singles':True}))[0]
+    components = []
+    for _p in proc:
+        for _loc in proc[_p]:
+            for _element in d[_p][_loc]:
+                if 'NA' in _p or 'RADIOGENIC' in _p:
+                    _tag = "%s_%s_%s"%(_element,_loc,_p)
+                    _tag = _tag.replace(" ","")
+                    _file = "reconstructed_root_files%s/merged_%s_%s_%s.root"%(singlesString,_element,_loc,_p)
+                    _file = _file.replace(" ","")
+                    components.append((_file,_tag))
+    return components
+
+def singlesCandidates(grid):
+
+    # reads the events of every radioactive sample which are prompt-like or
+    # delayed-like at the loosest cuts of the grid. Each event carries the
+    # rate (Hz) it represents. Also returns the rate of triggers (nhits>3).
+    estimator = '%s_Bonsai'%(energyEstimator)
+    branches = [estimator,'x_Bonsai','y_Bonsai','z_Bonsai','closestPMT_Bonsai','positionGoodness_Bonsai','nhits']
+    chunks,triggerRate,missing = [],0.,[]
+    for _file,_tag in singlesComponents():
+        if rates[_tag][0]<=0:
+            # no activity, so no accidentals
+            continue
+        if not os.path.exists(_file):
+            missing.append(_tag)
+            continue
+        kept,ntriggers,totalEvents = [],0,0
+        for cols in iterateColumns(_file,branches):
+            totalEvents += len(cols['nhits'])
+            trigger = cols['nhits']>3
+            ntriggers += np.count_nonzero(trigger)
+            loose = trigger & (cols['positionGoodness_Bonsai']>cutValue(min(grid['g'])))
+            loose &= cols['closestPMT_Bonsai']/1000.>cutValue(min(grid['fid']))
+            loose &= cols[estimator]>cutValue(min(min(grid['prompt']),min(grid['delayed'])))
+            kept.append({_b:cols[_b][loose] for _b in branches})
+        if totalEvents==0:
+            missing.append(_tag)
+            continue
+        weight = rates[_tag][0]/float(totalEvents)
+        triggerRate += ntriggers*weight
+        for _k in kept:
+            _k['weight'] = np.full(len(_k['nhits']),weight)
+            chunks.append(_k)
+    if missing:
+        print('No radioactive sample for %s, not included in the accidentals'%(', '.join(missing)))
+    if not chunks:
+        chunks.append({_b:np.zeros(0) for _b in branches+['weight']})
+    cand = {_b:np.concatenate([_c[_b] for _c in chunks]) for _b in chunks[0]}
+    cand['fid'] = cand['closestPMT_Bonsai']/1000.
+    cand['energy'] = cand[estimator]
+    return cand,triggerRate
+
+def cutSums(fid,energy,weight,cells):
+
+    # the sum of weights and of squared weights of the events with fid and
+    # energy above the cuts of each (fiducial, energy) cell, from a weighted
+    # 2D histogram of the number of cuts each event passes
+    fidcuts = np.unique([cutValue(_c[0]) for _c in cells])
+    ecuts = np.unique([cutValue(_c[1]) for _c in cells])
+    kf = np.searchsorted(fidcuts,fid,'left')
+    ke = np.searchsorted(ecuts,energy,'left')
+    shape = (len(fidcuts)+1,len(ecuts)+1)
+    sums = []
+    for w in (weight,weight*weight):
+        h = np.bincount(kf*shape[1]+ke,weights=w,minlength=shape[0]*shape[1]).reshape(shape)
+        # events passing cut i have kf > i, so sum the bins above it
+        h = h[::-1,::-1].cumsum(axis=0).cumsum(axis=1)[::-1,::-1]
+        sums.append(np.array([h[np.searchsorted(fidcuts,cutValue(_f))+1,np.searchsorted(ecuts,cutValue(_e))+1] for _f,_e in cells]))
+    return sums
+
+def dRFractions(cand,grid,prompt,delayed):
+
+    # the weighted fraction of uncorrelated prompt-like/delayed-like pairs
+    # closer than the dR cut, for each fiducial cut. It is evaluated from a
+    # fixed random subsample at the loosest energy and goodness cuts, for the
+    # last dR value only as the maps (named without dR) hold its cells.
+    dRcut = cutValue(grid['dR'][-1])
+    rng = np.random.default_rng(0)
+    ip = np.flatnonzero(prompt)
+    jd = np.flatnonzero(delayed)
+    if len(ip)>dRSample:
+        ip = np.sort(rng.choice(ip,dRSample,replace=False))
+    if len(jd)>dRSample:
+        jd = np.sort(rng.choice(jd,dRSample,replace=False))
+    dx = cand['x_Bonsai'][ip,None]-cand['x_Bonsai'][None,jd]
+    dy = cand['y_Bonsai'][ip,None]-cand['y_Bonsai'][None,jd]
+    dz = cand['z_Bonsai'][ip,None]-cand['z_Bonsai'][None,jd]
+    close = np.sqrt(dx*dx+dy*dy+dz*dz)/1000.<dRcut
+    fractions = {}
+    for fidcut in grid['fid']:
+        wp = cand['weight'][ip]*(cand['fid'][ip]>cutValue(fidcut))
+        wd = cand['weight'][jd]*(cand['fid'][jd]>cutValue(fidcut))
+        total = wp.sum()*wd.sum()
+        fractions[fidcut] = wp@close@wd/total if total>0 else 1.
+    return fractions
+
+def analyticAccidentals(outfile):
+
+    # fills and writes the accidental coincidence maps (coincidences per
+    # day, as the maps from the singles simulation) for every cut of the grid
+    grid = cutGrid()
+    cand,triggerRate = singlesCandidates(grid)
+    print('Analytic accidentals from %d candidate singles events, trigger rate %.3e Hz'%(len(cand['weight']),triggerRate))
+    loosePrompt = cand['energy']>cutValue(min(grid['prompt']))
+    looseDelayed = cand['energy']>cutValue(min(grid['delayed']))
+    fractions = dRFractions(cand,grid,loosePrompt&(cand['energy']<cutValue(max(grid['maxEp']))),looseDelayed)
+    empty = 0
+
+    for delayed_nxcut,dTcut,maxEp,gcut in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g']):
+        cells = scanCells(delayed_nxcut,grid)
+        good = cand['positionGoodness_Bonsai']>cutValue(gcut)
+        # prompt-like events: energy above the prompt cut of the cell
+        prompt = good & (cand['energy']<cutValue(maxEp))
+        rp,rp2 = cutSums(cand['fid'][prompt],cand['energy'][prompt],cand['weight'][prompt],cells)
+        # delayed-like events: energy above the delayed cut (passing every
+        # prompt cut of the cells)
+        delayed = good & (cand['energy']>cutValue(delayed_nxcut))
+        rd,rd2 = cutSums(cand['fid'][delayed],np.full(np.count_nonzero(delayed),np.inf),cand['weight'][delayed],cells)
+        # relative statistical errors
+        relp = np.divide(rp2,rp*rp,out=np.zeros(len(cells)),where=rp>0)
+        reld = np.divide(rd2,rd*rd,out=np.zeros(len(cells)),where=rd>0)
+        # cells without a prompt-like or delayed-like sample event have no
+        # accidentals estimate and are left empty
+        filled = (rp>0) & (rd>0)
+        empty += np.count_nonzero(~filled)
+        fdR = np.array([fractions[_f] for _f,_p in cells])
+        window = (dTcut-1)*1e-6
+        accidentals = rp*rd*window*fdR*86400.
+        if arguments['--timeline']:
+            # the timeline veto also removes pairs with any other trigger
+            # within dT of either event
+            accidentals *= np.exp(-triggerRate*2*dTcut*1e-6)
+        errors = accidentals*np.sqrt(relp+reld)
+
+        tag = accidentalsTag+'_delayed'+mapKey(delayed_nxcut,dTcut,maxEp,gcut)
+        outfile.cd()
+        gDirectory.Delete("hist_%s;*"%(tag))
+        hist = TH2D('hist_%s'%(tag),'Analytic accidentals -  %s '%(tag),binFid,rangeFidmin,rangeFidmax,binNX,rangeNXpmin,rangeNXpmax)
+        hist.SetXTitle('distance from wall [m]')
+        hist.SetYTitle('prompt %s cut'%(energyEstimator))
+        hist.SetZTitle('coincidences per day')
+        for (fidcut,prompt_nxcut),acc,err in zip([_c for _c,_f in zip(cells,filled) if _f],accidentals[filled],errors[filled]):
+            hist.Fill(fidcut,prompt_nxcut,float(acc))
+            hist.SetBinError(hist.FindBin(fidcut,prompt_nxcut),float(err))
+        hist.Write()
+        del hist
+    if empty:
+        print('%d cells have no prompt-like or delayed-like event in the radioactive samples; their accidentals maps are left empty'%(empty))
+    return 0
@@ -0,0 +1,149 @@
+from itertools import product
+from .globals import *
+from .pairs import *
+from .pairtable import *
+from .coincidence import *
+from .sensitivity import *
+
+# Adaptive coarse-to-fine optimisation of the cuts. Instead of mapping every
+# cell of the delayed-nX x dT x maxEp x g x fiducial x prompt-nX grid and then
+# scanning the maps, the candidate pairs of each tag are read once and the
+# sensitivity metric is evaluated on a coarse subgrid (every stride-th value
+# of each cut). The strides are then halved around the best cells until the
+# steps of the grid (--binwidth*) are reached and the best cell no longer
+# moves. Rates, systematics and the metric are those of --sensitivity, so
+# the optimum can be checked against the exhaustive --coincidences and
+# --sensitivity scan of the same grid.
+
+# the optimised cuts, in the order of the maps and cells of --sensitivity.
+# dR is held at the last value of its range, as in the maps of the scan
+# (their names do not include dR).
+adaptiveDims = ['delayed','dT','maxEp','g','fid','prompt']
+# the number of best cells refined at each level
+adaptiveKeep = 3
+
+def coarseStride(n):
+
+    # the largest power of two stride which leaves at least 3 values of a
+    # cut with n values
+    stride = 1
+    while (n-1)//(stride*2)>=2:
+        stride *= 2
+    return stride
+
+def strideIndices(n,stride,centre=None):
+
+    # every stride-th index of a cut with n values, or the neighbours of the
+    # centre index at the stride, always including the last index
+    if centre is None:
+        indices = list(range(0,n,stride))
+        if indices[-1]!=n-1:
+            indices.append(n-1)
+        return indices
+    return sorted(set(min(max(centre+_s,0),n-1) for _s in (-stride,0,stride)))
+
+def tagPairs(grid):
+
+    # the candidate pairs, number of events, trigger timeline and days of
+    # data of each tag, from its pair table or its merged file
+    samples = {}
+    for _file,_tag in coincidenceTasks():
+        if _tag not in rates or not os.path.exists(_file):
+            print('Skipping %s, %s not found'%(_tag,_file))
+            continue
+        table = loadPairTable(_file,_tag,grid)
+        if table is not None:
+            print('Reading pair table for', _tag)
+        elif arguments['--timeline']:
+            print('Reading', _file)
+            table = streamTimelinePairs(_file,grid)
+        else:
+            print('Reading', _file)
+            pairs,totalEvents = streamPairs(_file,grid)
+            table = (pairs,totalEvents,None)
+        pairs,totalEvents,triggers = table
+        if totalEvents==0:
+            print('Skipping %s, no events'%(_tag))
+            continue
+        samples[_tag] = (pairs,totalEvents,triggers,livetimeDays(_tag,totalEvents,rates[_tag][0]))
+    return samples
+
+def subgridRates(samples,grid,region,scenario):
+
+    # the rate (per day) and error of each component of the rates for the
+    # cells of the product of the region's indices of each cut, as arrays of
+    # shape (maps, cells)
+    subgrid = {_d:[grid[_d][i] for i in region[_d]] for _d in adaptiveDims}
+    subgrid['dR'] = [grid['dR'][-1]]
+    nmaps = len(subgrid['delayed'])*len(subgrid['dT'])*len(subgrid['maxEp'])*len(subgrid['g'])
+    cellIndex = {_c:i for i,_c in enumerate(product(subgrid['fid'],subgrid['prompt']))}
+    components = ['signal','acc','fn','li9','n17','reacIBDbg','geoIBDbg']
+    rateArrays = {_c:np.zeros((nmaps,len(cellIndex))) for _c in components}
+    variances = {_c:np.zeros((nmaps,len(cellIndex))) for _c in components}
+    for _tag,(pairs,totalEvents,triggers,days) in samples.items():
+        tagComponents = rateComponents(_tag,scenario)
+        if not tagComponents:
+            continue
+        for m,(cuts,cells,counts) in enumerate(coincidenceCounts(pairs,subgrid,(),triggers)):
+            coincidences,coincidenceErrs = coincidenceRates(counts,totalEvents)
+            columns = [cellIndex[_c] for _c in cells]
+            for component,scale in tagComponents:
+                rateArrays[component][m,columns] += coincidences/days*scale
+                variances[component][m,columns] += (coincidenceErrs/days*scale)**2
+    return rateArrays,{_c:sqrt(variances[_c]) for _c in components}
+
+def adaptiveOptimisation():
+
+    # optimises the cuts coarse-to-fine and prints the optimum found
+    if arguments['--core']:
+        print('Adaptive optimisation is not available for the combined reconstruction')
+        return 0
+    if arguments['--analyticAcc']:
+        print('Adaptive optimisation uses the accidentals of the singles simulation')
+    grid = cutGrid()
+    scenario = selectedScenario()
+    print('Signal scenario: %s'%(scenarioName(scenario)))
+    samples = tagPairs(grid)
+    sizes = {_d:len(grid[_d]) for _d in adaptiveDims}
+    exhaustive = int(np.prod([sizes[_d] for _d in adaptiveDims]))
+
+    stride = {_d:coarseStride(sizes[_d]) for _d in adaptiveDims}
+    regions = [{_d:strideIndices(sizes[_d],stride[_d]) for _d in adaptiveDims}]
+    # the score and rates of every cell evaluated, keyed by the index of
+    # each cut in the grid
+    cells = {}
+    level,previous = 0,None
+    while True:
+        for region in regions:
+            rateArrays,errorArrays = subgridRates(samples,grid,region,scenario)
+            model = backgroundModel(rateArrays,errorArrays)
+            signal,background = rateArrays['signal'],model['background']
+            sob,t3sig,valid,candidate,best,opt = optimiseCuts(signal,background,model['totSysError'])
+            candidate,score = cutScore(sob,t3sig,valid)
+            mapIndex = list(product(region['delayed'],region['dT'],region['maxEp'],region['g']))
+            cellIndex = list(product(region['fid'],region['prompt']))
+            for m,c in product(range(len(mapIndex)),range(len(cellIndex))):
+                cells[mapIndex[m]+cellIndex[c]] = (score[m,c],t3sig[m,c],sob[m,c],signal[m,c],background[m,c],model['totSysError'][m,c])
+        # the best cells (first in scan order on ties)
+        ranked = sorted(cells,key=lambda _k:(cells[_k][0],_k))[:adaptiveKeep]
+        top = ranked[0]
+        print('Level %d: strides %s, %d cells evaluated, best %s score %.4g'%(level,\
+              ' '.join('%s:%d'%(_d,stride[_d]) for _d in adaptiveDims),len(cells),\
+              ' '.join('%s:%g'%(_d,grid[_d][i]) for _d,i in zip(adaptiveDims,top)),cells[top][0]))
+        if all(stride[_d]==1 for _d in adaptiveDims) and top==previous:
+            break
+        previous = top
+        stride = {_d:max(1,stride[_d]//2) for _d in adaptiveDims}
+        regions = [{_d:strideIndices(sizes[_d],stride[_d],_k[i]) for i,_d in enumerate(adaptiveDims)} for _k in ranked]
+        level += 1
+
+    score,t3sig,sob,signal,background,totSysError = cells[top]
+    print('\nEvaluated %d of the %d cells of the grid (%.1f%%)'%(len(cells),exhaustive,100.*len(cells)/exhaustive))
+    if not np.isfinite(score):
+        print('No valid cuts found')
+        return 0
+    cuts = {_d:grid[_d][i] for _d,i in zip(adaptiveDims,top)}
+    print('Optimal cuts (%s): fiducial:%.1f  nXprompt:%d  nXdelayed:%d  dT:%d maxE: %d  g:%.1f  dR:%.1f'%(scenarioName(scenario),\
+          cuts['fid'],cuts['prompt'],cuts['delayed'],cuts['dT'],cuts['maxEp'],cuts['g'],grid['dR'][-1]))
+    print('s:%.3f  b:%.3f  total bg systematics: %1.2e  s/sqrt(b):%.3f  days to discovery:%.1f'%(signal,background,totSysError,sob,t3sig))
+    return 0
@@ -0,0 +1,203 @@
+import hashlib
+import json
+from itertools import product
+from ROOT import TFile
+from .globals import *
+from .pairs import *
+
+# Content-addressed cache for the coincidence maps. For every event tag the
+# cache records the identity of the merged input file and, for every
+# hist_<tag>_delayed... map written to coincidence_results.root, a digest of
+# the exact cut cells that produced it. A rerun only rewrites the maps (and
+# reads the tags) which are missing or stale.
+# The count of a cut cell only depends on the input file, the energy
+# estimator and the pairing mode, so the counts of every (delayed, dT,
+# maxEp, g, dR, fiducial, prompt nX) cell evaluated for a tag are also
+# recorded, in coincidence_cells/<tag>.npz. A stale map is refilled from the
+# recorded cells, and only its new cells (e.g. those of a higher --dRmax or
+# --maxNXprompt) are counted from the pair extraction.
+
+# the coordinates of a cell in the cell record
+cellColumns = ['delayed','dT','maxEp','g','dR','fid','prompt']
+
+def fileIdentity(file,known=None):
+
+    # size, mtime and sha1 of a file. The hash is only recomputed when the
+    # size or mtime differ from the known identity.
+    st = os.stat(file)
+    identity = {'size':st.st_size,'mtime':st.st_mtime}
+    if known and known.get('size')==identity['size'] and known.get('mtime')==identity['mtime']:
+        identity['sha1'] = known['sha1']
+        return identity
+    sha = hashlib.sha1()
+    with open(file,'rb') as f:
+        for block in iter(lambda: f.read(1<<24),b''):
+            sha.update(block)
+    identity['sha1'] = sha.hexdigest()
+    return identity
+
+def loadCache(cachefile):
+
+    if os.path.exists(cachefile):
+        with open(cachefile) as f:
+            return json.load(f)
+    return {}
+
+def saveCache(cache,cachefile):
+
+    # write to a temporary file first so an interrupted run cannot leave a
+    # truncated cache behind
+    with open(cachefile+'.tmp','w') as f:
+        json.dump(cache,f,indent=1,sort_keys=True)
+    os.replace(cachefile+'.tmp',cachefile)
+
+def resultsMaps(resultsfile):
+
+    # names of the maps already in the results file
+    names = set()
+    if os.path.exists(resultsfile):
+        f = TFile(resultsfile)
+        for key in f.GetListOfKeys():
+            names.add(key.GetName())
+        f.Close()
+    return names
+
+def mapCells(grid,scale):
+
+    # digest of the cut cells behind every map of the grid. The map names do
+    # not include dR, so each map holds the cells of the last dR value.
+    digests = {}
+    for delayed_nxcut,dTcut,maxEp,gcut in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g']):
+        coords = {'delayed':'%f'%(delayed_nxcut),'dT':'%f'%(dTcut),'maxEp':'%f'%(maxEp),'g':'%f'%(gcut),\
+                  'dR':'%f'%(grid['dR'][-1]) if grid['dR'] else None,\
+                  'cells':[('%f'%(fidcut),'%f'%(prompt_nxcut)) for fidcut,prompt_nxcut in scanCells(delayed_nxcut,grid)],\
+                  'hist':[binFid,rangeFidmin,rangeFidmax,binNX,rangeNXpmin,rangeNXpmax],\
+                  'scale':repr(scale)}
+        if arguments['--timeline']:
+            coords['timeline'] = True
+        digests[mapKey(delayed_nxcut,dTcut,maxEp,gcut)] = hashlib.sha1(json.dumps(coords).encode()).hexdigest()
+    return digests
+
+def freshMaps(cache,_tag,identity,expected,present):
+
+    # the map keys of a tag which are already up to date
+    entry = cache.get(_tag)
+    if not entry or entry['input'].get('sha1')!=identity['sha1']:
+        return set()
+    fresh = set()
+    for key,digest in expected.items():
+        if entry['maps'].get(key)==digest and 'hist_%s_delayed%s'%(_tag,key) in present:
+            fresh.add(key)
+    return fresh
+
+def updateCache(cache,_tag,identity,expected):
+
+    # record the maps of a tag computed from the given input file
+    entry = cache.get(_tag)
+    if not entry or entry['input'].get('sha1')!=identity['sha1']:
+        entry = {'maps':{}}
+    entry['input'] = identity
+    entry['maps'].update(expected)
+    cache[_tag] = entry
+    return 0
+
+def cellCacheFile(_tag):
+
+    return "reconstructed_root_files%s/coincidence_cells/%s.npz"%(additionalString,_tag)
+
+def cellSlices(rows):
+
+    # the (start, stop) rows of each (delayed, dT, maxEp, g, dR) cut of the
+    # record columns, which are sorted by cell
+    n = len(rows['count'])
+    if n==0:
+        return {}
+    keys = np.column_stack([rows[_c] for _c in cellColumns[:5]])
+    change = np.flatnonzero(np.any(keys[1:]!=keys[:-1],axis=1))+1
+    starts = np.concatenate(([0],change))
+    stops = np.concatenate((change,[n]))
+    return {tuple(keys[_s].tolist()):(_s,_e) for _s,_e in zip(starts,stops)}
+
+def loadCellCounts(_tag,identity):
+
+    # the cell record of a tag made from the input file of the given
+    # identity with the current energy estimator and pairing mode, or an
+    # empty record
+    record = {'input':identity,'totalEvents':None,'rows':{_c:np.zeros(0) for _c in cellColumns+['count']},'slices':{}}
+    cellfile = cellCacheFile(_tag)
+    if not os.path.exists(cellfile):
+        return record
+    with np.load(cellfile) as f:
+        meta = json.loads(str(f['meta']))
+        if meta['input'].get('sha1')!=identity['sha1'] or meta['energyEstimator']!=energyEstimator:
+            return record
+        if meta['timeline']!=bool(arguments['--timeline']):
+            return record
+        record['totalEvents'] = meta['totalEvents']
+        record['rows'] = {_c:f[_c] for _c in cellColumns+['count']}
+    record['slices'] = cellSlices(record['rows'])
+    return record
+
+def recordedCells(record,cuts):
+
+    # the recorded counts of the cells of a (delayed, dT, maxEp, g, dR) cut,
+    # by (fiducial, prompt nX) cut value
+    start,stop = record['slices'].get(tuple(cutValue(_x) for _x in cuts),(0,0))
+    rows = record['rows']
+    return dict(zip(zip(rows['fid'][start:stop].tolist(),rows['prompt'][start:stop].tolist()),rows['count'][start:stop].tolist()))
+
+def missingCells(record,grid,skip=()):
+
+    # the cells of each (delayed, dT, maxEp, g, dR) cut of the grid which
+    # are not recorded, for coincidenceCounts(only=...)
+    missing = {}
+    for cuts in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g'],grid['dR']):
+        if mapKey(*cuts[:4]) in skip:
+            continue
+        known = recordedCells(record,cuts)
+        cells = [_c for _c in scanCells(cuts[0],grid) if (cutValue(_c[0]),cutValue(_c[1])) not in known]
+        if cells:
+            missing[cuts] = cells
+    return missing
+
+def mergeCellCounts(record,scan,grid,skip,missing,added):
+
+    # yields, as coincidenceCounts(), the counts of every cell of the grid:
+    # the recorded ones and those of the missing cells from the scan of
+    # them (in the same order), which are also appended to added
+    for cuts in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g'],grid['dR']):
+        if mapKey(*cuts[:4]) in skip:
+            continue
+        known = recordedCells(record,cuts)
+        if cuts in missing:
+            _cuts,cells,counts = next(scan)
+            added.append((cuts,cells,counts))
+            for (fidcut,prompt_nxcut),count in zip(cells,counts):
+                known[(cutValue(fidcut),cutValue(prompt_nxcut))] = int(count)
+        cells = scanCells(cuts[0],grid)
+        yield cuts,cells,np.array([known[(cutValue(_f),cutValue(_p))] for _f,_p in cells],dtype=np.int64)
+
+def saveCellCounts(_tag,record,added):
+
+    # writes the recorded cells of a tag together with the cells counted
+    # since, sorted by cell, and the number of events of its input
+    columns = {_c:[record['rows'][_c]] for _c in cellColumns+['count']}
+    for cuts,cells,counts in added:
+        for _c,_x in zip(cellColumns[:5],cuts):
+            columns[_c].append(np.full(len(cells),cutValue(_x)))
+        columns['fid'].append(np.array([cutValue(_f) for _f,_p in cells]))
+        columns['prompt'].append(np.array([cutValue(_p) for _f,_p in cells]))
+        columns['count'].append(np.asarray(counts,dtype=np.int64))
+    rows = {_c:np.concatenate(columns[_c]) for _c in columns}
+    rows['count'] = rows['count'].astype(np.int64)
+    order = np.lexsort([rows[_c] for _c in reversed(cellColumns)])
+    rows = {_c:rows[_c][order] for _c in rows}
+    meta = {'input':record['input'],'totalEvents':record['totalEvents'],'energyEstimator':energyEstimator,'timeline':bool(arguments['--timeline'])}
+    cellfile = cellCacheFile(_tag)
+    os.makedirs(os.path.dirname(cellfile),exist_ok=True)
+    # write to a temporary file first so an interrupted run cannot leave a
+    # truncated record behind
+    with open(cellfile+'.tmp','wb') as f:
+        np.savez_compressed(f,meta=np.array(json.dumps(meta)),**rows)
+    os.replace(cellfile+'.tmp',cellfile)
+    return 0
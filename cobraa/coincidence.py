@@ -6,9 +6,19 @@ from itertools import product,combinations
 from numpy import multiply
 from math import fabs,log
 import sys
+import traceback
+import tempfile
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from .load import *
 from .globals import *
+from .columns import *
+from .pairs import *
+from .cache import *
+from .pairtable import *
+from .accidentals import *
+from .progress import *
 
 # This creates maps of signal and background coincidences in 5 dimensions. 
 # It outputs 2D histograms of coincidence rates as a function of prompt-event
@@ -45,8 +55,108 @@ def coincidenceMap():
 #        else:
 #            print("Updating the coincidences results file.")
 
-    outfile = TFile(_str,"UPDATE")
+    tasks = coincidenceTasks()
+    # the accidentals are estimated from the radioactive samples instead of
+    # the singles simulation
+    analyticAcc = arguments['--analyticAcc'] and not arguments['--core']
+    if analyticAcc:
+        tasks = [(_file,_tag) for _file,_tag in tasks if _tag!=accidentalsTag]
+
+    # skip the maps which are up to date for an unchanged input file
+    skips = {}
+    useCache = not arguments['--core'] and not arguments['--noCache']
+    if useCache:
+        cachefile = os.path.join(os.path.dirname(_str),"coincidence_cache.json")
+        cache = loadCache(cachefile)
+        present = resultsMaps(_str)
+        grid = cutGrid()
+        identities,expected,pending = {},{},[]
+        for _file,_tag in tasks:
+            if not os.path.exists(_file) or _tag not in rates:
+                pending.append((_file,_tag))
+                continue
+            identities[_tag] = fileIdentity(_file,cache.get(_tag,{}).get('input'))
+            scale = singlespersec if 'singles' in _tag else rates[_tag][0]
+            expected[_tag] = mapCells(grid,scale)
+            skips[_tag] = freshMaps(cache,_tag,identities[_tag],expected[_tag],present)
+            if len(skips[_tag])==len(expected[_tag]):
+                print('Coincidence maps for %s are up to date'%(_tag))
+                continue
+            if skips[_tag]:
+                print('Reusing %d of %d coincidence maps for %s'%(len(skips[_tag]),len(expected[_tag]),_tag))
+            pending.append((_file,_tag))
+        tasks = pending
+
+    jobs = int(arguments['--jobs'])
+    if jobs>1:
+        # evaluate each tag in a worker process, writing to a shard file per
+        # tag, then merge the shards into the results file. A worker killed
+        # in ROOT breaks the pool, which fails the tags not finished yet
+        # instead of waiting for them forever.
+        sharddir = os.path.join(os.path.dirname(_str),"coincidence_shards")
+        os.makedirs(sharddir,exist_ok=True)
+        shards,failed,done = [],[],[]
+        work = [(_file,_tag,"%s/coincidence_results_%s.root"%(sharddir,_tag),skips.get(_tag,set()),identities.get(_tag)) for _file,_tag in tasks]
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = {pool.submit(coincidenceShard,_w):_w for _w in work}
+            for future in as_completed(futures):
+                _file,_tag,shard,skip,identity = futures[future]
+                try:
+                    error = future.result()[2]
+                except BrokenProcessPool:
+                    error = 'the worker process died'
+                if error:
+                    print('Was not able to calculate coincidence for %s:\n%s'%(_tag,error))
+                    failed.append(_tag)
+                    # a partial shard is not merged
+                    if os.path.exists(shard):
+                        os.remove(shard)
+                else:
+                    print('Finished coincidences for %s'%(_tag))
+                    shards.append(shard)
+                    done.append(_tag)
+        outfile = TFile(_str,"UPDATE")
+        mergeShards(shards,outfile)
+        if useCache:
+            for _tag in done:
+                if _tag in identities:
+                    updateCache(cache,_tag,identities[_tag],expected[_tag])
+            saveCache(cache,cachefile)
+        if failed:
+            print('Coincidences failed for:',' '.join(failed))
+    else:
+        outfile = TFile(_str,"UPDATE")
+        for _file,_tag in tasks:
+            if arguments["--core"]:
+                rate = rates[_tag][0]
+                obtainCoincidencesCoRe(_file,_tag,outfile,rate)
+            else:
+                print("*************************** ",_tag)
+                try:
+                    rate = rates[_tag][0]
+                    obtainCoincidences(_file,_tag,outfile,rate,skips.get(_tag,set()),identities.get(_tag))
+                    print('')
+                except: print('Was not able to calculate coincidence')
+                else:
+                    if useCache and _tag in identities:
+                        updateCache(cache,_tag,identities[_tag],expected[_tag])
+                        saveCache(cache,cachefile)
+
+    if analyticAcc:
+        analyticAccidentals(outfile)
+        # the singles maps no longer come from the singles simulation
+        if useCache:
+            cache.pop(accidentalsTag,None)
+            saveCache(cache,cachefile)
+
+    print('Saving outfile:',_str)
+    outfile.Close()
+    return 0
+
+def coincidenceTasks():
 
+    # the (merged file, tag) of each event type to be evaluated
+    tasks = []
     if arguments['--evtype']:
         evtype = arguments['--evtype']
         if evtype=="li9":
@@ -64,16 +174,9 @@ def coincidenceMap():
                         else:
                             _file = "reconstructed_root_files%s/merged_%s_%s_%s.root"%(additionalString,_element,_loc,_p)
                         _file = _file.replace(" ","")
-                        rate = rates[_tag][0]
                         if 'pn_ibd' in _tag or 'A_Z' in _tag or 'FAST' in _tag or 'singles' in _tag:
                             print(_tag," from ",_file)
-                        if arguments["--core"]:
-                            obtainCoincidencesCoRe(_file,_tag,outfile,rate)
-                        else:
-                            try:
-                                obtainCoincidences(_file,_tag,outfile,rate)
-                                print('')
-                            except: print('Was not able to calculate coincidence')
+                        tasks.append((_file,_tag))
     else:
         for _p in proc:
             for _loc in proc[_p]:
@@ -91,125 +194,182 @@ def coincidenceMap():
                     if 'NA' in _tag:
                         print('Skipping ',_tag)
                         continue
-                    if arguments["--core"]:
-                        rate = rates[_tag][0]
-                        obtainCoincidencesCoRe(_file,_tag,outfile,rate)
-                    else:
-                        print("*************************** ",_tag)
-                        try:
-                            rate = rates[_tag][0]
-                            obtainCoincidences(_file,_tag,outfile,rate)
-                            print('')
-                        except: print('Was not able to calculate coincidence')
+                    tasks.append((_file,_tag))
+    return tasks
 
-    print('Saving outfile:',_str)
-    outfile.Close()
+def pairTables():
+
+    # writes the prompt-delayed pair table of each merged file (run after -M)
+    # so that --coincidences can be rerun without rereading the ntuples
+    if arguments['--core']:
+        print('Pair tables are not available for the combined reconstruction')
+        return 0
+    grid = cutGrid()
+    for _file,_tag in coincidenceTasks():
+        if not os.path.exists(_file):
+            print('Skipping %s, %s not found'%(_tag,_file))
+            continue
+        print('Writing pair table for %s from %s'%(_tag,_file))
+        writePairTable(_file,_tag,grid)
     return 0
 
-def obtainCoincidences(file,_tag,outfile,rate):
+def coincidenceShard(task):
+
+    # worker for coincidenceMap(): maps the coincidences of one tag into its
+    # own shard file. Errors are returned rather than raised so that one
+    # failing tag does not stop the others.
+    _file,_tag,shard,skip,identity = task
+    try:
+        outfile = TFile(shard,"RECREATE")
+        rate = rates[_tag][0]
+        if arguments['--core']:
+            obtainCoincidencesCoRe(_file,_tag,outfile,rate)
+        else:
+            obtainCoincidences(_file,_tag,outfile,rate,skip,identity)
+        outfile.Close()
+    except Exception:
+        return _tag,shard,traceback.format_exc()
+    return _tag,shard,None
+
+def mergeShards(shards,outfile):
+
+    # copies the latest cycle of every map in each shard into the results
+    # file, replacing any map of the same name, then removes the shard
+    for shard in shards:
+        shardfile = TFile(shard)
+        names = []
+        for key in shardfile.GetListOfKeys():
+            if key.GetName() not in names:
+                names.append(key.GetName())
+        for name in names:
+            obj = shardfile.Get(name)
+            outfile.cd()
+            gDirectory.Delete("%s;*"%(name))
+            obj.Write()
+        shardfile.Close()
+        os.remove(shard)
+    return 0
+
+def obtainCoincidences(file,_tag,outfile,rate,skip=(),identity=None):
 
     # Performs the coincidence evaluation on the 
     # FRED root files
     # called by coincidenceMap()
+    # maps whose mapKey() is in skip are already up to date and not redone;
+    # with the identity of the input file, the counts of the cells recorded
+    # for it are reused and only the others are counted
+    if not arguments['--drawScan']:
+        return fillCoincidences(file,_tag,outfile,rate,skip,None,identity)
+    # the friend tree of --drawScan is written to a private temporary
+    # directory, so that concurrent runs and workers do not share it, which
+    # is removed however the scan ends
+    with tempfile.TemporaryDirectory(prefix='cobraa_friend_') as scratch:
+        return fillCoincidences(file,_tag,outfile,rate,skip,scratch)
+
+def fillCoincidences(file,_tag,outfile,rate,skip,scratch,identity=None):
+
+    # fills and writes the maps of a tag, with the --drawScan friend tree
+    # in the scratch directory
     start_time = time.time()
-    recofile = TFile(file)
-    print('Reading', file)
     hist = {}
+    grid = cutGrid()
+    # the cells recorded for the input file, and those still to be counted
+    record,only,added = None,None,[]
+    if identity is not None and not arguments['--drawScan']:
+        record = loadCellCounts(_tag,identity)
+        only = missingCells(record,grid,skip)
+        print('Counting %d cells of %s, %d recorded'%(sum(len(_c) for _c in only.values()),_tag,len(record['rows']['count'])))
+    recorded = only=={} and record['totalEvents'] is not None
+    # use the pair table of the tag if there is one covering the grid
+    table = None
+    if not arguments['--drawScan'] and not recorded:
+        table = loadPairTable(file,_tag,grid)
+    if recorded:
+        # every cell is recorded, the input is not read
+        totalEvents = record['totalEvents']
+        scan = iter(())
+    elif table is not None:
+        print('Reading pair table for', _tag)
+        pairs,totalEvents,triggers = table
+        scan = coincidenceCounts(pairs,grid,skip,triggers,only)
+    else:
+        recofile = TFile(file)
+        print('Reading', file)
 
-    # check the root file is valid    
-    '''try:
-        runSummary = recofile.Get('runSummary')
-        runEntries = runSummary.GetEntries()
+        # check the root file is valid    
+        '''try:
+            runSummary = recofile.Get('runSummary')
+            runEntries = runSummary.GetEntries()
         
-    except:
-        print('File',file,'did not have run associated with it. Returning empty histogram.')
-        return -1
-
-    totalEvents  = 0
-    for i in range(runEntries):
-        runSummary.GetEntry(i)
-        totalEvents += runSummary.nEvents
-    print(totalEvents)'''
-
-    # get only required branches from data tree for speed
-    data         = recofile.Get('output')
-    dataEntries  = data.GetEntries()
-    totalEvents = dataEntries
-    print("************************************ ",dataEntries)
-    data.SetBranchStatus('*',0)
-    data.SetBranchStatus('%s_Bonsai'%(energyEstimator),1)#data.SetBranchStatus('%s'%(energyEstimator),1)
-    ##data.SetBranchStatus('%s_prev'%(energyEstimator),1)
-    data.SetBranchStatus('closestPMT_Bonsai',1)#data.SetBranchStatus('closestPMT',1)
-    data.SetBranchStatus('nhits',1)#inner_hit',1)
-    ##data.SetBranchStatus('nhits_prev',1)#inner_hit_prev',1)
-    #data.SetBranchStatus('veto_hit',1)
-    #data.SetBranchStatus('veto_hit_prev',1)
-    data.SetBranchStatus('positionGoodness_Bonsai',1)#good_pos',1)
-    ##data.SetBranchStatus('positionGoodness_Bonsai_prev',1)#good_pos_prev',1)
-    ##data.SetBranchStatus('dt_prev_us',1)
-    data.SetBranchStatus('timestamp',1)
-    ##data.SetBranchStatus('gtid',1)
-    ##if not arguments['--core']:
-    ##    data.SetBranchStatus('closestPMT_prev',1)
-    ##    data.SetBranchStatus('drPrevr',1)
-
-    newf = TFile('newfile.root',"RECREATE")
-    newtree = TTree("newtree","newtree")#data.CloneTree(0)
-
-
-    n9_prev_val  = np.array([0], dtype=np.float64)
-    positionGoodness_prev_val = np.array([0], dtype=np.float64)
-    nhits_prev_val = np.array([0], dtype=np.float64)
-    closestPMT_prev_val = np.array([0], dtype=np.float64)
-    dt_prev_us_val = np.array([0], dtype=np.float64)
-    drPrevr_val = np.array([0], dtype=np.float64)
-
-    newtree.Branch('n9_prev',n9_prev_val,'n9_prev/D')
-    newtree.Branch('positionGoodness_prev',positionGoodness_prev_val,'positionGoodness_prev/D')
-    newtree.Branch('nhits_prev',nhits_prev_val,'nhits_prev/D')
-    newtree.Branch('closestPMT_prev',closestPMT_prev_val,'closestPMT_prev/D')
-    newtree.Branch('dt_prev_us',dt_prev_us_val,'dt_prev_us/D')
-    newtree.Branch('drPrevr',drPrevr_val,'drPrevr/D')
-
-    for i in range(0,totalEvents):
-        data.GetEntry(i)
-
-        if i==0:
-            n9_prev_val[0]=-999999
-            positionGoodness_prev_val[0]=-999999
-            nhits_prev_val[0]=-999999
-            closestPMT_prev_val[0]=-999999
-            dt_prev_us_val[0]=-999999
-            drPrevr_val[0]=99999999999
-
+        except:
+            print('File',file,'did not have run associated with it. Returning empty histogram.')
+            return -1
+
+        totalEvents  = 0
+        for i in range(runEntries):
+            runSummary.GetEntry(i)
+            totalEvents += runSummary.nEvents
+        print(totalEvents)'''
+
+        # get only required branches from data tree for speed
+        data         = recofile.Get('output')
+        dataEntries  = data.GetEntries()
+        totalEvents = dataEntries
+        print("************************************ ",dataEntries)
+        data.SetBranchStatus('*',0)
+        data.SetBranchStatus('%s_Bonsai'%(energyEstimator),1)#data.SetBranchStatus('%s'%(energyEstimator),1)
+        ##data.SetBranchStatus('%s_prev'%(energyEstimator),1)
+        data.SetBranchStatus('closestPMT_Bonsai',1)#data.SetBranchStatus('closestPMT',1)
+        data.SetBranchStatus('nhits',1)#inner_hit',1)
+        ##data.SetBranchStatus('nhits_prev',1)#inner_hit_prev',1)
+        #data.SetBranchStatus('veto_hit',1)
+        #data.SetBranchStatus('veto_hit_prev',1)
+        data.SetBranchStatus('positionGoodness_Bonsai',1)#good_pos',1)
+        ##data.SetBranchStatus('positionGoodness_Bonsai_prev',1)#good_pos_prev',1)
+        ##data.SetBranchStatus('dt_prev_us',1)
+        data.SetBranchStatus('timestamp',1)
+        ##data.SetBranchStatus('gtid',1)
+        ##if not arguments['--core']:
+        ##    data.SetBranchStatus('closestPMT_prev',1)
+        ##    data.SetBranchStatus('drPrevr',1)
+
+        # the previous-event quantities are built from the branches read in
+        # bulk (x/y/z_Bonsai are read explicitly; they are disabled on the data tree)
+        if arguments['--drawScan']:
+            # per-cell TTree::Draw scan over the data tree and a friend tree
+            # of the previous-event columns
+            cols = readColumns(file,coincidenceBranches)
+            prev = previousEventColumns(cols)
+            del cols
+            friendfile = os.path.join(scratch,'friend_%s.root'%(_tag))
+            writeFriendTree(prev,friendfile)
+            del prev
+            newf = TFile(friendfile)
+            newtree = newf.Get('newtree')
+            data.AddFriend(newtree)
+            scan = drawCoincidenceCounts(data,grid,skip)
+        elif arguments['--timeline']:
+            # pair every delayed candidate with all the triggers within dT
+            # and veto against the full trigger timeline
+            pairs,_,triggers = streamTimelinePairs(file,grid)
+            scan = coincidenceCounts(pairs,grid,skip,triggers,only)
         else:
-            n9_prev_val[0]=prev_n9
-            positionGoodness_prev_val[0]=prev_pg
-            nhits_prev_val[0]=prev_nhits
-            closestPMT_prev_val[0]=prev_cp
-            dt_prev_us_val[0]=data.timestamp-prev_t
-            dx=data.x_Bonsai-prev_x;dy=data.y_Bonsai-prev_y;dz=data.z_Bonsai-prev_z
-            drPrevr_val[0]=np.sqrt(dx*dx+dy*dy+dz*dz)
-
-        prev_n9=data.n9_Bonsai
-        prev_pg=data.positionGoodness_Bonsai
-        prev_nhits=data.nhits
-        prev_cp=data.closestPMT_Bonsai
-        prev_t=data.timestamp
-        prev_x=data.x_Bonsai
-        prev_y=data.y_Bonsai
-        prev_z=data.z_Bonsai
-        newtree.Fill()
-
-        #print(i,data.nhits,nhits_prev_val[i],drPrevr_val[i])
-    #print(closestPMT_prev_val)
-    data.AddFriend(newtree)
+            # extract the candidate pairs once, streaming the file in chunks,
+            # and count every cell from them
+            pairs,_ = streamPairs(file,grid)
+            scan = coincidenceCounts(pairs,grid,skip,None,only)
+    if record is not None:
+        record['totalEvents'] = totalEvents
+        scan = mergeCellCounts(record,scan,grid,skip,only,added)
+    outfile.cd()
     
     # now we can evaluate the event coincidence
     # and scale down to the day rate
-    counter=0
-    for delayed_nxcut,dTcut,maxEp,gcut,dRcut in product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(minEpmax,rangeEpmax,binwidthEpmax),drange(gmin,rangeGmax,binwidthG),drange(dRmin,rangedRmax,binwidthdR)):
-        tag = _tag+'_delayed%s_%d_%dus_maxEp%d_%d'%(energyEstimator,delayed_nxcut,dTcut,maxEp,gcut*10)
+    ndays = livetimeDays(_tag,totalEvents,rate)
+    ncells = sum(len(scanCells(delayed_nxcut,grid)) for delayed_nxcut,dTcut,maxEp,gcut,dRcut in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g'],grid['dR']) if mapKey(delayed_nxcut,dTcut,maxEp,gcut) not in skip)
+    progress = startProgress(_tag,ncells)
+    for (delayed_nxcut,dTcut,maxEp,gcut,dRcut),cells,counts in scan:
+        tag = _tag+'_delayed'+mapKey(delayed_nxcut,dTcut,maxEp,gcut)
         histname = "hist_%s;1"%(tag)
         gDirectory.Delete("%s"%(histname));
         
@@ -219,19 +379,77 @@ def obtainCoincidences(file,_tag,outfile,rate):
         hist[tag].SetZTitle('coincidences per day')
         hist[tag].Reset()
         
-        for fidcut,prompt_nxcut in product(drange(minFid,rangeFidmax,binwidthFid),drange(minNXprompt,rangeNXpmax,binwidthNX)):
-            if arguments['--positiveScan']:
-                if prompt_nxcut>delayed_nxcut:
-                    continue
-            elif arguments['--negativeScan']:
-                if prompt_nxcut<delayed_nxcut:
-                    continue
-
+        coincidences,coincidenceErrs = coincidenceRates(counts,totalEvents)
+        records = []
+        for (fidcut,prompt_nxcut),count,coincidence,coincidenceErr in zip(cells,counts,coincidences,coincidenceErrs):
+            
+            detail(2,'** ',delayed_nxcut,dTcut,maxEp,gcut,dRcut,fidcut,prompt_nxcut,count)
+            if arguments['--cellLog']:
+                records.append({'tag':_tag,'delayed':delayed_nxcut,'dT':dTcut,'maxEp':maxEp,'g':gcut,'dR':dRcut,\
+                                'fid':fidcut,'prompt':prompt_nxcut,'count':int(count),'perDay':float(coincidence)/ndays,\
+                                'perDayErr':float(coincidenceErr)/ndays})
+            hist[tag].Fill(fidcut,prompt_nxcut,float(coincidence))
+            errorbin = hist[tag].FindBin(fidcut,prompt_nxcut)
+            hist[tag].SetBinError(errorbin, coincidenceErr)
             
-            print('** ',counter,' ** ',delayed_nxcut,dTcut,maxEp,gcut,dRcut,fidcut,prompt_nxcut)
-            counter+=1    
+            # end loop over prompt nx cuts
+            # end loop over fiducial cuts
+        # end loop over delayed nx cuts and dT time between triggers
+
+        # scale no. of coincidences to day rate
+        hist[tag].Scale(1./float(ndays))
+        
+        outfile.cd()
+        hist[tag].Write()
+        del hist[tag]
+        logCells(records)
+        detail(1,'%s: %d cells, %d coincidences'%(tag,len(cells),sum(counts)))
+        advanceProgress(progress,len(cells))
+    # end loop over delayed nx, dT and dR cuts
+    finishProgress(progress)
+    if added:
+        saveCellCounts(_tag,record,added)
+    if table is None and not recorded:
+        recofile.Close()
+        if arguments['--drawScan']:
+            newf.Close()
+            del newtree
+        del data
+    print("--- %s seconds ---" % (time.time() - start_time))
+    return
+
+def coincidenceRates(counts,totalEvents):
+
+    # the coincidences of each cell and their errors
+    # Poisson 95% UCL for zero if no coincidences are found
+    # alternative since this is really a binomial distribution:
+    # poisson approximation to binomial: -log(0.05)/totalEvents 
+    # gives a lower value for the UCL so adopting the most cautious approach here
+    # ref https://www.hilarispublisher.com/open-access/on-finding-the-upper-confidence-limit-for-a-binomial-proportion-when-zero-successes-are-observed-2155-6180-1000338.pdf
+    counts = np.asarray(counts,dtype=float)
+    coincidences = np.where(counts==0,3.6889/totalEvents,counts)
+    coincidenceErrs = 1/float(totalEvents)*sqrt(coincidences*(1-coincidences/float(totalEvents)))
+    return coincidences,coincidenceErrs
+
+def livetimeDays(_tag,totalEvents,rate):
+
+    # the days of data simulated for a tag, to scale coincidences to a day rate
+    if 'singles' in _tag:
+        return totalEvents/float(singlespersec)/86400.
+    return totalEvents/rate/86400.
+
+def drawCoincidenceCounts(data,grid,skip=()):
+
+    # yields the same cells and counts as coincidenceCounts() by running
+    # TTree::Draw over the whole tree for each cell (slow, kept to validate
+    # the pair engine). Needs the previous-event friend tree.
+    for delayed_nxcut,dTcut,maxEp,gcut,dRcut in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g'],grid['dR']):
+        if mapKey(delayed_nxcut,dTcut,maxEp,gcut) in skip:
+            continue
+        cells = scanCells(delayed_nxcut,grid)
+        counts = []
+        for fidcut,prompt_nxcut in cells:
             # define the prompt/delayed/coincidence cuts
-            coincidences=0
             delayedtrigger  = "closestPMT_Bonsai/1000.>%f"%(fidcut)#"closestPMT/1000.>%f"%(fidcut)
             delayedtrigger  += "&& positionGoodness_Bonsai>%f " %(gcut)#"&& good_pos>%f " %(gcut)
             delayedtrigger  += "&& nhits>3"#"&& inner_hit > 10 &&  veto_hit < 4"
@@ -257,37 +475,8 @@ def obtainCoincidences(file,_tag,outfile,rate):
             dtlast = t_prompt[1:-1]-t_delayed[:-2] # time since the last interaction in the previous event pair
             # do the multiplicity cut (for fast neutron multiplicity)
             # check for coincidences immediately before and after pair
-            coincidences = np.count_nonzero((dtnext>dTcut) & (dtlast>dTcut))
-            # Poisson 95% UCL for zero if no coincidences are found
-            if coincidences == 0:
-                coincidences = 3.6889/totalEvents 
-            # alternative since this is really a binomial distribution:
-            # poisson approximation to binomial: -log(0.05)/totalEvents 
-            # gives a lower value for the UCL so adopting the most cautious approach here
-            # ref https://www.hilarispublisher.com/open-access/on-finding-the-upper-confidence-limit-for-a-binomial-proportion-when-zero-successes-are-observed-2155-6180-1000338.pdf
-            coincidenceErr = 1/float(totalEvents)*sqrt(coincidences*(1-coincidences/float(totalEvents)))
-            hist[tag].Fill(fidcut,prompt_nxcut,float(coincidences))
-            errorbin = hist[tag].FindBin(fidcut,prompt_nxcut)
-            hist[tag].SetBinError(errorbin, coincidenceErr)
-            
-            # end loop over prompt nx cuts
-            # end loop over fiducial cuts
-        # end loop over delayed nx cuts and dT time between triggers
-
-        # scale no. of coincidences to day rate
-        ndays = totalEvents/rate/86400.
-        if 'singles' in _tag:
-            ndays = totalEvents/float(singlespersec)/86400.
-        hist[tag].Scale(1./float(ndays))
-        
-        outfile.cd()
-        hist[tag].Write()
-        del hist[tag]
-    # end loop over delayed nx, dT and dR cuts
-    recofile.Close()
-    del data,newtree
-    print("--- %s seconds ---" % (time.time() - start_time))
-    return
+            counts.append(np.count_nonzero((dtnext>dTcut) & (dtlast>dTcut)))
+        yield (delayed_nxcut,dTcut,maxEp,gcut,dRcut),cells,counts
 
 def obtainCoincidencesCoRe(file,_tag,outfile,rate):
 
@@ -0,0 +1,138 @@
+import json
+from ROOT import RDataFrame,RDF,TFile
+from .globals import *
+
+# Columnar access to the merged ntuples. Branches are read in bulk into
+# numpy arrays so that per-event quantities can be built with array
+# arithmetic instead of a python loop over the TTree entries. If -M
+# --columnar has written an uncompressed copy of the branches next to the
+# merged file, the readers return memory-mapped views of it instead.
+
+# branches of the 'output' tree used by the coincidence evaluation
+coincidenceBranches = ['%s_Bonsai'%(energyEstimator),'x_Bonsai','y_Bonsai','z_Bonsai',\
+'timestamp','closestPMT_Bonsai','positionGoodness_Bonsai','nhits']
+
+def columnarDir(file):
+
+    # merged_<tag>.root -> merged_<tag>_columns/
+    return os.path.splitext(file)[0]+'_columns'
+
+def writeColumnar(file,branches,treename='output'):
+
+    # writes each branch of the tree as a float64 .npy file, streaming the
+    # tree in chunks, plus a columns.json record of the source file
+    outdir = columnarDir(file)
+    os.makedirs(outdir,exist_ok=True)
+    recofile = TFile(file)
+    nevents = recofile.Get(treename).GetEntries()
+    recofile.Close()
+    arrays = {_b:np.lib.format.open_memmap(os.path.join(outdir,'%s.npy'%(_b)),mode='w+',dtype=np.float64,shape=(nevents,)) for _b in branches}
+    start = 0
+    for cols in iterateColumns(file,branches,treename,columnar=False):
+        n = len(cols[branches[0]])
+        for _b in branches:
+            arrays[_b][start:start+n] = cols[_b]
+        start += n
+    for _b in branches:
+        arrays[_b].flush()
+    del arrays
+    st = os.stat(file)
+    meta = {'size':st.st_size,'mtime':st.st_mtime,'tree':treename,'entries':nevents,'branches':list(branches)}
+    with open(os.path.join(outdir,'columns.json'),'w') as f:
+        json.dump(meta,f,indent=1)
+    print('Wrote columnar copy of %d events to %s'%(nevents,outdir))
+    return 0
+
+def columnarCopy(file,branches,treename='output'):
+
+    # memory-mapped views of the requested branches, or None if there is no
+    # columnar copy of them for the current version of the merged file
+    metafile = os.path.join(columnarDir(file),'columns.json')
+    if not os.path.exists(metafile) or not os.path.exists(file):
+        return None
+    with open(metafile) as f:
+        meta = json.load(f)
+    st = os.stat(file)
+    if meta['size']!=st.st_size or meta['mtime']!=st.st_mtime or meta['tree']!=treename:
+        return None
+    if not set(branches)<=set(meta['branches']):
+        return None
+    return {_b:np.load(os.path.join(columnarDir(file),'%s.npy'%(_b)),mmap_mode='r') for _b in branches}
+
+def readColumns(file,branches,treename='output'):
+
+    # reads the requested branches of a tree into a dict of float64 arrays
+    copy = columnarCopy(file,branches,treename)
+    if copy is not None:
+        return copy
+    cols = RDataFrame(treename,file).AsNumpy(list(branches))
+    return {_b:np.ascontiguousarray(cols[_b],dtype=np.float64) for _b in branches}
+
+def iterateColumns(file,branches,treename='output',columnar=True):
+
+    # yields the requested branches in consecutive chunks of events, so that
+    # files larger than memory can be streamed. The chunk size follows the
+    # --chunkMB budget for the float64 columns of a chunk.
+    branches = list(branches)
+    chunk = max(1,int(float(arguments['--chunkMB'])*2**20/(8*len(branches))))
+    copy = columnarCopy(file,branches,treename) if columnar else None
+    if copy is not None:
+        nevents = len(copy[branches[0]])
+        for start in range(0,nevents,chunk):
+            yield {_b:copy[_b][start:start+chunk] for _b in branches}
+        return
+    recofile = TFile(file)
+    tree = recofile.Get(treename)
+    nevents = tree.GetEntries()
+    tree.SetBranchStatus('*',0)
+    for _b in branches:
+        tree.SetBranchStatus(_b,1)
+    tree.SetEstimate(min(chunk,nevents)+1)
+    for start in range(0,nevents,chunk):
+        cols = {}
+        # TTree::Draw returns up to four columns at a time
+        for i in range(0,len(branches),4):
+            group = branches[i:i+4]
+            n = tree.Draw(':'.join(group),'','goff',chunk,start)
+            for j,_b in enumerate(group):
+                cols[_b] = np.array(np.ndarray((n),'d',getattr(tree,'GetV%d'%(j+1))()))
+        yield cols
+    recofile.Close()
+
+def previousEventColumns(cols,last=None):
+
+    # returns, for every event, the quantities of the event before it in the
+    # tree (the n9_prev/dt_prev_us/drPrevr friend branches). The first event
+    # has no predecessor and gets the same sentinel values as the old loop,
+    # unless the last event of the previous chunk is passed in last.
+    if last is not None:
+        cols = {_b:np.concatenate(([last[_b]],cols[_b])) for _b in cols}
+        return {_name:_v[1:] for _name,_v in previousEventColumns(cols).items()}
+    nevents = len(cols['timestamp'])
+    prev = {}
+    for _name,_branch in (('%s_prev'%(energyEstimator),'%s_Bonsai'%(energyEstimator)),\
+                          ('positionGoodness_prev','positionGoodness_Bonsai'),\
+                          ('nhits_prev','nhits'),\
+                          ('closestPMT_prev','closestPMT_Bonsai')):
+        prev[_name] = np.empty(nevents)
+        prev[_name][:1] = -999999
+        prev[_name][1:] = cols[_branch][:-1]
+
+    prev['dt_prev_us'] = np.empty(nevents)
+    prev['dt_prev_us'][:1] = -999999
+    prev['dt_prev_us'][1:] = np.diff(cols['timestamp'])
+
+    prev['drPrevr'] = np.empty(nevents)
+    prev['drPrevr'][:1] = 99999999999
+    dx = np.diff(cols['x_Bonsai'])
+    dy = np.diff(cols['y_Bonsai'])
+    dz = np.diff(cols['z_Bonsai'])
+    prev['drPrevr'][1:] = np.sqrt(dx*dx+dy*dy+dz*dz)
+    return prev
+
+def writeFriendTree(prev,file,treename='newtree'):
+
+    # writes the previous-event columns to a tree which can be added as a
+    # friend of the data tree for TTree::Draw based cuts
+    RDF.FromNumpy(prev).Snapshot(treename,file)
+    return 0
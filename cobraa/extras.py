@@ -2,6 +2,7 @@
 from ROOT import TFile,TH1D,TCanvas,THStack,TLegend,gPad,TColor
 import pandas as pd
 from .globals import *
+from .columns import *
 from pathlib import Path
 
 # This is a place for additional tools which can be useful in the 
@@ -25,6 +26,7 @@ def triggers():
     triggerdata = open("triggerdata.txt","w+")
     simsmissing = open("simsmissing.txt","w+")
     simsrequired = open("simsrequired.txt","w+")
+    taglist=[]
     loclist=[]
     decaylist=[]
     isolist=[]
@@ -72,48 +74,39 @@ def triggers():
                 _file = _file.replace(" ","")
                 if os.path.isfile(_file):
                     print(_tag," from ",_file)
-                    outputfile = TFile(_file)
-                    # check the root file is valid
-            
-                    #runSummary = outputfile.Get('runSummary')
-                    #Entries = runSummary.GetEntries()
-                    #totalEvents = 0
-                    #for i in range(Entries):
-                    #    runSummary.GetEntry(i)
-                    #    totalEvents += runSummary.nEvents
-                    data = outputfile.Get('output')
+                    # histogram the number of hit PMTs per event, streaming
+                    # the file in chunks and merging the counts
+                    nhitsCounts = np.zeros(120,dtype=np.int64)
+                    totalevents = 0
+                    for cols in iterateColumns(_file,['nhits']):
+                        nhits = cols['nhits'].astype(np.int64)
+                        totalevents += len(nhits)
+                        counts = np.bincount(nhits,minlength=len(nhitsCounts))
+                        if len(counts)>len(nhitsCounts):
+                            nhitsCounts = np.append(nhitsCounts,np.zeros(len(counts)-len(nhitsCounts),dtype=np.int64))
+                        nhitsCounts += counts
 
-                    totalevents = data.GetEntries()#round(data.GetEntries()/50000)*50000
-                    totalhitevents = data.Draw("","nhits>0")
+                    totalhitevents = nhitsCounts[1:].sum()
                     detectioneff = totalhitevents/totalevents
                     detectionrate = detectioneff*rates[_tag][0]
-                    hitevents1 = data.Draw("","nhits==1")
-                    hitevents2 = data.Draw("","nhits==2")
-                    hitevents3 = data.Draw("","nhits==3")
-                    hitevents4 = data.Draw("","nhits==4")
-                    hitevents5 = data.Draw("","nhits==5")
-                    hitevents6 = data.Draw("","nhits==6")
-                    hitevents7 = data.Draw("","nhits==7")
-                    hitevents8 = data.Draw("","nhits==8")
-                    hitevents9 = data.Draw("","nhits==9")
-                    hitevents10 = data.Draw("","nhits==10")
-                    hitevents4plus = data.Draw("","nhits>3")
+                    hitevents1 = nhitsCounts[1]
+                    hitevents2 = nhitsCounts[2]
+                    hitevents3 = nhitsCounts[3]
+                    hitevents4 = nhitsCounts[4]
+                    hitevents5 = nhitsCounts[5]
+                    hitevents6 = nhitsCounts[6]
+                    hitevents7 = nhitsCounts[7]
+                    hitevents8 = nhitsCounts[8]
+                    hitevents9 = nhitsCounts[9]
+                    hitevents10 = nhitsCounts[10]
+                    hitevents4plus = nhitsCounts[4:].sum()
 
                     hitevents4plusrate = hitevents4plus/totalevents*rates[_tag][0]
                     hitevents4plusratelist.append(hitevents4plusrate)
-                    #hitevents4plus = data.Draw("","nhits>3")
-                    pmttriggers = [0]*120
-                    totalpmtshit = 0
-                    totalpmtshit4plus = 0
-                    for i in range(totalevents):
-                        data.GetEntry(i)
-                        if data.nhits > 0:
-                            #pmttriggers = data.nhits
-                            if data.nhits>90: print(data.nhits)
-                            pmttriggers[data.nhits]+=data.nhits
-                            totalpmtshit += data.nhits
-                            if data.nhits > 3:
-                                totalpmtshit4plus += data.nhits
+                    # total PMT hits from events with each number of hits
+                    pmttriggers = nhitsCounts*np.arange(len(nhitsCounts))
+                    totalpmtshit = pmttriggers[1:].sum()
+                    totalpmtshit4plus = pmttriggers[4:].sum()
 
                     print(pmttriggers[0], pmttriggers[1], pmttriggers[2], pmttriggers[3], pmttriggers[4], pmttriggers[5], pmttriggers[6])
                     pmttriggerrate = []
@@ -126,6 +119,7 @@ def triggers():
                     singlesrate = 0.0 #singles/totalEvents*rates[_tag][0]
                     rate = rates[_tag][0]
                     simtime = totalevents/rates[_tag][0]/60./60./24.
+                    taglist.append(_tag)
                     loclist.append(_loc)
                     decaylist.append(_p)
                     isolist.append(_element)
@@ -193,6 +187,8 @@ def triggers():
     df = df.replace("singles","Radioactivity")
     df = df.replace("SINGLES","All")
     df = df.replace("_hartlepool","",regex=True)
+    # the event type, unformatted, for --plan
+    df["{Tag}"] = taglist
     df = df.sort_values(by=["{Component}","{Origin}","{Isotope}"])
     df. to_csv('button_background_triggers%s.csv'%(additionalString), index=False)
     # convert to LaTex and do some formatting to work with siunitx
@@ -221,24 +217,21 @@ def backgrounds():
                 _file = _file.replace(" ","")
                 if 'hartlepool' in _tag or 'heysham' in _tag or 'mono' in _tag or 'boulby' in _tag:
                     continue
-                fredfile = TFile(_file)
                 # check the root file is valid
-                totalEvents = 0
                 try:
-                    runSummary = fredfile.Get('runSummary')
-                    Entries = runSummary.GetEntries()
-                    for i in range(Entries):
-                        runSummary.GetEntry(i)
-                        totalEvents += runSummary.nEvents
-                    data = fredfile.Get('data')
-
+                    cols = readColumns(_file,['%s_Bonsai'%(energyEstimator),'closestPMT_Bonsai'])
                 except:
                     print("cannot open ",_tag,"from ",_file)
                     continue
                 print("opening ",_tag,"from ",_file)
+                totalEvents = len(cols['closestPMT_Bonsai'])
+                if totalEvents==0:
+                    continue
+                triggered = cols['%s_Bonsai'%(energyEstimator)]>0
+                fid = cols['closestPMT_Bonsai'][triggered]/1000.
 
                 for fidcut in drange(minFid,rangeFidmax,binwidthFid):
-                    nevts = data.Draw("","n9_Consai>0 && closestPMT_Bonsai/1000.>%f"%(fidcut),"goff")
+                    nevts = np.count_nonzero(fid>float('%f'%(fidcut)))
                     rate = nevts/totalEvents*rates[_tag][0]
                     if 'PMT' in _tag:
                         hPMT.Fill(fidcut,rate)
@@ -1,7 +1,15 @@
 from .load import *
 from .globals import *
+from .columns import *
+from .planning import *
+from .runner import *
+from .cache import *
 from ROOT import gROOT, TFile
+from glob import glob
+import hashlib
+import json
 import os
+import re
 
 # The purpose of this class is to handle the input/ouput operations of
 # Cobraa. This includes creating directories and files for the different
@@ -30,6 +38,64 @@ and using --force.        \n'''%(directory))
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+def writeIfChanged(file,content,mode=None):
+
+    # writes the content to the file unless the file already holds it, so
+    # that regenerating leaves the unchanged files (and their mtimes) alone.
+    # Returns whether the file was written.
+    if os.path.exists(file):
+        with open(file) as f:
+            if f.read()==content:
+                return False
+    with open(file+'.tmp','w') as f:
+        f.write(content)
+    if mode is not None:
+        os.chmod(file+'.tmp',mode)
+    os.replace(file+'.tmp',file)
+    return True
+
+def scriptFingerprint(script):
+
+    # sha1 of a run script and of the macros it reads, which together fix
+    # the configuration of its events. The evts_* macros only set the
+    # number of events of a run, so runs made with another number are kept.
+    sha = hashlib.sha1()
+    with open(script) as f:
+        text = f.read()
+    sha.update(text.encode())
+    for macro in re.findall(r'\S+\.mac\b',text):
+        if os.path.basename(macro).startswith('evts_') or not os.path.exists(macro):
+            continue
+        with open(macro,'rb') as f:
+            sha.update(macro.encode()+b'\0'+f.read())
+    return sha.hexdigest()
+
+def refreshOutputs(runs):
+
+    # compares the fingerprint of the configuration of each event type with
+    # the one of its existing outputs. The outputs of a changed event type
+    # are cleared with --force, or reported; the others are left alone.
+    fingerprintfile = f"job/fingerprints{additionalString}.json".replace(" ","")
+    fingerprints = loadCache(fingerprintfile)
+    stale = []
+    for _tag,script in dict.fromkeys((_r[0],_r[1]) for _r in runs):
+        fingerprint = scriptFingerprint(script)
+        if fingerprints.get(_tag,fingerprint)!=fingerprint:
+            if not arguments['--force']:
+                stale.append(_tag)
+                continue
+            print('The configuration of %s changed, clearing its outputs'%(_tag))
+            for base in ('raw_root_files','reconstructed_root_files','log'):
+                testCreateDirectory(f"{base}{additionalString}/{_tag}".replace(" ",""))
+            for marker in glob(f"job/done{additionalString}/{_tag}_[0-9]*.done".replace(" ","")):
+                if re.fullmatch(r'\d+',os.path.basename(marker)[len(_tag)+1:-5]):
+                    os.remove(marker)
+        fingerprints[_tag] = fingerprint
+    writeIfChanged(fingerprintfile,json.dumps(fingerprints,indent=1,sort_keys=True))
+    if stale:
+        print('The configuration of %d event types changed since their outputs were made (%s); rerun -j with --force to clear their outputs'%(len(stale),', '.join(stale)))
+    return stale
+
 def generateMacros():
 
     # Writes the macros for each element (_element) of each physical process (_p)
@@ -37,7 +103,8 @@ def generateMacros():
     
     # Calls macroGenerator(), which provides the macro content 
    
-    testCreateDirectoryIfNotExist("mac")
+    # the macros are only rewritten where their content changes
+    os.makedirs("mac",exist_ok=True)
 
     # write the macros for each type of event to be generated
     # and its location in the detector
@@ -48,129 +115,59 @@ def generateMacros():
                     macdir="mac/%s_%s_%s"%(_element,_loc,_p)
                     macdir=macdir.replace(" ","")
                     #print(macdir)
-                    testCreateDirectory(macdir)
+                    os.makedirs(macdir,exist_ok=True)
 
                     generator,detectorvolume = macroGenerator(_loc,_element,_p,nruns) 
                     _element=_element.replace(" ","")
-                    outfile = open("%s/phys_%s.mac"%(macdir,_element),"w+")
-                    outfile.writelines(generator)
-                    outfile.close
-                    outfile = open("%s/geo_%s.mac"%(macdir,_loc),"w+")
-                    outfile.writelines(detectorvolume)
-                    outfile.close
+                    writeIfChanged("%s/phys_%s.mac"%(macdir,_element),generator)
+                    writeIfChanged("%s/geo_%s.mac"%(macdir,_loc),detectorvolume)
                     #print(_p,_loc,_element)
  
 
     # write the macros for the detector geometry and rat processors
     header,processors,recon,daq = generalMacroGenerator()
-    outfile = open(f"mac/detector_{detectorStr}.mac","w+")
-    outfile.writelines(header)
-    outfile.close
-    outfile = open("mac/process.mac","w+")
-    outfile.writelines(processors)
-    outfile.close
+    writeIfChanged(f"mac/detector_{detectorStr}.mac",header)
+    writeIfChanged("mac/process.mac",processors)
     # temp daq file, remove once button daq is done
-    outfile = open("mac/daq.mac","w+")
-    outfile.writelines(daq)
-    outfile.close
+    writeIfChanged("mac/daq.mac",daq)
     if arguments['--bonsai']:
-        outfile = open("mac/bonsai.mac","w+")
-        outfile.writelines(recon)
-        outfile.close
-        outfile = open("mac/bonsai_proc.mac","w+")
-        outfile.writelines(f"""/rat/proc bonsai
+        writeIfChanged("mac/bonsai.mac",recon)
+        writeIfChanged("mac/bonsai_proc.mac",f"""/rat/proc bonsai
 /rat/proc outntuple""")
-        outfile.close
-    outfile = open("mac/initialize.mac","w+")
-    outfile.writelines(f"/run/initialize")
-    outfile.close
+    writeIfChanged("mac/initialize.mac",f"/run/initialize")
 
     # write the macros for the number of events to be simulated and
     # expected total event rates in the detector (before detector effects)
+    # (from the event plan of --plan where there is one)
     for _k in rates:
         if os.path.isdir(f"mac/{_k}"):
-            _events = int(float(arguments['-e'])*rates[_k][1])
+            _events,_runs = plannedEvents(_k)
             if 'singles' in _k:
-                print("\n\n\n Warning - only %f days of singles events will be simulated!!!!!\n\n\n"%(_events*nsetSingles*nruns/float(singlespersec*86400)))
-                outfile = open(f"mac/evts_singles.mac","w+")
-                outfile.writelines(f"/run/beamOn {_events}")
+                print("\n\n\n Warning - only %f days of singles events will be simulated!!!!!\n\n\n"%(_events*_runs/float(singlespersec*86400)))
+                writeIfChanged(f"mac/evts_singles.mac",f"/run/beamOn {_events}")
             elif 'pn_ibd' in _k or 'A_Z' in _k or 'fast' in _k or 'mono' in _k:
-                outfile = open(f"mac/{_k}/rates_{_k}.mac","w+")
-                outfile.writelines(f"/generator/rate/set {rates[_k][0]}")
-                outfile.close
-                outfile = open(f"mac/{_k}/evts_{_k}.mac","w+")
-                outfile.writelines(f"/run/beamOn {int(_events)}")
-                outfile.close
+                writeIfChanged(f"mac/{_k}/rates_{_k}.mac",f"/generator/rate/set {rates[_k][0]}")
+                writeIfChanged(f"mac/{_k}/evts_{_k}.mac",f"/run/beamOn {int(_events)}")
             else:
-                outfile = open(f"mac/{_k}/rates_{_k}.mac","w+")
-                outfile.writelines(f"/generator/rate/set {rates[_k][0]}")
-                outfile.close
-                outfile = open(f"mac/{_k}/evts_{_k}.mac","w+")
-                outfile.writelines(f"/run/beamOn {int(_events)}")
-                outfile.close
+                writeIfChanged(f"mac/{_k}/rates_{_k}.mac",f"/generator/rate/set {rates[_k][0]}")
+                writeIfChanged(f"mac/{_k}/evts_{_k}.mac",f"/run/beamOn {int(_events)}")
 
 
 
 def generateJobs():
 
+    if duplicateSeeds(localRuns()):
+        return 1
 
-    # Create the directory trees
+    # Create the directory trees (existing outputs are kept, see
+    # refreshOutputs())
     for _p in proc:
         for _loc in proc[_p]:
             for _element in d[_p][_loc]:
-                if arguments['--singles']:
-                    dir = "raw_root_files%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                    dir = dir.replace(" ","")
-                    if arguments['--force']:
-                        print('Using force to recreate dir:',dir)
-                        testCreateDirectory(dir)
-                    else:
-                        testCreateDirectoryIfNotExist(dir)
-                    #if arguments['--core']:
-                        #dir = "raw_root_files%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                    #else:
-                    dir = "reconstructed_root_files%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                    dir = dir.replace(" ","")
-                    if arguments['--force']:
-                        print('Using force to recreate dir:',dir)
-                        testCreateDirectory(dir)
-                    else:
-                       testCreateDirectoryIfNotExist(dir)
-                    dir = "log%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                    dir = dir.replace(" ","")
-                    if arguments['--force']:
-                        print('Using force to recreate dir:',dir)
-                        testCreateDirectory(dir)
-                    else:
-                        testCreateDirectoryIfNotExist(dir)
-
-                else:
-                    if 'pn_ibd' in _p or 'A_Z' in _p or 'FAST' in _p or 'singles' in _p or 'mono' in _p:
-                
-                        dir = "raw_root_files%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                        dir = dir.replace(" ","")
-                        if arguments['--force']:
-                            print('Using force to recreate dir:',dir)
-                            testCreateDirectory(dir)
-                        else:
-                            testCreateDirectoryIfNotExist(dir)
-                        #if arguments['--core']:
-                        #    dir = "raw_root_files%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                        #else:
-                        dir = "reconstructed_root_files%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                        dir = dir.replace(" ","")
-                        if arguments['--force']:
-                            print('Using force to recreate dir:',dir)
-                            testCreateDirectory(dir)
-                        else:
-                           testCreateDirectoryIfNotExist(dir)
-                        dir = "log%s/%s_%s_%s"%(additionalString,_element,_loc,_p)
-                        dir = dir.replace(" ","")
-                        if arguments['--force']:
-                            print('Using force to recreate dir:',dir)
-                            testCreateDirectory(dir)
-                        else:
-                            testCreateDirectoryIfNotExist(dir)
+                if arguments['--singles'] or 'pn_ibd' in _p or 'A_Z' in _p or 'FAST' in _p or 'singles' in _p or 'mono' in _p:
+                    for base in ('raw_root_files','reconstructed_root_files','log'):
+                        dir = "%s%s/%s_%s_%s"%(base,additionalString,_element,_loc,_p)
+                        os.makedirs(dir.replace(" ",""),exist_ok=True)
 
     ratDir      = os.environ['RATROOT']
     butDir      = os.environ['BUTTONDATA']
@@ -182,65 +179,102 @@ def generateJobs():
 
     directory   = os.getcwd()
     dir =  "%s/job"%(directory)
-    if arguments['--force']:
-        print('Using force to recreate dir:',dir)
-        testCreateDirectory(dir)
-    else:
-        testCreateDirectoryIfNotExist(dir)
+    os.makedirs(dir,exist_ok=True)
 
     # write out the scripts to be run
-    # and the jobs which will run the scripts the correct number of times
-    # jobs are set up to run locally by default but can be tailored to 
-    # job submission on a cluster (currently --lassen and --sheff)
+    # and one array job which runs every run of the manifest of runs
+    # the job is set up to run locally by default but can be tailored to 
+    # job submission on a cluster (currently --lassen, --sheffield,
+    # --warwick and --edinburgh)
     singlesscript = f"{dir}/script{additionalString}_singles.sh".replace(" ","")
-    outfile_singlesscript = open(singlesscript, "w+")
-    outfile_singlesscript.writelines(f"""#!/bin/sh
-source {ratDir+'/../../env.sh'} && source {butDir+'/'+experimentStr.lower()+'.sh'} && TMPNAME=$(date +%s%N)  && {experimentStr.lower()} mac/detector_{detectorStr}.mac mac/daq.mac mac/bonsai.mac mac/initialize.mac mac/process.mac mac/bonsai_proc.mac """)
+    singlescontent = (f"""#!/bin/sh
+source {ratDir+'/../../env.sh'} && source {butDir+'/'+experimentStr.lower()+'.sh'} && TMPNAME=${{TMPNAME:-$(date +%s%N)}}  && {experimentStr.lower()} mac/detector_{detectorStr}.mac mac/daq.mac mac/bonsai.mac mac/initialize.mac mac/process.mac mac/bonsai_proc.mac """)
     for _p in proc:
         for _loc in proc[_p]:
             for _element in d[_p][_loc]:
                 _element = _element.replace(" ","")
                 if arguments['--singles']:
                     script = f"{dir}/script{additionalString}_{_element}_{_loc}_{_p}.sh".replace(" ","")
-                    outfile_script = open(script,"w+")
-                    outfile_script.writelines(f"""#!/bin/sh
-source {ratDir+'/../../env.sh'} && source {butDir+'/'+experimentStr.lower()+'.sh'} && TMPNAME=$(date +%s%N)  && {experimentStr.lower()} mac/detector_{detectorStr}.mac mac/daq.mac mac/bonsai.mac mac/initialize.mac mac/process.mac mac/bonsai_proc.mac mac/{_element}_{_loc}_{_p}/phys_{_element}.mac mac/{_element}_{_loc}_{_p}/geo_{_loc}.mac mac/{_element}_{_loc}_{_p}/rates_{_element}_{_loc}_{_p}.mac mac/{_element}_{_loc}_{_p}/evts_{_element}_{_loc}_{_p}.mac -o {filetype}_root_files{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.root -l log{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.log""")
-                    outfile_script.close
-                    os.chmod(script,S_IRWXU)
-                    file = f"{dir}/job{additionalString}_{_element}_{_loc}_{_p}.sh".replace(" ","")
-                    outfile_jobs = open(file,"w+")
-                    jobheader = jobSubmissionCommands(_element,timeJob,file,outFile,errFile,script,arguments,directory)
-                    outfile_jobs.writelines(jobheader)
-
-                    outfile_jobs.close
+                    writeIfChanged(script,f"""#!/bin/sh
+source {ratDir+'/../../env.sh'} && source {butDir+'/'+experimentStr.lower()+'.sh'} && TMPNAME=${{TMPNAME:-$(date +%s%N)}}  && {experimentStr.lower()} mac/detector_{detectorStr}.mac mac/daq.mac mac/bonsai.mac mac/initialize.mac mac/process.mac mac/bonsai_proc.mac mac/{_element}_{_loc}_{_p}/phys_{_element}.mac mac/{_element}_{_loc}_{_p}/geo_{_loc}.mac mac/{_element}_{_loc}_{_p}/rates_{_element}_{_loc}_{_p}.mac mac/{_element}_{_loc}_{_p}/evts_{_element}_{_loc}_{_p}.mac ${{SEED:+-s $SEED}} -o {filetype}_root_files{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.root -l log{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.log""",S_IRWXU)
 
                 else:
 
                     if 'NA' in _p or 'RADIOGENIC' in _p: 
-                        outfile_singlesscript.writelines(f" mac/{_element}_{_loc}_{_p}/phys_{_element}.mac mac/{_element}_{_loc}_{_p}/geo_{_loc}.mac mac/{_element}_{_loc}_{_p}/rates_{_element}_{_loc}_{_p}.mac") 
+                        singlescontent += (f" mac/{_element}_{_loc}_{_p}/phys_{_element}.mac mac/{_element}_{_loc}_{_p}/geo_{_loc}.mac mac/{_element}_{_loc}_{_p}/rates_{_element}_{_loc}_{_p}.mac") 
                     elif 'singles' in _p:
-                        for i in range(nsetSingles):
-                            file = f"{dir}/job{additionalString}_{_element}_{_loc}_{_p}_{i}.sh".replace(" ","")
-                            outfile_jobs = open(file,"w+")
-                            jobheader = jobSubmissionCommands(_element,timeJob,file,outFile,errFile,singlesscript,arguments,directory)
-                            outfile_jobs.writelines(jobheader)
+                        # the runs of the singles script are in the manifest
+                        continue
                     else:
                         script = f"{dir}/script{additionalString}_{_element}_{_loc}_{_p}.sh".replace(" ","")
-                        outfile_script = open(script,"w+")
-                        outfile_script.writelines(f"""#!/bin/sh
-    source {ratDir+'/../../env.sh'} && source {butDir+'/'+experimentStr.lower()+'.sh'} && TMPNAME=$(date +%s%N)  && {experimentStr.lower()} mac/detector_{detectorStr}.mac mac/daq.mac mac/bonsai.mac mac/initialize.mac mac/process.mac mac/bonsai_proc.mac mac/{_element}_{_loc}_{_p}/phys_{_element}.mac mac/{_element}_{_loc}_{_p}/geo_{_loc}.mac mac/{_element}_{_loc}_{_p}/rates_{_element}_{_loc}_{_p}.mac mac/{_element}_{_loc}_{_p}/evts_{_element}_{_loc}_{_p}.mac -o {filetype}_root_files{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.root -l log{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.log""")
-                        outfile_script.close
-                        os.chmod(script,S_IRWXU)
-                        file = f"{dir}/job{additionalString}_{_element}_{_loc}_{_p}.sh".replace(" ","") 
-                        outfile_jobs = open(file,"w+")
-                        jobheader = jobSubmissionCommands(_element,timeJob,file,outFile,errFile,script,arguments,directory)
-                        outfile_jobs.writelines(jobheader)
-
-                        outfile_jobs.close
+                        writeIfChanged(script,f"""#!/bin/sh
+    source {ratDir+'/../../env.sh'} && source {butDir+'/'+experimentStr.lower()+'.sh'} && TMPNAME=${{TMPNAME:-$(date +%s%N)}}  && {experimentStr.lower()} mac/detector_{detectorStr}.mac mac/daq.mac mac/bonsai.mac mac/initialize.mac mac/process.mac mac/bonsai_proc.mac mac/{_element}_{_loc}_{_p}/phys_{_element}.mac mac/{_element}_{_loc}_{_p}/geo_{_loc}.mac mac/{_element}_{_loc}_{_p}/rates_{_element}_{_loc}_{_p}.mac mac/{_element}_{_loc}_{_p}/evts_{_element}_{_loc}_{_p}.mac ${{SEED:+-s $SEED}} -o {filetype}_root_files{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.root -l log{additionalString}/{_element}_{_loc}_{_p}/run$TMPNAME.log""",S_IRWXU)
     
-    outfile_singlesscript.writelines(f" mac/evts_singles.mac -o {filetype}_root_files{additionalString}/singles_ALL_singles/run$TMPNAME.root -l log{additionalString}/singles_ALL_singles/run$TMPNAME.log")
-    outfile_singlesscript.close()
-    os.chmod(singlesscript,S_IRWXU)
+    singlescontent += (f" mac/evts_singles.mac ${{SEED:+-s $SEED}} -o {filetype}_root_files{additionalString}/singles_ALL_singles/run$TMPNAME.root -l log{additionalString}/singles_ALL_singles/run$TMPNAME.log")
+    writeIfChanged(singlesscript,singlescontent,S_IRWXU)
+
+    # the manifest maps each index of the array job to a (tag, run), and
+    # the array script skips the runs which are done
+    runs = localRuns()
+    refreshOutputs(runs)
+    writeIfChanged(manifestFile(),manifestContent(runs))
+    manifest = os.path.abspath(manifestFile())
+    arrayscript = f"{dir}/array{additionalString}.sh".replace(" ","")
+    writeIfChanged(arrayscript,f"""#!/bin/bash
+# runs line <index> of {manifest}, with, as argument, the index from 0 or
+# else the index (from 1) of the scheduler's array task, both counted from
+# the ARRAYOFFSET of the job file when a campaign is split over several
+if [ -n "$1" ]; then
+  index=$(( $1 + 1 ))
+else
+  index=${{SLURM_ARRAY_TASK_ID:-${{SGE_TASK_ID:-$LSB_JOBINDEX}}}}
+fi
+index=$(( index + ${{ARRAYOFFSET:-0}} ))
+cd {directory}
+read tag script name output log seed marker <<< "$(sed -n "${{index}}p" {manifest})"
+if [ -z "$marker" ]; then echo "No run $index in {manifest}"; exit 1; fi
+if [ -f "$marker" ] && [ -f "$output" ]; then exit 0; fi
+mkdir -p $(dirname $log) $(dirname $marker)
+if TMPNAME=$name SEED=$seed bash $script > $log 2>&1 && [ -s $output ]; then
+  printf '{{"script": "%s", "output": "%s", "seed": %s}}\\n' $script $output $seed > $marker
+else
+  echo "Run $name of $tag failed, see $log"
+  exit 1
+fi
+""",S_IRWXU)
+    # the schedulers limit the size of an array, so a campaign with more
+    # than --maxArray tasks is split over several job files, each running
+    # the manifest lines from its offset
+    chunks = arrayChunks(len(runs))
+    files = []
+    for k,(offset,nrun) in enumerate(chunks):
+        if len(chunks)==1:
+            file = f"{dir}/job{additionalString}.sh".replace(" ","")
+        else:
+            file = f"{dir}/job{additionalString}_{k+1}.sh".replace(" ","")
+        jobheader = jobSubmissionCommands('cobraa%s'%(additionalString),timeJob,file,outFile,errFile,arrayscript,arguments,directory,nrun,offset)
+        writeIfChanged(file,jobheader)
+        files.append(file)
+    # the job files of an earlier split
+    jobname = f"job{additionalString}".replace(" ","")
+    for old in glob(f"{dir}/{jobname}*.sh"):
+        if old not in files and re.fullmatch(re.escape(jobname)+r'(_\d+)?\.sh',os.path.basename(old)):
+            os.remove(old)
+    if len(files)==1:
+        print('Wrote the array job %s of %d runs'%(files[0],len(runs)))
+    else:
+        print('Wrote %d array jobs %s to %s of %d runs (at most %s tasks each); submit each of them'%(len(files),files[0],files[-1],len(runs),arguments['--maxArray']))
+
+def arrayChunks(nruns):
+
+    # the (offset, runs) of each job file. On lassen each task is a node of
+    # lassenRunsPerNode runs; local runs are not arrays and are not split.
+    if arguments['--cluster'] not in ('lassen','sheffield','edinburgh','warwick'):
+        return [(0,nruns)]
+    size = int(arguments['--maxArray'])
+    if arguments['--cluster']=='lassen':
+        size *= lassenRunsPerNode
+    return [(_o,min(size,nruns-_o)) for _o in range(0,max(nruns,1),size)]
 
 
 def reset():
@@ -288,6 +322,10 @@ def mergeRootFiles():
                     if os.path.exists(filedir):
                         if len(os.listdir(filedir))>0:
                             os.system(f'hadd -f -k -v 0 reconstructed_{outfile} reconstructed_{files}')
+                            # uncompressed copy of the analysis branches for
+                            # memory-mapped reading by the later stages
+                            if arguments['--columnar'] and os.path.exists(f'reconstructed_{outfile}'):
+                                writeColumnar(f'reconstructed_{outfile}',coincidenceBranches)
                     #        #if arguments['--core']:
                     #           os.system(f'hadd -f -k -v 0 raw_{outfile} raw_{files}')
                     #        else:
@@ -466,21 +504,36 @@ def macroGenerator(location,element,process,nruns):
     return generator,detectorvolume
 
 
+# the runs at once on each (whole) lassen node, one per core
+lassenRunsPerNode = 40
+
 # Specify the header for the job submission script
-def jobSubmissionCommands(_element,timeJob,file,outFile,errFile,script,arguments,directory):
+# script is the array script of generateJobs(), run for the nrun indices of
+# an array job from the manifest line offset+1
+def jobSubmissionCommands(_element,timeJob,file,outFile,errFile,script,arguments,directory,nrun,offset=0):
     jobheader=""
     if arguments['--cluster']=='lassen':
+        # nodes are allocated whole, so each array element runs
+        # lassenRunsPerNode runs side by side on its node
+        nnodes = (nrun+lassenRunsPerNode-1)//lassenRunsPerNode
         jobheader = f"""#!/bin/sh
 #BSUB -nnodes 1  
-#BSUB -J job_{_element}    #name of job
+#BSUB -J job_{_element}[1-{nnodes}]    #name of job
 #BSUB -W {timeJob}      #time in minute
 #BSUB -G ait         # sets bank account
 #BSUB -q pbatch         #pool
-#BSUB -o {file+outFile}
-#BSUB -e {file+errFile}
+#BSUB -o {file}%I{outFile}
+#BSUB -e {file}%I{errFile}
 #BSUB                     # no more psub commands
 
-jsrun -p{nruns} {script}
+first=$(( {offset}+($LSB_JOBINDEX-1)*{lassenRunsPerNode} ))
+last=$(( first+{lassenRunsPerNode}-1 ))
+if [ $last -gt {offset+nrun-1} ]; then last={offset+nrun-1}; fi
+pids=""
+for i in `seq $first $last`; do jsrun -n1 -a1 -c1 -g0 {script} $i & pids="$pids $!"; done
+status=0
+for pid in $pids; do wait $pid || status=1; done
+exit $status
 
 """ 
 
@@ -488,23 +541,25 @@ jsrun -p{nruns} {script}
         jobheader = f"""#!/bin/sh
 
 executable = {script}
-output     = {file+outFile}
-error      = {file+errFile}
+arguments  = $(Process)
+output     = {file}$(Process){outFile}
+error      = {file}$(Process){errFile}
 getenv     = True
-queue {nruns}
+environment = "ARRAYOFFSET={offset}"
+queue {nrun}
 
 """
     elif arguments['--cluster']=='glasgow':
         jobheader = f"""#!/bin/sh
 
-for i in `seq {nruns}`; do source {script}; done
+for i in `seq {offset} {offset+nrun-1}`; do bash {script} $i; done
 
     """ 
 
     elif arguments['--cluster']=='edinburgh':
         jobheader = f"""#!/bin/sh
 
-qsub -t 1-40 -V -q ppe.7.day -N job_{_element} -j y -cwd {script}
+qsub -t 1-{nrun} -v ARRAYOFFSET={offset} -V -q ppe.7.day -N job_{_element} -j y -cwd {script}
     """ 
 
     elif arguments['--cluster']=='warwick':
@@ -513,20 +568,22 @@ qsub -t 1-40 -V -q ppe.7.day -N job_{_element} -j y -cwd {script}
 #SBATCH --job-name=job_{_element}
 #SBATCH -A epp
 #SBATCH --partition=epp,taskfarm
-#SBATCH -o {file+outFile}
-#SBATCH -e {file+errFile}
+#SBATCH --array=1-{nrun}
+#SBATCH -o {file}%a{outFile}
+#SBATCH -e {file}%a{errFile}
 #SBATCH --mem=4G
 #SBATCH --time=12:00:00
 #SBATCH --nodes=1
 #SBATCH -D {directory}
 #SBATCH -v
 
-srun -n{nruns} {script}
+export ARRAYOFFSET={offset}
+srun -n1 {script}
     """
     else:
         jobheader = f"""#!/bin/sh
 
-for i in `seq {nruns}`; do source {script}; done
+for i in `seq {offset} {offset+nrun-1}`; do bash {script} $i; done
 
     """ 
 
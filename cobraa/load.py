@@ -29,7 +29,7 @@ except:
 # Adapted for BUTTON by Liz Kneale (2022)
 
 docstring = """
-    Usage: watchmakers.py [options]
+    Usage: watchmakers.py [-v...] [options]
 
     Arguments:
 
@@ -37,28 +37,52 @@ docstring = """
 
     ## System options
 
-    --force                Forcing the recreation of the root_file,bonsai_root_file and log folders
-    -v                     Verbose. Allow print out of additional information.
-    --cluster=<_clus>      Specify cluster to use (options: lassen, sheffield, warwick) [Default: local]
+    --force                With -j, clear the root_file and log folders of the event types whose configuration changed
+    -v                     Verbose. Allow print out of additional information (-vv also prints every cut cell).
+    --cellLog=<file>       Append a JSON line per coincidence cell and per sensitivity map optimum to file
+    --cluster=<_clus>      Specify cluster of the array job (options: lassen, sheffield, warwick, edinburgh, glasgow) [Default: local]
     --reset                Delete job, mac, log, raw, and reconstruction directories, start fresh.
 
     ## Create macros and job scripts for a user defined detector configuration
 
     -m                     Generate rat-pac macro files
     -j                     Create rat-pac/bonsai submision scripts for option above. Can be run with -m.
+    --run-jobs             Run the local jobs created with -j in parallel, retrying failed runs and skipping finished ones on reruns
+    --cores=<_cores>       Number of simultaneous runs for --run-jobs (default: all available cores)
+    --retries=<_retries>   Number of retries of a failed run with --run-jobs [Default: 2]
     --bonsai               Generate BONSAI fitting macro which can be used within RAT-PAC run (New for RAT-PAC2).
     --jobTime=<_jt>        Length of job in minutes for LASSEN [Default: 200]
     --energyEst=<_EE>      Default energy estimator (n9,n100,n400,nX) [Default: n9]
     -N=<_N>                Number of runs to simulate [Default: 40]
+    --maxArray=<_n>        With -j, the most tasks (lassen: nodes) of one array job; larger campaigns are split over several job files [Default: 1000]
+    --seed=<_seed>         Salt of the random seeds of the runs (each run of -j gets its own fixed seed, below 9e8) [Default: 0]
+    --plan                 Plan the events and runs of each event type from the trigger efficiencies of --triggers (use with -m -j)
+    --targetDays=<days>    With --plan, simulate the events of this livetime (days) for every event type
+    --targetError=<err>    With --plan, simulate the events needed for this relative statistical error on the triggered rate
+
+    --synthesize           Write synthetic reconstructed run files for the runs of -e and -N (or the event plan) in place of RAT, to test and time the analysis
+    --synthConfig=<file>   JSON file overriding the distributions of --synthesize (see synthModel in cobraa/synthesize.py)
 
     ## Perform efficiency and sensitivity evaluation (after simulation and reconstruction).
 
     -M                     Merge result files from trial ntuples. Step one.
     --mergeRATFiles        Merge raw ratds files (off by default)
+    --columnar             With -M, also write a memory-mapped columnar copy of the analysis branches of each merged file
+    --pairs                Write a prompt-delayed pair table per event type for fast --coincidences reruns (after -M)
     --coincidences         Map the efficiencies of coincidences which pass the cuts (analysis step 1)
     --core                 Use the combined reconstruction (option to pass with -m, -j and --coincidences)
     --evtype=<_ev>         Set process to evaluate for coincidences
+    --drawScan             Map coincidences with one TTree::Draw per cut cell (slow, for validating the pair engine)
+    --jobs=<_jobs>         Number of worker processes for --coincidences (one event type per worker) [Default: 1]
+    --noCache              Recompute all coincidence maps, ignoring the coincidence_cache.json record of up-to-date maps and the coincidence_cells record of the counts of each cut cell. With the records, a map whose fiducial, prompt nX or dR range changes (e.g. a higher --dRmax or --maxNXprompt) only counts its new cells
+    --timeline             Pair each delayed trigger with all triggers within dT and apply the multiplicity cut against every trigger
+    --analyticAcc          Estimate the accidentals maps from the radioactive (*_NA, RADIOGENIC) samples instead of the singles simulation. Cells with no prompt-like or delayed-like event of a sample with a nonzero rate are left empty (no accidentals) and counted in the output. The dR fraction is that of the last dR value, the one the maps hold
+    --chunkMB=<_mb>        Memory budget (MB) for the event columns streamed from a merged file at once [Default: 512]
     --sensitivity          Calculate the rates for final optimisation of signal significance (analysis step 2)
+    --adaptive             Optimise the cuts coarse-to-fine from the pair tables or merged files, refining around the best cells down to the --binwidth* steps
+    --query=<expr>         Filter the cells of the sensitivity results table with a pandas query (e.g. "fid>=1 and valid") and print the best
+    --rank=<col>           Column to rank the --query cells by, - for descending (default t3sig, or -sob with --optimiseSoB)
+    --top=<n>              Number of --query cells to print [Default: 10]
     --triggers             Get the number of triggers for singles processes
     --backgrounds          Plot backgrounds as a function of distance from rPMT
     --positiveScan         Only look at nx delayed above nx prompt
@@ -133,6 +157,7 @@ docstring = """
     --GSH                        Gravelines, Hinkley Point C and Sizewell signal
     --SH                         Sizewell + Hinkley Point C signal
     --GH                         Gravelines + HInkley Point C signal
+    --allScenarios               With --sensitivity, also optimise and compare every signal scenario above from the same maps
 
     # ################### Sensitivity metric options #########################
     # specify the sensitivity metric to use (default uses Gaussian statistics)
@@ -143,6 +168,9 @@ docstring = """
     --measurement          calculate dwell time to 3 sigma reactor measurement
     --2sigma               calculate dwell time to 2 sigma detection (gaussian) at 90% confidence (knoll)
     --optimiseSoB          optimise signal over background rather than dwell time (useful in stats-limited regime)
+    --toys=<n>             With --sensitivity, quantiles of the dwell time and significance at the optimum from n pseudo-experiments [Default: 0]
+    --toysGrid             With --toys, also the dwell time quantiles of every cell of the scan (added to the results table)
+    --toyNuisance=<dist>   Distribution of the rate nuisance factors of the toys (lognormal, gauss) [Default: lognormal]
 """
 
 try:
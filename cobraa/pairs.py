@@ -0,0 +1,290 @@
+from itertools import product
+from .globals import *
+from .columns import *
+
+# Single-pass coincidence engine. Candidate prompt-delayed pairs are
+# extracted once from the event columns with the loosest cuts of the scan,
+# then every cell of the delayed-nX x dT x maxEp x g x dR x fiducial x
+# prompt-nX grid is counted from the (small) pair arrays instead of
+# re-scanning the whole tree with TTree::Draw for each cell.
+
+def cutValue(x):
+
+    # the TTree::Draw scan applied cuts as '%f' formatted strings, so
+    # compare against the cut value rounded in the same way
+    return float('%f'%(x))
+
+def cutGrid():
+
+    # the cut values scanned by the coincidence stage, in scan order
+    grid = {}
+    grid['delayed'] = list(drange(minNXdelayed,rangeNXdmax,binwidthNX))
+    grid['dT']      = list(drange(dTmin,rangedTmax,binwidthdT))
+    grid['maxEp']   = list(drange(minEpmax,rangeEpmax,binwidthEpmax))
+    grid['g']       = list(drange(gmin,rangeGmax,binwidthG))
+    grid['dR']      = list(drange(dRmin,rangedRmax,binwidthdR))
+    grid['fid']     = list(drange(minFid,rangeFidmax,binwidthFid))
+    grid['prompt']  = list(drange(minNXprompt,rangeNXpmax,binwidthNX))
+    return grid
+
+def mapKey(delayed_nxcut,dTcut,maxEp,gcut):
+
+    # the cut part of the hist_<tag>_delayed... map names
+    return '%s_%d_%dus_maxEp%d_%d'%(energyEstimator,delayed_nxcut,dTcut,maxEp,gcut*10)
+
+def scanCells(delayed_nxcut,grid):
+
+    # the (fiducial, prompt nX) cells evaluated for a delayed nX cut
+    cells = []
+    for fidcut,prompt_nxcut in product(grid['fid'],grid['prompt']):
+        if arguments['--positiveScan']:
+            if prompt_nxcut>delayed_nxcut:
+                continue
+        elif arguments['--negativeScan']:
+            if prompt_nxcut<delayed_nxcut:
+                continue
+        cells.append((fidcut,prompt_nxcut))
+    return cells
+
+def extractPairs(cols,prev,grid):
+
+    # keeps the events which, together with the event before them, pass the
+    # loosest value of every cut in the grid. Returns the pair columns in
+    # tree order.
+    estimator = '%s_Bonsai'%(energyEstimator)
+    estimatorPrev = '%s_prev'%(energyEstimator)
+    loose = (cols['nhits']>3) & (prev['nhits_prev']>3)
+    loose &= cols[estimator]>cutValue(min(grid['delayed']))
+    loose &= prev[estimatorPrev]>cutValue(min(grid['prompt']))
+    loose &= prev[estimatorPrev]<cutValue(max(grid['maxEp']))
+    loose &= (prev['dt_prev_us']>1) & (prev['dt_prev_us']<cutValue(max(grid['dT'])))
+    loose &= (cols['positionGoodness_Bonsai']>cutValue(min(grid['g']))) & (prev['positionGoodness_prev']>cutValue(min(grid['g'])))
+    loose &= (cols['closestPMT_Bonsai']/1000.>cutValue(min(grid['fid']))) & (prev['closestPMT_prev']/1000.>cutValue(min(grid['fid'])))
+    loose &= prev['drPrevr']/1000.<cutValue(max(grid['dR']))
+
+    pairs = {}
+    pairs['delayed']         = cols[estimator][loose]
+    pairs['prompt']          = prev[estimatorPrev][loose]
+    pairs['closestPMT']      = cols['closestPMT_Bonsai'][loose]
+    pairs['closestPMT_prev'] = prev['closestPMT_prev'][loose]
+    pairs['goodness']        = cols['positionGoodness_Bonsai'][loose]
+    pairs['goodness_prev']   = prev['positionGoodness_prev'][loose]
+    pairs['nhits']           = cols['nhits'][loose]
+    pairs['nhits_prev']      = prev['nhits_prev'][loose]
+    pairs['timestamp']       = cols['timestamp'][loose]
+    pairs['dt_prev_us']      = prev['dt_prev_us'][loose]
+    pairs['drPrevr']         = prev['drPrevr'][loose]
+    return pairs
+
+def streamPairs(file,grid):
+
+    # extracts the candidate pairs of a merged file chunk by chunk, carrying
+    # the last event of each chunk forward so that pairs spanning a chunk
+    # boundary are kept. Returns the pair columns and the number of events.
+    chunks,last,totalEvents = [],None,0
+    for cols in iterateColumns(file,coincidenceBranches):
+        if len(cols['timestamp'])==0:
+            continue
+        totalEvents += len(cols['timestamp'])
+        prev = previousEventColumns(cols,last)
+        last = {_b:cols[_b][-1] for _b in cols}
+        chunks.append(extractPairs(cols,prev,grid))
+        del cols,prev
+    if not chunks:
+        empty = {_b:np.zeros(0) for _b in coincidenceBranches}
+        chunks.append(extractPairs(empty,previousEventColumns(empty),grid))
+    pairs = {_c:np.concatenate([_chunk[_c] for _chunk in chunks]) for _c in chunks[0]}
+    return pairs,totalEvents
+
+def unwrapTimestamps(raw,maxdT,state):
+
+    # the merged files are a sequence of runs whose clocks restart. Each
+    # restarted run is shifted to follow the previous one with a gap longer
+    # than any dT cut, so that no pair or veto window spans two runs. state
+    # carries the last timestamp and offset from chunk to chunk.
+    gap = 2*maxdT+1
+    if len(raw)==0:
+        return raw
+    last = state.get('last',raw[0])
+    offset = state.get('offset',0.)
+    resets = np.flatnonzero(np.diff(raw,prepend=last)<0)
+    offsets = np.zeros(len(resets)+1)
+    offsets[0] = offset
+    for i,k in enumerate(resets):
+        previous = (raw[k-1] if k>0 else last)+offsets[i]
+        offsets[i+1] = previous+gap-raw[k]
+    segment = np.zeros(len(raw),dtype=np.int64)
+    segment[resets] = 1
+    t = raw+offsets[np.cumsum(segment)]
+    state['last'] = raw[-1]
+    state['offset'] = offsets[-1]
+    return t
+
+def timelinePairs(cols,t,grid,first=0):
+
+    # finds, for every delayed candidate from row first onwards, all the
+    # earlier triggers within the largest dT of the grid by binary search
+    # of the (unwrapped, sorted) timeline t, and keeps the pairs which pass
+    # the loosest cuts. Returns the same pair columns as extractPairs(),
+    # with timestamp on the unwrapped timeline.
+    estimator = '%s_Bonsai'%(energyEstimator)
+    maxdT = cutValue(max(grid['dT']))
+    trigger = cols['nhits']>3
+    located = (cols['positionGoodness_Bonsai']>cutValue(min(grid['g']))) & (cols['closestPMT_Bonsai']/1000.>cutValue(min(grid['fid'])))
+    delayed = np.flatnonzero(trigger & located & (cols[estimator]>cutValue(min(grid['delayed']))))
+    delayed = delayed[delayed>=first]
+    promptOK = trigger & located & (cols[estimator]>cutValue(min(grid['prompt']))) & (cols[estimator]<cutValue(max(grid['maxEp'])))
+
+    # rows [lo,hi) hold the triggers with 1 < t_delayed-t < maxdT
+    lo = np.searchsorted(t,t[delayed]-maxdT,'right')
+    hi = np.searchsorted(t,t[delayed]-1,'left')
+    npairs = np.maximum(hi-lo,0)
+    jd = np.repeat(delayed,npairs)
+    ip = np.repeat(lo,npairs)+np.arange(npairs.sum())-np.repeat(np.cumsum(npairs)-npairs,npairs)
+    keep = promptOK[ip]
+    ip,jd = ip[keep],jd[keep]
+    dt = t[jd]-t[ip]
+    dx = cols['x_Bonsai'][jd]-cols['x_Bonsai'][ip]
+    dy = cols['y_Bonsai'][jd]-cols['y_Bonsai'][ip]
+    dz = cols['z_Bonsai'][jd]-cols['z_Bonsai'][ip]
+    dR = np.sqrt(dx*dx+dy*dy+dz*dz)
+    keep = (dt>1) & (dt<maxdT) & (dR/1000.<cutValue(max(grid['dR'])))
+    ip,jd = ip[keep],jd[keep]
+
+    pairs = {}
+    pairs['delayed']         = cols[estimator][jd]
+    pairs['prompt']          = cols[estimator][ip]
+    pairs['closestPMT']      = cols['closestPMT_Bonsai'][jd]
+    pairs['closestPMT_prev'] = cols['closestPMT_Bonsai'][ip]
+    pairs['goodness']        = cols['positionGoodness_Bonsai'][jd]
+    pairs['goodness_prev']   = cols['positionGoodness_Bonsai'][ip]
+    pairs['nhits']           = cols['nhits'][jd]
+    pairs['nhits_prev']      = cols['nhits'][ip]
+    pairs['timestamp']       = t[jd]
+    pairs['dt_prev_us']      = dt[keep]
+    pairs['drPrevr']         = dR[keep]
+    return pairs
+
+def streamTimelinePairs(file,grid):
+
+    # as streamPairs() for the timeline mode: pairs are searched over all
+    # earlier triggers within dT, carrying the triggers of the last dT of
+    # each chunk forward. Also returns the timeline of all triggers
+    # (nhits>3) used for the multiplicity veto.
+    maxdT = cutValue(max(grid['dT']))
+    chunks,triggers,totalEvents = [],[],0
+    state,tail,tailT = {},None,None
+    for cols in iterateColumns(file,coincidenceBranches):
+        if len(cols['timestamp'])==0:
+            continue
+        totalEvents += len(cols['timestamp'])
+        t = unwrapTimestamps(cols['timestamp'],maxdT,state)
+        triggers.append(t[cols['nhits']>3])
+        first = 0
+        if tail is not None:
+            first = len(tailT)
+            cols = {_b:np.concatenate((tail[_b],cols[_b])) for _b in cols}
+            t = np.concatenate((tailT,t))
+        chunks.append(timelinePairs(cols,t,grid,first))
+        carry = t>t[-1]-maxdT
+        tail = {_b:cols[_b][carry] for _b in cols}
+        tailT = t[carry]
+        del cols
+    if not chunks:
+        empty = {_b:np.zeros(0) for _b in coincidenceBranches}
+        chunks.append(timelinePairs(empty,np.zeros(0),grid))
+        triggers.append(np.zeros(0))
+    pairs = {_c:np.concatenate([_chunk[_c] for _chunk in chunks]) for _c in chunks[0]}
+    return pairs,totalEvents,np.concatenate(triggers)
+
+def isolatedPairs(t_prompt,t_delayed,triggers,dTcut):
+
+    # the multiplicity veto on the full timeline: a pair is kept if the
+    # prompt and delayed triggers are the only triggers from dTcut before
+    # the prompt to dTcut after the delayed
+    lo = np.searchsorted(triggers,t_prompt-dTcut,'left')
+    hi = np.searchsorted(triggers,t_delayed+dTcut,'right')
+    return hi-lo==2
+
+def vetoCounts(fid,prompt,isolated,cells):
+
+    # counts, for each (fiducial, prompt nX) cell, the selected pairs which
+    # pass the timeline multiplicity veto
+    counts = np.zeros(len(cells),dtype=np.int64)
+    fid,prompt = fid[isolated],prompt[isolated]
+    if len(fid)==0 or len(cells)==0:
+        return counts
+    fidcuts = np.array([cutValue(_c[0]) for _c in cells])
+    promptcuts = np.array([cutValue(_c[1]) for _c in cells])
+    block = max(1,int(4e6//len(fid)))
+    for start in range(0,len(cells),block):
+        stop = min(start+block,len(cells))
+        counts[start:stop] = np.count_nonzero((fid>fidcuts[start:stop,None]) & (prompt>promptcuts[start:stop,None]),axis=1)
+    return counts
+
+def multiplicityCounts(fid,prompt,t_prompt,t_delayed,cells,dTcut):
+
+    # counts, for each (fiducial, prompt nX) cell, the selected pairs which
+    # pass the multiplicity cut: the previous and next selected pair must be
+    # more than dTcut away. As in the dtnext/dtlast arrays, the first and
+    # last selected pair of a cell are never counted.
+    npairs = len(fid)
+    counts = np.zeros(len(cells),dtype=np.int64)
+    if npairs<3 or len(cells)==0:
+        return counts
+    fidcuts = np.array([cutValue(_c[0]) for _c in cells])
+    promptcuts = np.array([cutValue(_c[1]) for _c in cells])
+    index = np.arange(npairs)
+    # evaluate the cells in blocks to bound the size of the selection matrix
+    block = max(1,int(4e6//npairs))
+    for start in range(0,len(cells),block):
+        stop = min(start+block,len(cells))
+        sel = (fid>fidcuts[start:stop,None]) & (prompt>promptcuts[start:stop,None])
+        # index of the previous/next selected pair, from running max/min
+        last = np.maximum.accumulate(np.where(sel,index,-1),axis=1)
+        prevsel = np.empty_like(last)
+        prevsel[:,0] = -1
+        prevsel[:,1:] = last[:,:-1]
+        first = np.minimum.accumulate(np.where(sel,index,npairs)[:,::-1],axis=1)[:,::-1]
+        nextsel = np.empty_like(first)
+        nextsel[:,-1] = npairs
+        nextsel[:,:-1] = first[:,1:]
+        interior = sel & (prevsel>=0) & (nextsel<npairs)
+        dtlast = t_prompt-t_delayed[np.clip(prevsel,0,npairs-1)]
+        dtnext = t_prompt[np.clip(nextsel,0,npairs-1)]-t_delayed
+        counts[start:stop] = np.count_nonzero(interior & (dtnext>dTcut) & (dtlast>dTcut),axis=1)
+    return counts
+
+def coincidenceCounts(pairs,grid,skip=(),triggers=None,only=None):
+
+    # yields the cut values, the (fiducial, prompt nX) cells and the number
+    # of coincidences in each cell for every delayed nX, dT, maxEp, g and dR.
+    # Maps whose mapKey() is in skip are not evaluated. If the trigger
+    # timeline is given, the multiplicity cut vetoes against every trigger
+    # instead of the neighbouring selected pairs. If only is given, just the
+    # cuts in it are evaluated, for its list of cells.
+    fid = np.minimum(pairs['closestPMT'],pairs['closestPMT_prev'])/1000.
+    good = np.minimum(pairs['goodness'],pairs['goodness_prev'])
+    dR = pairs['drPrevr']/1000.
+    t_delayed = pairs['timestamp']
+    t_prompt = t_delayed-pairs['dt_prev_us']
+    isolated = {}
+    for cuts in product(grid['delayed'],grid['dT'],grid['maxEp'],grid['g'],grid['dR']):
+        delayed_nxcut,dTcut,maxEp,gcut,dRcut = cuts
+        if mapKey(delayed_nxcut,dTcut,maxEp,gcut) in skip:
+            continue
+        if only is not None and cuts not in only:
+            continue
+        outer = pairs['delayed']>cutValue(delayed_nxcut)
+        outer &= pairs['dt_prev_us']<cutValue(dTcut)
+        outer &= pairs['prompt']<cutValue(maxEp)
+        outer &= good>cutValue(gcut)
+        outer &= dR<cutValue(dRcut)
+        cells = scanCells(delayed_nxcut,grid) if only is None else only[cuts]
+        if triggers is None:
+            counts = multiplicityCounts(fid[outer],pairs['prompt'][outer],t_prompt[outer],t_delayed[outer],cells,dTcut)
+        else:
+            if dTcut not in isolated:
+                isolated[dTcut] = isolatedPairs(t_prompt,t_delayed,triggers,dTcut)
+            counts = vetoCounts(fid[outer],pairs['prompt'][outer],isolated[dTcut][outer],cells)
+        yield (delayed_nxcut,dTcut,maxEp,gcut,dRcut),cells,counts
@@ -0,0 +1,89 @@
+import json
+from .globals import *
+from .pairs import *
+from .cache import fileIdentity
+
+# Persistent prompt-delayed pair tables. The candidate pairs of a merged
+# file which pass the loosest cuts of the grid are written once per tag as
+# one .npy file per column plus a pairs.json record of the bounds and the
+# input file, so that --coincidences can be rerun with a new grid from the
+# (memory-mapped) table instead of rereading the merged ntuple.
+
+def pairTableDir(_tag):
+
+    return "reconstructed_root_files%s/pair_tables/%s"%(additionalString,_tag)
+
+def looseBounds(grid):
+
+    # the loosest value of each cut of the grid, as applied by extractPairs()
+    return {'delayed':cutValue(min(grid['delayed'])),'prompt':cutValue(min(grid['prompt'])),\
+            'maxEp':cutValue(max(grid['maxEp'])),'dT':cutValue(max(grid['dT'])),\
+            'g':cutValue(min(grid['g'])),'fid':cutValue(min(grid['fid'])),\
+            'dR':cutValue(max(grid['dR']))}
+
+def coversGrid(bounds,grid):
+
+    # a table holds every pair of the grid if its cuts are no tighter
+    need = looseBounds(grid)
+    for _c in ('delayed','prompt','g','fid'):
+        if need[_c]<bounds[_c]:
+            return False
+    for _c in ('maxEp','dT','dR'):
+        if need[_c]>bounds[_c]:
+            return False
+    return True
+
+def writePairTable(file,_tag,grid):
+
+    # extracts the pairs of a merged file and writes them to the tag's
+    # pair table directory
+    outdir = pairTableDir(_tag)
+    os.makedirs(outdir,exist_ok=True)
+    # the columns are overwritten in place, so the record of a previous
+    # table goes first: an interrupted write then leaves no table
+    metafile = os.path.join(outdir,'pairs.json')
+    if os.path.exists(metafile):
+        os.remove(metafile)
+    identity = fileIdentity(file)
+    timeline = bool(arguments['--timeline'])
+    if timeline:
+        pairs,totalEvents,triggers = streamTimelinePairs(file,grid)
+        np.save(os.path.join(outdir,'triggers.npy'),triggers)
+    else:
+        pairs,totalEvents = streamPairs(file,grid)
+    for _c in pairs:
+        np.save(os.path.join(outdir,'%s.npy'%(_c)),pairs[_c])
+    meta = {'input':identity,'file':file,'energyEstimator':energyEstimator,'timeline':timeline,\
+            'totalEvents':totalEvents,'bounds':looseBounds(grid),'columns':list(pairs)}
+    # write the record last, once every column is complete
+    with open(metafile+'.tmp','w') as f:
+        json.dump(meta,f,indent=1,sort_keys=True)
+    os.replace(metafile+'.tmp',metafile)
+    print('Wrote %d pairs from %d events to %s'%(len(pairs['timestamp']),totalEvents,outdir))
+    return 0
+
+def loadPairTable(file,_tag,grid):
+
+    # returns the pair columns (memory-mapped), the number of events and
+    # the trigger timeline (None unless --timeline) of the tag's pair
+    # table, or None if there is no table for this input file, energy
+    # estimator and pairing mode which covers the grid
+    metafile = os.path.join(pairTableDir(_tag),'pairs.json')
+    if not os.path.exists(metafile) or not os.path.exists(file):
+        return None
+    with open(metafile) as f:
+        meta = json.load(f)
+    if meta['energyEstimator']!=energyEstimator or not coversGrid(meta['bounds'],grid):
+        return None
+    if meta.get('timeline',False)!=bool(arguments['--timeline']):
+        return None
+    if fileIdentity(file,meta['input'])['sha1']!=meta['input']['sha1']:
+        print('Pair table for %s is out of date with %s'%(_tag,file))
+        return None
+    pairs = {}
+    for _c in meta['columns']:
+        pairs[_c] = np.load(os.path.join(pairTableDir(_tag),'%s.npy'%(_c)),mmap_mode='r')
+    triggers = None
+    if meta.get('timeline',False):
+        triggers = np.load(os.path.join(pairTableDir(_tag),'triggers.npy'),mmap_mode='r')
+    return pairs,meta['totalEvents'],triggers
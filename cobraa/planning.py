@@ -0,0 +1,114 @@
+import json
+import pandas as pd
+from math import ceil
+from .globals import *
+
+# Allocation of the simulated events from the trigger efficiencies measured
+# by --triggers. Instead of -e events per run (times the factor in rates) and
+# -N runs for every component, --plan works out for each tag the number of
+# events needed to cover --targetDays of livetime or to measure the
+# triggered rate to a relative statistical error of --targetError (the
+# smaller of the two when both are given), and writes the events per run
+# and the number of runs to event_plan.json. -m, -j and --run-jobs then use
+# the plan for the tags in it, so a component with a high activity and a
+# low efficiency gets more runs and a negligible one fewer.
+
+# the column of the triggers table counted as triggered events
+planTriggers = "{Events detected (PMT hits > 3)}"
+# the 90% upper limit on the expected count when no event triggered
+zeroTriggers = 2.3
+eventPlan = None
+
+def eventPlanFile():
+
+    return "event_plan%s.json"%(additionalString)
+
+def loadEventPlan():
+
+    # the plan written by --plan, read once, or {} without one
+    global eventPlan
+    if eventPlan is None:
+        eventPlan = {}
+        if os.path.exists(eventPlanFile()):
+            with open(eventPlanFile()) as f:
+                eventPlan = json.load(f)
+            print('Using the events and runs of %d event types from %s'%(len(eventPlan),eventPlanFile()))
+    return eventPlan
+
+def defaultEvents(_tag):
+
+    # the events per run and the number of runs without a plan (nsetSingles
+    # sets of runs of the singles script)
+    runs = nsetSingles*nruns if 'singles' in _tag and not arguments['--singles'] else nruns
+    return int(float(arguments['-e'])*rates[_tag][1]),runs
+
+def plannedEvents(_tag):
+
+    # the events per run and the number of runs of a tag
+    plan = loadEventPlan()
+    if _tag in plan:
+        return plan[_tag]['events'],plan[_tag]['runs']
+    return defaultEvents(_tag)
+
+def requiredEvents(rate,efficiency,upperLimit):
+
+    # the events to simulate to reach the targets, with the upper limit of
+    # the efficiency standing in when no event triggered
+    required = []
+    if arguments['--targetDays']:
+        required.append(rate*float(arguments['--targetDays'])*86400.)
+    if arguments['--targetError']:
+        required.append(1./float(arguments['--targetError'])**2/(efficiency if efficiency>0 else upperLimit))
+    return min(required)
+
+def planEvents():
+
+    # writes the events per run and number of runs of each tag in the
+    # triggers table to the event plan
+    global eventPlan
+    if not arguments['--targetDays'] and not arguments['--targetError']:
+        print('--plan needs --targetDays and/or --targetError')
+        return 1
+    infile = 'button_background_triggers%s.csv'%(additionalString)
+    if not os.path.exists(infile):
+        print('No trigger table %s, run -M --triggers on a first production first'%(infile))
+        return 1
+    df = pd.read_csv(infile)
+    if "{Tag}" not in df.columns:
+        print('%s has no {Tag} column, rerun --triggers to rewrite it'%(infile))
+        return 1
+
+    plan = {}
+    print('%-40s %12s %10s %14s %8s %10s %10s'%('event type','events','efficiency','planned events','runs','days','rel. error'))
+    for _,row in df.iterrows():
+        _tag = row["{Tag}"]
+        if _tag not in rates or row["{Events}"]<=0:
+            continue
+        rate = rates[_tag][0]
+        efficiency = row[planTriggers]/row["{Events}"]
+        upperLimit = zeroTriggers/row["{Events}"]
+        events = requiredEvents(rate,efficiency,upperLimit)
+        # runs of the usual size, with the events spread evenly over them
+        perRun,runs = defaultEvents(_tag)
+        runs = max(1,int(ceil(events/max(perRun,1))))
+        perRun = max(1,int(ceil(events/runs)))
+        total = perRun*runs
+        triggered = total*(efficiency if efficiency>0 else upperLimit)
+        plan[_tag] = {'events':perRun,'runs':runs,'efficiency':efficiency,'days':total/rate/86400.,'error':1./sqrt(triggered)}
+        print('%-40s %12d %10.2e %14d %8d %10.2f %10.3f'%(_tag,row["{Events}"],efficiency,total,runs,plan[_tag]['days'],plan[_tag]['error']))
+
+    if not plan:
+        print('No event types of %s are simulated with these options'%(infile))
+        return 1
+    # the share of the planned events, as a proxy of the CPU time
+    total = sum(plan[_t]['events']*plan[_t]['runs'] for _t in plan)
+    print('\nPlanned %d events in %d runs'%(total,sum(plan[_t]['runs'] for _t in plan)))
+    for _tag in sorted(plan,key=lambda _t:-plan[_t]['events']*plan[_t]['runs'])[:5]:
+        print('  %5.1f%% %s'%(100.*plan[_tag]['events']*plan[_tag]['runs']/total,_tag))
+    with open(eventPlanFile()+'.tmp','w') as f:
+        json.dump(plan,f,indent=1)
+    os.replace(eventPlanFile()+'.tmp',eventPlanFile())
+    print('Wrote %s; run -m -j to write the macros and jobs of the plan'%(eventPlanFile()))
+    # the plan is read again by -m and -j in the same invocation
+    eventPlan = None
+    return 0
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+import time
+from .load import arguments
+
+# Output of the long loops over cut cells. The verbosity is the number of -v
+# flags given:
+#   0  a progress line with the cells per second and the time left
+#   1  also a summary line for each map
+#   2  also a line for every cell
+# With --cellLog=<file>, a JSON record of every cell is appended to the file
+# (one per line) whatever the verbosity.
+
+verbosity = int(arguments['-v'] or 0)
+# seconds between progress lines: a terminal line is updated in place,
+# a log file gets a new line
+interactive = sys.stdout.isatty()
+progressInterval = 1. if interactive else 30.
+cellLogFd = None
+
+def detail(level,*args):
+
+    # prints at verbosity level and above
+    if verbosity>=level:
+        print(*args)
+
+def formatSeconds(seconds):
+
+    if seconds==float('inf'):
+        return '--:--:--'
+    seconds = int(seconds)
+    return '%d:%02d:%02d'%(seconds//3600,seconds//60%60,seconds%60)
+
+def startProgress(label,total,unit='cells'):
+
+    now = time.time()
+    return {'label':label,'total':total,'unit':unit,'done':0,'start':now,'last':now}
+
+def printProgress(progress,line):
+
+    if interactive and verbosity==0:
+        # overwrite the previous progress line
+        print('\r%-79s'%(line),end='',flush=True)
+    else:
+        print(line,flush=True)
+
+def advanceProgress(progress,n=1):
+
+    # counts n more cells (or maps) done and prints the progress line at
+    # most once per progressInterval
+    progress['done'] += n
+    now = time.time()
+    if now-progress['last']<progressInterval:
+        return
+    progress['last'] = now
+    elapsed = now-progress['start']
+    rate = progress['done']/elapsed if elapsed>0 else 0.
+    left = (progress['total']-progress['done'])/rate if rate>0 else float('inf')
+    printProgress(progress,'%s: %d/%d %s, %.0f %s/s, %s left'%(progress['label'],progress['done'],progress['total'],progress['unit'],rate,progress['unit'],formatSeconds(left)))
+
+def finishProgress(progress):
+
+    elapsed = time.time()-progress['start']
+    rate = progress['done']/elapsed if elapsed>0 else 0.
+    printProgress(progress,'%s: %d %s in %s, %.0f %s/s'%(progress['label'],progress['done'],progress['unit'],formatSeconds(elapsed),rate,progress['unit']))
+    if interactive and verbosity==0:
+        print('')
+
+def logCells(records):
+
+    # appends the records (dicts) to the --cellLog file in one write, so
+    # that the lines of parallel workers do not interleave
+    global cellLogFd
+    if not arguments['--cellLog'] or not records:
+        return
+    if cellLogFd is None:
+        cellLogFd = os.open(arguments['--cellLog'],os.O_WRONLY|os.O_CREAT|os.O_APPEND,0o644)
+    os.write(cellLogFd,''.join(json.dumps(_r)+'\n' for _r in records).encode())
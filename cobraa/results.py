@@ -0,0 +1,81 @@
+import pandas as pd
+from .globals import *
+
+# Columnar store of the sensitivity scan. Every cell of the scan (one row
+# per scenario and combination of cuts) is written with its cut values, the
+# signal and background rates with their statistical and systematic errors
+# and the metric values to sensitivity_results.npz, next to the ROOT
+# histograms, so that the scan can be explored with --query without
+# rerunning --sensitivity.
+
+def resultsTableFile():
+
+    if arguments['--core']:
+        return "core_root_files%s/sensitivity_results.npz"%(additionalString)
+    return "reconstructed_root_files%s/sensitivity_results.npz"%(additionalString)
+
+def resultsColumns(scenario,mapCuts,cellCuts,arrays):
+
+    # flattens arrays of shape (maps, cells) into the columns of the table,
+    # with the cut values of each row
+    nmaps,ncells = len(mapCuts),len(cellCuts)
+    mapCuts = np.array(mapCuts,dtype=float)
+    cellCuts = np.array(cellCuts,dtype=float)
+    columns = {'scenario':np.full(nmaps*ncells,scenario)}
+    for i,_c in enumerate(('delayed','dT','maxEp','g')):
+        columns[_c] = np.repeat(mapCuts[:,i],ncells)
+    for i,_c in enumerate(('fid','prompt')):
+        columns[_c] = np.tile(cellCuts[:,i],nmaps)
+    for _c in arrays:
+        columns[_c] = np.asarray(arrays[_c]).reshape(nmaps*ncells)
+    return columns
+
+def writeResultsTable(tables):
+
+    # writes the rows of one or more resultsColumns() tables
+    outfile = resultsTableFile()
+    # columns only evaluated for some of the tables are nan in the others
+    names = list(tables[0])+[_c for _t in tables[1:] for _c in _t if _c not in tables[0]]
+    names = list(dict.fromkeys(names))
+    columns = {_c:np.concatenate([_t[_c] if _c in _t else np.full(len(_t['scenario']),np.nan) for _t in tables]) for _c in names}
+    # write to a temporary file first, so that an interrupted write leaves
+    # the previous table
+    with open(outfile+'.tmp','wb') as f:
+        np.savez(f,**columns)
+    os.replace(outfile+'.tmp',outfile)
+    print('Wrote %d scan cells to %s'%(len(columns['scenario']),outfile))
+    return 0
+
+def loadResultsTable():
+
+    infile = resultsTableFile()
+    if not os.path.exists(infile):
+        print('No sensitivity results table %s, run --sensitivity first'%(infile))
+        return None
+    with np.load(infile) as data:
+        return pd.DataFrame({_c:data[_c] for _c in data.files})
+
+def queryResults():
+
+    # filters the cells of the results table with a pandas query expression
+    # and prints the best ones, ranked by --rank (- for descending)
+    df = loadResultsTable()
+    if df is None:
+        return 1
+    if arguments['--rank']:
+        rank = arguments['--rank']
+    elif arguments['--optimiseSoB']:
+        rank = '-sob'
+    else:
+        rank = 't3sig'
+    ascending = not rank.startswith('-')
+    rank = rank.lstrip('-')
+    if rank not in df.columns:
+        print('No column %s in the results table; columns are %s'%(rank,', '.join(df.columns)))
+        return 1
+    selected = df.query(arguments['--query'])
+    selected = selected.sort_values(rank,ascending=ascending,kind='stable')
+    print('%d of %d cells match "%s", ranked by %s%s:\n'%(len(selected),len(df),arguments['--query'],'' if ascending else '-',rank))
+    with pd.option_context('display.max_columns',None,'display.width',250):
+        print(selected.head(int(arguments['--top'])).to_string(index=False))
+    return 0
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor,as_completed
+from .globals import *
+from .progress import *
+from .planning import *
+
+# Local job runner. Instead of sourcing every job/job*.sh one after the
+# other, --run-jobs runs the simulation scripts written by -j in a pool of
+# at most --cores simultaneous runs. Each run gets a fixed name (passed to
+# the script as TMPNAME, so its output is run<name>.root) and a marker file
+# in job/done once it exits cleanly with its output written. Runs with a
+# marker are skipped when --run-jobs is invoked again, and failed runs are
+# retried up to --retries times.
+# The runs are those of the manifest written by -j, whose lines are also
+# the indices of the array job submitted to a cluster. Each run has a fixed
+# random seed (passed to the script as SEED), so a run repeated after a
+# failure simulates the same events.
+
+# the seeds of the runs of an event type are consecutive from a start given
+# by a hash of --seed and its tag, so that they do not change with the runs
+# of other types or the order of the rates. They stay below the 9e8 that
+# the CLHEP engines (HepJamesRandom) take without folding seeds together,
+# well within 32 bit seeds.
+runSeedRange = 900000000
+
+def tagSeed(_tag):
+
+    # the hash of --seed and the tag, the same in every session
+    return int(hashlib.sha1(('%s:%s'%(arguments['--seed'],_tag)).encode()).hexdigest()[:8],16)
+
+def runSeed(_tag,i):
+
+    # the seed of run i of a tag, in [1, runSeedRange)
+    return 1+(tagSeed(_tag)+i)%(runSeedRange-1)
+
+def duplicateSeeds(runs):
+
+    # the tags of the runs whose seed is also the seed of another run,
+    # reported with the option to change
+    tags = {}
+    for run in runs:
+        tags.setdefault(run[5],[]).append(run[0])
+    clashes = sorted(set(_t for _seed in tags if len(tags[_seed])>1 for _t in tags[_seed]))
+    if clashes:
+        print('The runs of %s share random seeds; choose another --seed'%(', '.join(clashes)))
+    return clashes
+
+def localRuns():
+
+    # the runs of the scripts written by generateJobs(): (tag, script, run
+    # name, output file, log file, seed)
+    directory = os.getcwd()
+    runs = []
+    singlesscript = f"{directory}/job/script{additionalString}_singles.sh".replace(" ","")
+    for _p in proc:
+        for _loc in proc[_p]:
+            for _element in d[_p][_loc]:
+                _element = _element.replace(" ","")
+                _tag = f"{_element}_{_loc}_{_p}".replace(" ","")
+                if arguments['--singles'] or not ('NA' in _p or 'RADIOGENIC' in _p or 'singles' in _p):
+                    script = f"{directory}/job/script{additionalString}_{_tag}.sh".replace(" ","")
+                elif 'singles' in _p:
+                    # the sets of runs of the singles script
+                    script = singlesscript
+                else:
+                    # simulated within the singles script
+                    continue
+                for i in range(plannedEvents(_tag)[1]):
+                    name = '%05d'%(i)
+                    runs.append((_tag,script,name,\
+                                 f"{filetype}_root_files{additionalString}/{_tag}/run{name}.root",\
+                                 f"log{additionalString}/{_tag}/runner{name}.log",\
+                                 '%d'%(runSeed(_tag,i))))
+    return runs
+
+def manifestFile():
+
+    return f"job/manifest{additionalString}.txt".replace(" ","")
+
+def manifestContent(runs):
+
+    # one line per run: tag, script, run name, output, log, seed and done
+    # marker
+    return ''.join(' '.join(run+(doneMarker(run),))+'\n' for run in runs)
+
+def readManifest():
+
+    # the runs of the manifest, or None without one
+    if not os.path.exists(manifestFile()):
+        return None
+    with open(manifestFile()) as f:
+        return [tuple(_l.split()[:6]) for _l in f if _l.strip()]
+
+def doneMarker(run):
+
+    _tag,script,name,output,log,seed = run
+    return f"job/done{additionalString}/{_tag}_{name}.done".replace(" ","")
+
+def runDone(run):
+
+    # a run is done once it has its marker and its output
+    return os.path.exists(doneMarker(run)) and os.path.exists(run[3])
+
+def executeRun(run):
+
+    # runs the script once with the run's name and seed, returning the
+    # exit code
+    _tag,script,name,output,log,seed = run
+    start = time.time()
+    env = dict(os.environ,TMPNAME=name,SEED=seed)
+    os.makedirs(os.path.dirname(log),exist_ok=True)
+    with open(log,'w') as f:
+        returncode = subprocess.run(['bash',script],env=env,stdout=f,stderr=subprocess.STDOUT).returncode
+    if returncode==0 and os.path.exists(output) and os.path.getsize(output)>0:
+        with open(doneMarker(run),'w') as f:
+            json.dump({'script':script,'output':output,'seed':int(seed),'seconds':time.time()-start},f)
+    return returncode
+
+def runJobs():
+
+    # runs the local jobs in parallel with retries, skipping finished runs
+    if arguments['--cluster']!='local':
+        print('--run-jobs runs the local jobs; submit the jobs for %s with its scheduler'%(arguments['--cluster']))
+        return 1
+    if arguments['--cores']:
+        cores = int(arguments['--cores'])
+    elif hasattr(os,'sched_getaffinity'):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count()
+    retries = int(arguments['--retries'])
+    runs = readManifest()
+    if runs is None:
+        print('No manifest %s; generate the jobs with -j first'%(manifestFile()))
+        return 1
+    missing = sorted(set(_r[1] for _r in runs if not os.path.exists(_r[1])))
+    if missing:
+        print('No script %s; generate the jobs with -j first'%(', '.join(missing)))
+        return 1
+    os.makedirs(f"job/done{additionalString}".replace(" ",""),exist_ok=True)
+    pending = [_r for _r in runs if not runDone(_r)]
+    print('%d of %d runs already done, running %d on %d cores'%(len(runs)-len(pending),len(runs),len(pending),cores))
+
+    for attempt in range(retries+1):
+        if not pending:
+            break
+        if attempt>0:
+            print('Retrying %d failed runs (attempt %d of %d)'%(len(pending),attempt+1,retries+1))
+        progress = startProgress('Runs',len(pending),'runs')
+        failed = []
+        with ThreadPoolExecutor(max_workers=cores) as pool:
+            futures = {pool.submit(executeRun,_r):_r for _r in pending}
+            for future in as_completed(futures):
+                run = futures[future]
+                returncode = future.result()
+                if not runDone(run):
+                    detail(1,'Run %s of %s failed (exit code %d), see %s'%(run[2],run[0],returncode,run[4]))
+                    failed.append(run)
+                advanceProgress(progress)
+        finishProgress(progress)
+        pending = failed
+
+    if pending:
+        print('%d runs failed after %d attempts:'%(len(pending),retries+1))
+        for run in pending:
+            print('  %s run %s, log %s'%(run[0],run[2],run[4]))
+        return 1
+    print('All %d runs done'%(len(runs)))
+    return 0
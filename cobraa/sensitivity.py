@@ -1,11 +1,15 @@
 from decimal import *
+import re
 from numpy import max
 
-from ROOT import TH2D,TFile,TF1
+from ROOT import TH2D,TFile
 
 from .load import *
 from .coincidence import *
 from .globals import *
+from .results import *
+from .toys import *
+from .progress import *
 from math import fabs
 # This performs the final sensitivity calculations for the reactor analysis. 
 # Author Liz Kneale (2021)
@@ -42,6 +46,14 @@ def calculateSensitivity():
     hli9 = {}
     hn17 = {}
     hgeo = {}
+    # the histograms and their name prefix for each component of the rates
+    rateHists = {'acc':(hacc,'hAcc'),'signal':(hibd,'hIBD'),'reacIBDbg':(hibdBG,'hIBDBG'),'geoIBDbg':(hgeo,'hGeo'),\
+                 'fn':(hfn,'hFN'),'li9':(hli9,'hRNli'),'n17':(hn17,'hRNn')}
+    # the pn_ibd maps of each reactor, for the comparison of signal scenarios
+    ibdComponents = {}
+
+    scenario = selectedScenario()
+    print('Signal scenario: %s'%(scenarioName(scenario)))
 
     print('Reading in root tree')
     # get the results of previous steps      
@@ -52,6 +64,19 @@ def calculateSensitivity():
     resultsFile = TFile(resultsstr,"READ")
     print('reading in coincidence maps from %s'%(resultsstr))
 
+    # read every map needed by the scan in one pass over the file keys
+    needed = set()
+    for delayed_nxcut,dTcut,maxEp,gcut in product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(minEpmax,rangeEpmax,binwidthEpmax),drange(gmin,rangeGmax,binwidthG)):
+        for _p in proc:
+            for _loc in proc[_p]:
+                for _element in d[_p][_loc]:
+                    _str = "%s_%s_%s"%(_element,_loc,_p)
+                    _str = _str.replace(" ","")
+                    if 'pn_ibd' in _str or 'A_Z' in _str or 'FASTNEUTRONS' in _str or 'singles' in _str:
+                        needed.add(mapCoordinates(_str,delayed_nxcut,dTcut,maxEp,gcut))
+    maps = loadCoincidenceMaps(resultsFile,needed)
+    progress = startProgress('Reading maps',len(list(product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(minEpmax,rangeEpmax,binwidthEpmax),drange(gmin,rangeGmax,binwidthG)))),'maps')
+
     for delayed_nxcut,dTcut,maxEp,gcut in product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(minEpmax,rangeEpmax,binwidthEpmax),drange(gmin,rangeGmax,binwidthG)):
     #for delayed_nxcut,dTcut,maxEp,gcut in product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(gmin,rangeGmax,binwidthG)):
 
@@ -88,131 +113,38 @@ def calculateSensitivity():
                     _tag = _tag.replace(" ","")
                     _str = "%s_%s_%s"%(_element,_loc,_p)
                     _str = _str.replace(" ","")
+                    coords = mapCoordinates(_str,delayed_nxcut,dTcut,maxEp,gcut)
+                    if coords not in maps and coords in needed:
+                        # already reported as missing
+                        continue
                     if 'pn_ibd' in _tag or 'A_Z' in _tag or 'FASTNEUTRONS' in _tag:
-                        print('correlated event, getting %s from %s'%(_tag,resultsstr))
-                        hist[_tag] = resultsFile.Get(_tag)
+                        detail(2,'correlated event, getting %s from %s'%(_tag,resultsstr))
+                        hist[_tag] = maps[coords]
                     elif 'singles' in _tag:
-                        print('uncorrelated event, getting %s from %s'%(_tag,resultsstr))
-                        hist[_tag] = resultsFile.Get(_tag)
+                        detail(2,'uncorrelated event, getting %s from %s'%(_tag,resultsstr))
+                        hist[_tag] = maps[coords]
                     else:
-                        print('Neither correlated nor uncorrelated, %s\n'%(_tag))
+                        detail(2,'Neither correlated nor uncorrelated, %s\n'%(_tag))
                         continue
 
                     try:
-                        #print(' entries:',hist[_tag].GetEntries(),' ... ', end = '')
-                        if 'singles' in _tag:
-                            print('%s, identified as accidentals'%(_tag))
-                            hacc["hAcc%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                        elif 'pn_ibd' in _tag:
-                            print('%s identified as IBD pair events'%(_tag))
-                            if 'geo' in _tag:
-                                hgeo["hGeo%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            if arguments["--GSH"]:
-                                if 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    print('Adding %s to ibd signal'%(_tag))
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag:
-                                    print('Adding %s to ibd bg'%(_tag))
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments["--GH"]:
-                                if 'gravelines' in _tag or 'hinkley' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'sizewell' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments["--SH"]:
-                                if 'sizewell' in _tag or 'hinkley' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'gravelines' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments["--Gravelines"]:
-                                if 'gravelines' in _tag:
-                                    print('Adding %s to ibd signal'%(_tag))
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    print('Adding %s to ibd bg'%(_tag))
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments["--HinkleyC"]:
-                                if 'hinkley' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'sizewell' in _tag or 'gravelines' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments["--Sizewell"]:
-                                if 'sizewell' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'hinkley' in _tag or 'gravelines' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments["--Heysham"]:
-                                print('Calculating dwell time for Heysham signal (all cores)')
-                                if 'heysham_full' in _tag:
-                                    print('Adding %s to ibd signal'%(_tag))
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'torness_full' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    print('Adding %s to ibd bg'%(_tag))
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-
-                            elif arguments["--HeyshamTorness"]:
-                                if 'heysham_2' in _tag or 'torness_full' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                    
-                            elif arguments["--Heysham2"]:
-                                print('Calculating dwell time for Heysham 2 signal')
-                                if 'heysham_2' in _tag:
-                                    print('Adding %s to ibd signal'%(_tag))
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'torness_full' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    print('Adding %s to ibd bg'%(_tag))
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-
-                            elif arguments["--Torness"]:
-                                if 'torness_' in _tag:
-                                    print('Adding %s to ibd signal'%(_tag))
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'heysham_2' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    print('Adding %s to ibd bg'%(_tag))
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-
-                            elif arguments['--Hartlepool1']:
-                                if 'hartlepool_1' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'hartlepool_2' in _tag or 'heysham_full' in _tag or 'torness_full' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            elif arguments['--Hartlepool2']:
-                                if 'hartlepool_2' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'hartlepool_1' in _tag or 'heysham_full' in _tag or 'torness_full' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                            else:
-                                if 'hartlepool_1' in _tag or 'hartlepool_2' in _tag:
-                                    hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                elif 'boulby_worldbg' in _tag or 'heysham_full' in _tag or 'torness_full' in _tag or 'gravelines' in _tag or 'sizewell' in _tag or 'hinkley' in _tag:
-                                    hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-
-                        elif 'FASTNEUTRONS' in _tag:
-                            hfn["hFN%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                        elif 'A_Z' in _tag:
-                            # scale by fraction surviving with 1 second after
-                            # muon detected in fiducial (Study on the effect of varying veto
-                            # thickness on the sensitivity of Gd-H2O filled tank, F. Sutanto),
-                            # adjusted to 95% muon-detection efficiency with passive veto
-                            # (Radionuclide Rates, E. Kneale 
-                            # https://ait-neo.llnl.gov/confluence/pages/viewpage.action?pageId=10191240)
-                            if 'li9' in _tag:
-                                hist[_tag].Scale(0.069)
-                                hli9["hRNli%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                                hli9.Draw()
-                            elif 'n17' in _tag:
-                                hist[_tag].Scale(0.85)
-                                hn17["hRNn%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],1)
-                        else:
-                            print('not added to rates histogram')
+                        if 'pn_ibd' in _tag:
+                            ibdComponents.setdefault(_str,{})["%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)] = hist[_tag]
+                        components = rateComponents(_tag,scenario)
+                        for component,scale in components:
+                            detail(2,'Adding %s to %s'%(_tag,component))
+                            _hists,_prefix = rateHists[component]
+                            _hists["%s%d%d%d%d"%(_prefix,delayed_nxcut,dTcut,maxEp,gcut*10)].Add(hist[_tag],scale)
+                        if not components:
+                            detail(2,'not added to rates histogram')
                             continue
                     
 
                     except:
                         print("Could not find ",_tag,". Skipping entry.")
-                    print(" ")
+                    detail(2," ")
+        advanceProgress(progress)
+    finishProgress(progress)
     print("\nCompleted reading in of histogram, accidental and IBD identifitication. \n\n")
 
     optSignal,optBg,optSoB,optNXdelayed,optNXprompt,optDTW,optdT,optdR,optFidcut,optE,optG = -1,-1,-1,-1,-1,-1,-1,-1,-1,-1,-1
@@ -223,11 +155,77 @@ def calculateSensitivity():
 #    line,_line,_line2= ("",),"",""
     _histograms = {}
 
-    for delayed_nxcut,dTcut,maxEp,gcut in product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(minEpmax,rangeEpmax,binwidthEpmax),drange(gmin,rangeGmax,binwidthG)):
+    # the cuts of the scan, in the order of the (delayed, dT, maxEp, g)
+    # maps and of the (fiducial, prompt) cells within each map
+    mapCuts = list(product(drange(minNXdelayed,rangeNXdmax,binwidthNX),drange(dTmin,rangedTmax,binwidthdT),drange(minEpmax,rangeEpmax,binwidthEpmax),drange(gmin,rangeGmax,binwidthG)))
+    cellCuts = list(product(drange(minFid,maxFid+binwidthFid,binwidthFid),drange(minNXprompt,maxNXprompt+binwidthNX,binwidthNX)))
+    mapKeys = ["%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10) for delayed_nxcut,dTcut,maxEp,gcut in mapCuts]
+    # all the maps have the same binning
+    cutBins = np.array([hibd["hIBD"+mapKeys[0]].FindBin(fidcut,prompt_nxcut) for fidcut,prompt_nxcut in cellCuts])
+
+    # load the maps once into arrays of shape (maps, cells)
+    signal,signalError = mapArrays(hibd,"hIBD",mapKeys,cutBins)
+    accRate,accError = mapArrays(hacc,"hAcc",mapKeys,cutBins)
+    fnRate,fnError = mapArrays(hfn,"hFN",mapKeys,cutBins)
+    reacibdBgRate,reacibdBgError = mapArrays(hibdBG,"hIBDBG",mapKeys,cutBins)
+    geoibdBgRate,geoibdBgError = mapArrays(hgeo,"hGeo",mapKeys,cutBins)
+    li9Rate,li9Error = mapArrays(hli9,"hRNli",mapKeys,cutBins)
+    n17Rate,n17Error = mapArrays(hn17,"hRNn",mapKeys,cutBins)
+    bgRates = {'acc':accRate,'fn':fnRate,'li9':li9Rate,'n17':n17Rate,'reacIBDbg':reacibdBgRate,'geoIBDbg':geoibdBgRate}
+    bgErrors = {'acc':accError,'fn':fnError,'li9':li9Error,'n17':n17Error,'reacIBDbg':reacibdBgError,'geoIBDbg':geoibdBgError}
+    model = backgroundModel(bgRates,bgErrors)
+    rnRate,rnError = model['rn'],model['rnError']
+    fnSysError,rnSysError = model['fnSysError'],model['rnSysError']
+    reacibdBgSysError,geoibdBgSysError = model['reacIBDbgSysError'],model['geoIBDbgSysError']
+    background,bgError,totSysError = model['background'],model['bgError'],model['totSysError']
+
+    # calculate the signal over background and/or dwell time metric and
+    # find the optimal cuts
+    sob,t3sig,valid,candidate,best,opt = optimiseCuts(signal,background,totSysError)
+    # TODO get correct error for all metrics
+    sobError = np.ones(sob.shape)
+    # every cell of the scan, for the results table
+    tables = [resultsColumns(scenarioName(scenario),mapCuts,cellCuts,{'signal':signal,'signalError':signalError,\
+            'background':background,'bgError':bgError,'totSysError':totSysError,'acc':accRate,'accError':accError,\
+            'fn':fnRate,'fnError':fnError,'fnSysError':fnSysError,'rn':rnRate,'rnError':rnError,'rnSysError':rnSysError,\
+            'reacIBDbg':reacibdBgRate,'reacIBDbgError':reacibdBgError,'reacIBDbgSysError':reacibdBgSysError,\
+            'geoIBDbg':geoibdBgRate,'geoIBDbgError':geoibdBgError,'geoIBDbgSysError':geoibdBgSysError,\
+            'sob':sob,'t3sig':t3sig,'valid':valid,'candidate':candidate})]
+
+    if arguments['--allScenarios']:
+        # every signal scenario from the same maps: only the reactor IBD
+        # signal and background (and its systematic) change
+        names = sorted(ibdComponents)
+        ibdRates,ibdErrors = componentArrays(ibdComponents,names,mapKeys,cutBins)
+        signalWeights,bgWeights = scenarioWeights(names)
+        print('\nComparison of signal scenarios (* is the scenario used for the results below):')
+        print('%-16s %10s %10s %10s %10s %6s %4s %4s %4s %4s %4s'%('scenario','dwell time','S/sqrt(B)','S','B','fid','NXp','NXd','dT','maxE','g'))
+        for i,_scenario in enumerate(signalScenarios):
+            _signal = np.tensordot(signalWeights[i],ibdRates,1)
+            _reacibdBg = np.tensordot(bgWeights[i],ibdRates,1)
+            _reacibdBgError = sqrt(np.tensordot(bgWeights[i],ibdErrors**2,1))
+            _model = backgroundModel(dict(bgRates,reacIBDbg=_reacibdBg),dict(bgErrors,reacIBDbg=_reacibdBgError))
+            _background,_totSysError = _model['background'],_model['totSysError']
+            _sob,_t3sig,_valid,_candidate,_best,_opt = optimiseCuts(_signal,_background,_totSysError)
+            if _scenario!=scenario:
+                _signalError = sqrt(np.tensordot(signalWeights[i],ibdErrors**2,1))
+                tables.append(resultsColumns(scenarioName(_scenario),mapCuts,cellCuts,{'signal':_signal,'signalError':_signalError,\
+                        'background':_background,'bgError':_model['bgError'],\
+                        'totSysError':_totSysError,'acc':accRate,'accError':accError,\
+                        'fn':fnRate,'fnError':fnError,'fnSysError':fnSysError,'rn':rnRate,'rnError':rnError,'rnSysError':rnSysError,\
+                        'reacIBDbg':_reacibdBg,'reacIBDbgError':_reacibdBgError,'reacIBDbgSysError':_model['reacIBDbgSysError'],\
+                        'geoIBDbg':geoibdBgRate,'geoIBDbgError':geoibdBgError,'geoIBDbgSysError':geoibdBgSysError,\
+                        'sob':_sob,'t3sig':_t3sig,'valid':_valid,'candidate':_candidate}))
+            name = ('* ' if _scenario==scenario else '  ')+scenarioName(_scenario)
+            if _opt is None:
+                print('%-16s no valid cuts'%(name))
+                continue
+            m,c = np.unravel_index(_opt,_sob.shape)
+            print('%-16s %10.1f %10.4f %10.4f %10.4f %6.1f %4d %4d %4d %4d %4.1f'%(name,_t3sig[m,c],_sob[m,c],_signal[m,c],_background[m,c],cellCuts[c][0],cellCuts[c][1],mapCuts[m][0],mapCuts[m][1],mapCuts[m][2],mapCuts[m][3]))
+        print('')
+
+    for m,(delayed_nxcut,dTcut,maxEp,gcut) in enumerate(mapCuts):
         
-        binR = hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetNbinsX()
-        binN = hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetNbinsY()
-
         _histograms["sOverB%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)]= hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Clone()
         _histograms["sOverB%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetZTitle('signal/sqrt(signal+background)')
         _histograms["sOverB%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetYTitle('%s cut on prompt'%(energyEstimator))
@@ -248,205 +246,71 @@ def calculateSensitivity():
         _histograms["background%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetName('hBackground%d%d%d%d'%(delayed_nxcut,dTcut,maxEp,gcut*10))
         _histograms["background%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Reset()
 
-
+        # fill the valid cells of the map
+        setBins(_histograms["sOverB%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)],cutBins[valid[m]],sob[m][valid[m]],sobError[m][valid[m]])
+        setBins(_histograms["signal%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)],cutBins[valid[m]],signal[m][valid[m]],signalError[m][valid[m]])
+        setBins(_histograms["background%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)],cutBins[valid[m]],background[m][valid[m]],bgError[m][valid[m]])
 
         maxSoB,maxBg,maxSignal,maxBackground,maxNXd,maxNXp,maxFidcut,maxdT,maxdR,maxE,maxG = -1,-1,-1,-1,-1,-1,-1,-1,-1,-1,-1
-        maxFnSysErr,maxIBDbgSysErr,maxRnSysErr,maxTotSysErr,maxt3sig,t3sig = -1,-1,-1,-1,1000000.,0
-
-        for fidcut in drange(minFid,maxFid+binwidthFid,binwidthFid):
-            for prompt_nxcut in drange(minNXprompt,maxNXprompt+binwidthNX,binwidthNX):
-                # get the signal rates
-                cutBin   = hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].FindBin(fidcut,prompt_nxcut)
-                signal  = hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                signalError = hibd["hIBD%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-
-                # now get the background rates
-                # first get the individual background contributions
-                # at each cut value
-                accRate  = hacc["hAcc%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                accError = hacc["hAcc%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-                fnRate   = hfn["hFN%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                fnError = hfn["hFN%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-                reacibdBgRate = hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                reacibdBgError = hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-                geoibdBgRate = hgeo["hGeo%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                geoibdBgError = hgeo["hGeo%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-                li9Rate = hli9["hRNli%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                li9Error = hli9["hRNli%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-                n17Rate = hn17["hRNn%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinContent(cutBin)
-                n17Error = hn17["hRNn%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].GetBinError(cutBin)
-                rnRate = li9Rate+n17Rate
-                rnError = sqrt(li9Error**2+n17Error**2)
-
-                # now we need to deal with systematic uncertainties
-		# fractional systematic uncertainty on fast neutron rate (27%)
-                fnSysError = fnRate*0.27
-                # radionuclide systematics are somewhat more complex
-                eMuSysError = (264/270.)**0.73*(log(264/270.)*0.1) #error on E=264GeV:0.73*264*sigmaEmu (not included); 0.1 error on 0.73 power: 264**0.73 * log(264)*0.1
-                liSysError = li9Rate*sqrt(0.15e-8**2/4.09e-8+(eMuSysError**2)/((264/270.)**0.73))
-                n17SysError = n17Rate*sqrt((0.15e-8**2)/4.09e-8+(eMuSysError**2)/((264/270.)**0.73))# error on muon flux and energy dependence
-                rnSysError = sqrt(liSysError**2 + n17SysError**2)
-                # fractional systematic uncertainties on IBD backgrounds (6% and 25%)
-                reacibdBgSysError = reacibdBgRate*0.06
-                geoibdBgSysError = geoibdBgRate*0.25
-
-                # then get the total background rates (inc error rates)
-                background = accRate + rnRate + reacibdBgRate +fnRate + geoibdBgRate # background rate
-                bgError = sqrt(pow(accError,2)+pow(rnError,2)+pow(reacibdBgError,2)+pow(fnError,2)+pow(geoibdBgError,2))
-                totSysError = sqrt(rnSysError*rnSysError+fnSysError*fnSysError+reacibdBgSysError*reacibdBgSysError+geoibdBgSysError*geoibdBgSysError)
-
-                print("** Signal : ",signal)
-                print("** Background : %.3e +/- %.3e" %(background,totSysError))
-                #print("** Background Components : \n Accidentals : %.3e +/- %.3e \n Fast Neutrons : %.3e +/- %.3e \n Reactor Background IBD : %.3e +/- %.3e \n Boulby Geo : %.3e +/- %.3e \n Li9 : %.3e +/- %.3e \n N17 : %.3e +/- %.3e" %(accRate,accError,fnRate,fnError,reacibdBgRate,reacibdBgError,geoibdBgRate,geoibdBgError,li9Rate,li9Error,n17Rate,n17Error))
-                #print("^^^^^^^^^^ ",accRate,fnRate,reacibdBgRate,geoibdBgRate,li9Rate,n17Rate,rnRate)
-                #print("&&&&&&&&&&& ",accError,fnError,reacibdBgError,geoibdBgError,li9Error,n17Error,rnError)
-
-		# calculate the signal over background and/or dwell time metric
-                if arguments['--poissonpoisson']:
-		    # poisson significance with poisson systematic uncertainty on backgrounds
-                    try:
-                        sob = sqrt(2*((signal+background)*log((signal+background)*(background+ totSysError**2)/(background**2+(signal+background)*totSysError**2))-background**2/totSysError**2 * log(1 + (totSysError**2*signal/(background*(background + totSysError**2))))))
-                    except:
-                        continue
-                elif arguments['--poisson']:
-		    # poisson significance with gaussian systematic uncertainty on backgrounds
-                    try:
-                        B_hat = 0.5*(background-pow(totSysError,2)+sqrt(pow(background,2)-2*totSysError*pow(totSysError,2)+4*(signal+background)*pow(totSysError,2)+pow(totSysError,4)))
-                        sob = sqrt(-2*((signal+background)*log(B_hat/(signal+background))-pow(background-B_hat,2)/(2*pow(totSysError,2))-B_hat+signal+background))
-                    except:
-                        continue
-                    #t3sig = poissonTime(signal,background,totSysError)
-                    
-                elif arguments['--knoll']:
-		    # time to 3 sigma positive detection at 95% confidence level
-                    if arguments['--2sigma']:
-                        ton=((1.28*sqrt(2*background*(RonOff+1))+2*sqrt(signal*RonOff+2*background*(RonOff+1)))/(signal*RonOff))**2
-                        toff=((1.28*sqrt(2*background*(1+1/RonOff))+2*sqrt(signal/RonOff+2*background*(1+1/RonOff)))/signal)**2
-                    else:
-                        ton=((1.645*sqrt(2*background*(RonOff+1))+3*sqrt(signal*RonOff+2*background*(RonOff+1)))/(signal*RonOff))**2
-                        toff=((1.645*sqrt(2*background*(1+1/RonOff))+3*sqrt(signal/RonOff+2*background*(1+1/RonOff)))/signal)**2
-
-                    t3sig=(2+RonOff)*toff
-                    sob=-1
-                elif arguments['--measurement']:
-                    sysError = signal*0.06
-                    sob = signal/sqrt(signal+sysError**2 + background+totSysError**2)
-                    t3sig = 9*(signal + background) / ( signal**2 - 9*(sysError**2 + totSysError**2))
-                else:
-		    # gaussian significance
-                    sob = signal/sqrt(background+totSysError**2)
-                    if arguments['--2sigma']:
-                        t3sig = 4.*background/(signal**2-4.*totSysError**2)
-                    else:
-                        t3sig = 9.*background/(signal**2-9.*totSysError**2)
-                try:
-		    # TODO get correct error for all metrics
-                    sobError = sqrt(pow(signalError/signal,2)+pow(sqrt_s_plus_b_error/sqrt(signal+background),2))*sob
-                except: 
-                    sobError = 1
-
-                _histograms["sOverB%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetBinContent(cutBin,sob)
-                _histograms["signal%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetBinContent(cutBin,signal)
-                _histograms["background%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetBinContent(cutBin,background)
-                _histograms["sOverB%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetBinError(cutBin,sobError)
-                _histograms["signal%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetBinError(cutBin,signalError)
-                _histograms["background%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].SetBinError(cutBin,bgError)
-
-                if arguments['--optimiseSoB'] or arguments['--poisson'] or arguments['--poissonpoisson']:
-                    # removing the option to optimise on dwell time for poisson stats due to
-                    # multiple failures of fit -> lengthy analysis process.
-                    # find the maximum significance for each combination of NXd, maxEp, g cut
-                    if sob >maxSoB:
-                        maxt3sig = t3sig
-                        maxTotSysErr = totSysError
-                        maxSoB = sob
-                        maxNXd = delayed_nxcut
-                        maxNXp = prompt_nxcut
-                        maxSignal = signal
-                        maxBg = background
-                        maxFidcut = fidcut
-                        maxdT = dTcut
-                        maxG = gcut
-                        maxE = maxEp
-                        line = ("beta/n: Wall-dist %4.1f m, %s cut (%d,%d) g cut %f, ibd rate : %4.2f per day;"\
-                                %(maxFidcut,energyEstimator,maxNXp, maxNXd,maxG,signal),)
-                        line2 =    (" acc. rate: %4.3f per day, rn rate: %4.3f per day, fn rate: %4.3f per day (all cuts)"\
-                                %(accRate,rnRate,fnRate),)
-                        # find the overall optimal significance
-                    if sob>optSoB:
-                        optt3sig = t3sig
-                        optFnSysErr = fnSysError
-                        optRnSysErr = rnSysError
-                        optReacibdBgSysErr = reacibdBgSysError
-                        optGeoibdBgSysErr = geoibdBgSysError
-                        optSoB = sob
-                        optSignal = signal
-                        optBg     = background
-                        optNXprompt  = prompt_nxcut
-                        optNXdelayed  = delayed_nxcut
-                        optFidcut = fidcut
-                        optdT = dTcut
-                        optG  = gcut
-                        optE  = maxEp
-                        optAcc = accRate
-                        optRN = rnRate
-                        optFN = fnRate
-                        optReacibdBg = reacibdBgRate
-                        optGeoibdBg = geoibdBgRate
-                        optSigErr = signalError
-                        optBgErr = bgError
-                        optSoBErr = sobError
-                        optTotSysErr = totSysError
-                else:
-                    # find the minimum dwell time for each combination of NXd, maxEp, g cut
-                    if t3sig>0.5 and t3sig<maxt3sig:
-                        maxt3sig = t3sig
-                        maxTotSysErr = totSysError
-                        maxSoB = sob
-                        maxNXd = delayed_nxcut
-                        maxNXp = prompt_nxcut
-                        maxSignal = signal
-                        maxBg = background
-                        maxFidcut = fidcut
-                        maxdT = dTcut
-                        maxG = gcut
-                        maxE = maxEp
-                        line = ("beta/n: Wall-dist %4.1f m, %s cut (%d,%d) g cut %f, ibd rate : %4.2f per day;"\
-                                %(maxFidcut,energyEstimator,maxNXp, maxNXd,maxG,signal),)
-                        line2 =    (" acc. rate: %4.3f per day, rn rate: %4.3f per day, fn rate: %4.3f per day (all cuts)"\
-                                %(accRate,rnRate,fnRate),)
-                        # find the overall optimal s/sqrt(s+b)
-                    if t3sig>0.5 and t3sig<optt3sig:
-                        optt3sig = t3sig
-                        optFnSysErr = fnSysError
-                        optRnSysErr = rnSysError
-                        optReacibdBgSysErr = reacibdBgSysError
-                        optGeoibdBgSysErr = geoibdBgSysError
-                        optSoB = sob
-                        optSignal = signal
-                        optBg     = background
-                        optNXprompt  = prompt_nxcut
-                        optNXdelayed  = delayed_nxcut
-                        optFidcut = fidcut
-                        optdT = dTcut
-                        optG  = gcut
-                        optE  = maxEp
-                        optAcc = accRate
-                        optRN = rnRate
-                        optFN = fnRate
-                        optReacibdBg = reacibdBgRate
-                        optGeoibdBg = geoibdBgRate
-                        optSigErr = signalError
-                        optBgErr = bgError
-                        optSoBErr = sobError
-                        optTotSysErr = totSysError
-
-
-
+        maxFnSysErr,maxIBDbgSysErr,maxRnSysErr,maxTotSysErr,maxt3sig = -1,-1,-1,-1,1000000.
+        if candidate[m].any():
+            # the optimal values for this combination of NXd, dT, maxEp, g cut
+            c = best[m]
+            maxt3sig = t3sig[m,c]
+            maxTotSysErr = totSysError[m,c]
+            maxSoB = sob[m,c]
+            maxNXd = delayed_nxcut
+            maxNXp = cellCuts[c][1]
+            maxSignal = signal[m,c]
+            maxBg = background[m,c]
+            maxFidcut = cellCuts[c][0]
+            maxdT = dTcut
+            maxG = gcut
+            maxE = maxEp
 
         # print to screen the optimal values for each combination of delayed nx, goodness, maxEp and dT
-        print('Dwell time:','{0:.1f}'.format(maxt3sig),'Delayed nx:',str(maxNXd).rjust(3,' '),'prompt nx:',str(maxNXp).rjust(3,' '),'dT:',str(maxdT).rjust(3,' '),'g:',str(maxG),',S/sqrt(B+sigma_b^2)','{0:.4f}'.format(maxSoB),',(S,B,dtw):','{0:.4f}'.format(maxSignal),'{0:.4f}'.format(maxBg),'{0:.1f}'.format(maxFidcut),'{0:.1f}'.format(maxE),")")
+        detail(1,'Dwell time:','{0:.1f}'.format(maxt3sig),'Delayed nx:',str(maxNXd).rjust(3,' '),'prompt nx:',str(maxNXp).rjust(3,' '),'dT:',str(maxdT).rjust(3,' '),'g:',str(maxG),',S/sqrt(B+sigma_b^2)','{0:.4f}'.format(maxSoB),',(S,B,dtw):','{0:.4f}'.format(maxSignal),'{0:.4f}'.format(maxBg),'{0:.1f}'.format(maxFidcut),'{0:.1f}'.format(maxE),")")
         #line += (_line + _line2,)
+        if arguments['--cellLog']:
+            logCells([{'map':"%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10),'delayed':delayed_nxcut,'dT':dTcut,'maxEp':maxEp,'g':gcut,\
+                       'fid':maxFidcut,'prompt':maxNXp,'t3sig':float(maxt3sig),'sob':float(maxSoB),'signal':float(maxSignal),'background':float(maxBg)}])
+
+    if opt is not None:
+        # find the overall optimum
+        m,c = np.unravel_index(opt,sob.shape)
+        optt3sig = t3sig[m,c]
+        optFnSysErr = fnSysError[m,c]
+        optRnSysErr = rnSysError[m,c]
+        optReacibdBgSysErr = reacibdBgSysError[m,c]
+        optGeoibdBgSysErr = geoibdBgSysError[m,c]
+        optSoB = sob[m,c]
+        optSignal = signal[m,c]
+        optBg     = background[m,c]
+        optNXdelayed,optdT,optE,optG = mapCuts[m]
+        optFidcut,optNXprompt = cellCuts[c]
+        optAcc = accRate[m,c]
+        optRN = rnRate[m,c]
+        optFN = fnRate[m,c]
+        optReacibdBg = reacibdBgRate[m,c]
+        optGeoibdBg = geoibdBgRate[m,c]
+        optSigErr = signalError[m,c]
+        optBgErr = bgError[m,c]
+        optSoBErr = sobError[m,c]
+        optTotSysErr = totSysError[m,c]
+
+    ntoys = int(arguments['--toys'])
+    if ntoys>0:
+        # spread of the dwell time and significance from pseudo-experiments
+        zeros = np.zeros(signal.shape)
+        toyComponents = {'signal':(signal,signalError,zeros),'acc':(accRate,accError,zeros),\
+                         'fn':(fnRate,fnError,fnSysError),'rn':(rnRate,rnError,rnSysError),\
+                         'reacIBDbg':(reacibdBgRate,reacibdBgError,reacibdBgSysError),\
+                         'geoIBDbg':(geoibdBgRate,geoibdBgError,geoibdBgSysError)}
+        if opt is not None:
+            optimumToys(toyComponents,totSysError,(m,c),ntoys)
+        if arguments['--toysGrid']:
+            print('\nToy dwell times for all %d cells of the scan'%(signal.size))
+            tables[0]['t3sigP16'],tables[0]['t3sigP50'],tables[0]['t3sigP84'] = [_q.reshape(-1) for _q in gridToys(toyComponents,totSysError,ntoys)]
 
 
     print('\n\nMore info on the maximal sensitivity found:')
@@ -468,16 +332,8 @@ def calculateSensitivity():
     
     # calculate dwell time
     if optSignal >0:
-        if arguments['--poisson']:
-            print('Finding dwell time for signal ',optSignal)
-            # poisson with gaussian uncertainties
-            T3SIGMA = poissonTime(optSignal,optBg,optTotSysErr)
-        elif arguments['--poissonpoisson']:
-            # poisson with poisson uncertainties
-            T3SIGMA = poissonpoissonTime(optSignal,optBg,optTotSysErr)
-        else:
-            # gaussian or knoll
-            T3SIGMA = optt3sig #9.*optBg/(optSignal**2-9.*optTotSysErr**2)
+        # gaussian, knoll, or poisson from the batch solver
+        T3SIGMA = optt3sig #9.*optBg/(optSignal**2-9.*optTotSysErr**2)
     else:
         T3SIGMA = 1e999
     
@@ -503,48 +359,349 @@ def calculateSensitivity():
         hibdBG["hIBDBG%d%d%d%d"%(delayed_nxcut,dTcut,maxEp,gcut*10)].Write()
 
     f_root.Close()
+    writeResultsTable(tables)
 
     print('\n\n')
 
-def bhat(x,par):
-    Bhat = 0.5*(par[2]*x[0]-pow(par[1]*x[0],2)+sqrt(pow(par[2]*x[0],2)-2*par[1]*x[0]*pow(par[1]*x[0],2)+4*(par[0]*x[0]+par[2]*x[0])*pow(par[1]*x[0],2)+pow(par[1]*x[0],4)))
-    return Bhat
+# The reactor signal scenarios, in order of precedence of the signal options
+# (the last is the default Hartlepool signal). Each gives the pn_ibd
+# components (matched in the map names) which are the IBD signal and those
+# which are an IBD background; the other reactors are off.
+signalScenarios = [
+    ('--GSH',['gravelines','sizewell','hinkley'],['boulby_worldbg']),
+    ('--GH',['gravelines','hinkley'],['boulby_worldbg','sizewell']),
+    ('--SH',['sizewell','hinkley'],['boulby_worldbg','gravelines']),
+    ('--Gravelines',['gravelines'],['boulby_worldbg','sizewell','hinkley']),
+    ('--HinkleyC',['hinkley'],['boulby_worldbg','sizewell','gravelines']),
+    ('--Sizewell',['sizewell'],['boulby_worldbg','hinkley','gravelines']),
+    ('--Heysham',['heysham_full'],['boulby_worldbg','torness_full','gravelines','sizewell','hinkley']),
+    ('--HeyshamTorness',['heysham_2','torness_full'],['boulby_worldbg','gravelines','sizewell','hinkley']),
+    ('--Heysham2',['heysham_2'],['boulby_worldbg','torness_full','gravelines','sizewell','hinkley']),
+    ('--Torness',['torness_'],['boulby_worldbg','heysham_2','gravelines','sizewell','hinkley']),
+    ('--Hartlepool1',['hartlepool_1'],['boulby_worldbg','hartlepool_2','heysham_full','torness_full','gravelines','sizewell','hinkley']),
+    ('--Hartlepool2',['hartlepool_2'],['boulby_worldbg','hartlepool_1','heysham_full','torness_full','gravelines','sizewell','hinkley']),
+    (None,['hartlepool_1','hartlepool_2'],['boulby_worldbg','heysham_full','torness_full','gravelines','sizewell','hinkley']),
+]
+
+def selectedScenario():
+
+    # the first scenario whose option is given on the command line
+    for _scenario in signalScenarios:
+        if _scenario[0] is None or arguments[_scenario[0]]:
+            return _scenario
+
+def scenarioName(scenario):
+    if scenario[0] is None:
+        return 'Hartlepool'
+    return scenario[0].lstrip('-')
+
+def scenarioRole(scenario,_tag):
+
+    # whether the pn_ibd map is signal, background or off in the scenario
+    option,signal,background = scenario
+    if any(_r in _tag for _r in signal):
+        return 'signal'
+    elif any(_r in _tag for _r in background):
+        return 'background'
+    return 'off'
+
+def rateComponents(_tag,scenario):
+
+    # the components of the rates (and the scale) to which a coincidence map
+    # of the tag contributes in the signal scenario
+    if 'singles' in _tag:
+        return [('acc',1.)]
+    elif 'pn_ibd' in _tag:
+        components = []
+        if 'geo' in _tag:
+            components.append(('geoIBDbg',1.))
+        role = scenarioRole(scenario,_tag)
+        if role=='signal':
+            components.append(('signal',1.))
+        elif role=='background':
+            components.append(('reacIBDbg',1.))
+        return components
+    elif 'FASTNEUTRONS' in _tag:
+        return [('fn',1.)]
+    elif 'A_Z' in _tag:
+        # scale by fraction surviving with 1 second after
+        # muon detected in fiducial (Study on the effect of varying veto
+        # thickness on the sensitivity of Gd-H2O filled tank, F. Sutanto),
+        # adjusted to 95% muon-detection efficiency with passive veto
+        # (Radionuclide Rates, E. Kneale 
+        # https://ait-neo.llnl.gov/confluence/pages/viewpage.action?pageId=10191240)
+        if 'li9' in _tag:
+            return [('li9',0.069)]
+        elif 'n17' in _tag:
+            return [('n17',0.85)]
+    return []
+
+def backgroundModel(rates,errors):
+
+    # the total background rate, its statistical error and the systematic
+    # uncertainties from the rates and errors of the background components
+    # (acc, fn, li9, n17, reacIBDbg, geoIBDbg)
+    model = {}
+    model['rn'] = rates['li9']+rates['n17']
+    model['rnError'] = sqrt(errors['li9']**2+errors['n17']**2)
+
+    # now we need to deal with systematic uncertainties
+    # fractional systematic uncertainty on fast neutron rate (27%)
+    model['fnSysError'] = rates['fn']*0.27
+    # radionuclide systematics are somewhat more complex
+    eMuSysError = (264/270.)**0.73*(log(264/270.)*0.1) #error on E=264GeV:0.73*264*sigmaEmu (not included); 0.1 error on 0.73 power: 264**0.73 * log(264)*0.1
+    liSysError = rates['li9']*sqrt(0.15e-8**2/4.09e-8+(eMuSysError**2)/((264/270.)**0.73))
+    n17SysError = rates['n17']*sqrt((0.15e-8**2)/4.09e-8+(eMuSysError**2)/((264/270.)**0.73))# error on muon flux and energy dependence
+    model['rnSysError'] = sqrt(liSysError**2 + n17SysError**2)
+    # fractional systematic uncertainties on IBD backgrounds (6% and 25%)
+    model['reacIBDbgSysError'] = rates['reacIBDbg']*0.06
+    model['geoIBDbgSysError'] = rates['geoIBDbg']*0.25
+
+    # then get the total background rates (inc error rates)
+    model['background'] = rates['acc'] + model['rn'] + rates['reacIBDbg'] + rates['fn'] + rates['geoIBDbg']
+    model['bgError'] = sqrt(errors['acc']**2+model['rnError']**2+errors['reacIBDbg']**2+errors['fn']**2+errors['geoIBDbg']**2)
+    model['totSysError'] = sqrt(model['rnSysError']**2+model['fnSysError']**2+model['reacIBDbgSysError']**2+model['geoIBDbgSysError']**2)
+    return model
+
+def scenarioWeights(names):
+
+    # the signal and background weight matrices, of shape (scenarios,
+    # components), of the named pn_ibd components
+    signalWeights = np.zeros((len(signalScenarios),len(names)))
+    bgWeights = np.zeros((len(signalScenarios),len(names)))
+    for i,_scenario in enumerate(signalScenarios):
+        for j,_str in enumerate(names):
+            role = scenarioRole(_scenario,_str)
+            signalWeights[i,j] = role=='signal'
+            bgWeights[i,j] = role=='background'
+    return signalWeights,bgWeights
+
+def componentArrays(components,names,mapKeys,cutBins):
+
+    # the rates and errors of the named components as arrays of shape
+    # (components, maps, cells), from their maps keyed by cut; missing maps
+    # count as zero
+    rates = np.zeros((len(names),len(mapKeys),len(cutBins)))
+    errors = np.zeros(rates.shape)
+    for i,_str in enumerate(names):
+        for m,key in enumerate(mapKeys):
+            if key in components[_str]:
+                _rates,_errors = mapArrays(components[_str],'',[key],cutBins)
+                rates[i,m],errors[i,m] = _rates[0],_errors[0]
+    return rates,errors
+
+def optimiseCuts(signal,background,totSysError):
+
+    # the significance, dwell time and valid cells of the metric selected on
+    # the command line, the candidate cells for the optimum and the best cell
+    # of each map and overall (None if there is no candidate). Cells where
+    # the metric cannot be evaluated are not valid and are skipped.
+    sob,t3sig,valid = significance(signal,background,totSysError)
+    if arguments['--poisson'] or arguments['--poissonpoisson']:
+        # dwell times for every cell from the batch solver
+        t3sig,converged = dwellTime(signal,background,totSysError)
+        if np.count_nonzero(valid & ~converged):
+            print('Dwell time did not converge for %d of %d cells'%(np.count_nonzero(valid & ~converged),valid.size))
+
+    # the best cells have the lowest score (first in scan order on ties)
+    candidate,score = cutScore(sob,t3sig,valid)
+    best = np.argmin(score,axis=1)
+    opt = np.argmin(score) if candidate.any() else None
+    return sob,t3sig,valid,candidate,best,opt
+
+def cutScore(sob,t3sig,valid):
+
+    # the cells which can be the optimum and a score to minimise: the dwell
+    # time, or minus the significance with --optimiseSoB
+    if arguments['--optimiseSoB']:
+        candidate = valid & (sob>-1)
+        score = np.where(candidate,-sob,np.inf)
+    else:
+        candidate = valid & (t3sig>0.5) & (t3sig<1000000.)
+        score = np.where(candidate,t3sig,np.inf)
+    return candidate,score
+
+def mapCoordinates(_tag,delayed_nxcut,dTcut,maxEp,gcut):
+
+    # the (tag, estimator, delayed, dT, maxEp, g*10) coordinates of a map,
+    # truncated to integers as in the map names
+    return (_tag,energyEstimator,int(delayed_nxcut),int(dTcut),int(maxEp),int(gcut*10))
+
+def coincidenceIndex(resultsFile):
+
+    # parses the name of every coincidence map in the results file into its
+    # tag and cut coordinates. Returns {(tag, estimator, delayed, dT, maxEp,
+    # g*10): key} for the highest cycle of each map.
+    pattern = re.compile(r'^hist_(?P<tag>.+)_delayed(?P<est>[A-Za-z0-9]+?)_(?P<delayed>-?\d+)_(?P<dT>-?\d+)us_maxEp(?P<maxEp>-?\d+)_(?P<g>-?\d+)$')
+    index = {}
+    for key in resultsFile.GetListOfKeys():
+        match = pattern.match(key.GetName())
+        if not match:
+            continue
+        coords = (match.group('tag'),match.group('est'),int(match.group('delayed')),int(match.group('dT')),int(match.group('maxEp')),int(match.group('g')))
+        if coords not in index or key.GetCycle()>index[coords].GetCycle():
+            index[coords] = key
+    return index
+
+def loadCoincidenceMaps(resultsFile,needed):
+
+    # loads the maps of the needed coordinates in one sweep over the index
+    # of the results file and reports the missing ones, per tag, before the
+    # scan starts
+    index = coincidenceIndex(resultsFile)
+    print('Found %d coincidence maps for %d tags in %s'%(len(index),len(set(_c[0] for _c in index)),resultsFile.GetName()))
+    maps,missing = {},{}
+    for coords in sorted(needed):
+        if coords in index:
+            maps[coords] = index[coords].ReadObj()
+        else:
+            missing.setdefault(coords[0],[]).append(coords)
+    for _tag in missing:
+        print('Missing %d coincidence maps for %s (e.g. delayed %d, dT %d us, maxEp %d, g %d/10); skipping them'%((len(missing[_tag]),_tag)+missing[_tag][0][2:]))
+    return maps
+
+def mapArrays(hists,prefix,mapKeys,cutBins):
+
+    # the contents and errors of the given bins of each map, as arrays of
+    # shape (maps, bins)
+    contents = np.empty((len(mapKeys),len(cutBins)))
+    errors = np.empty((len(mapKeys),len(cutBins)))
+    for m,key in enumerate(mapKeys):
+        h = hists[prefix+key]
+        content = np.ndarray((h.GetSize()),'d',h.GetArray())
+        if h.GetSumw2N()>0:
+            error = sqrt(np.ndarray((h.GetSize()),'d',h.GetSumw2().GetArray()))
+        else:
+            error = sqrt(np.absolute(content))
+        contents[m] = content[cutBins]
+        errors[m] = error[cutBins]
+    return contents,errors
+
+def setBins(h,bins,values,errors):
+
+    # sets the contents and errors of the given bins of a reset histogram
+    content = np.zeros(h.GetSize())
+    content[bins] = values
+    sumw2 = np.zeros(h.GetSize())
+    sumw2[bins] = errors**2
+    if h.GetSumw2N()==0:
+        h.Sumw2()
+    h.Set(h.GetSize(),content)
+    h.GetSumw2().Set(h.GetSize(),sumw2)
+    h.ResetStats()
+    h.SetEntries(len(bins))
+    return 0
+
+def significance(signal,background,totSysError):
+
+    # the signal over background and dwell time metrics selected on the
+    # command line, for arrays of signal and background rates and background
+    # systematics. Returns the significance, the dwell time to 3 sigma (0
+    # where it is not calculated) and the cells where the metric could be
+    # evaluated (a log of a non-positive number, a zero systematic
+    # denominator or a non-finite value in the poisson metrics).
+    t3sig = np.zeros(signal.shape)
+    valid = np.ones(signal.shape,dtype=bool)
+    with np.errstate(all='ignore'):
+        if arguments['--poissonpoisson']:
+            # poisson significance with poisson systematic uncertainty on backgrounds
+            arg1 = (signal+background)*(background+ totSysError**2)/(background**2+(signal+background)*totSysError**2)
+            arg2 = 1 + (totSysError**2*signal/(background*(background + totSysError**2)))
+            sob = sqrt(2*((signal+background)*np.log(arg1)-background**2/totSysError**2 * np.log(arg2)))
+            valid = ~(arg1<=0) & ~(arg2<=0) & (totSysError!=0) & np.isfinite(sob)
+        elif arguments['--poisson']:
+            # poisson significance with gaussian systematic uncertainty on backgrounds
+            B_hat = 0.5*(background-totSysError**2+sqrt(background**2-2*totSysError*totSysError**2+4*(signal+background)*totSysError**2+totSysError**4))
+            sob = sqrt(-2*((signal+background)*np.log(B_hat/(signal+background))-(background-B_hat)**2/(2*totSysError**2)-B_hat+signal+background))
+            valid = ~(B_hat/(signal+background)<=0) & (2*totSysError**2!=0) & np.isfinite(sob)
+        elif arguments['--knoll']:
+            # time to 3 sigma positive detection at 95% confidence level
+            if arguments['--2sigma']:
+                toff=((1.28*sqrt(2*background*(1+1/RonOff))+2*sqrt(signal/RonOff+2*background*(1+1/RonOff)))/signal)**2
+            else:
+                toff=((1.645*sqrt(2*background*(1+1/RonOff))+3*sqrt(signal/RonOff+2*background*(1+1/RonOff)))/signal)**2
+            t3sig=(2+RonOff)*toff
+            sob=-np.ones(signal.shape)
+        elif arguments['--measurement']:
+            sysError = signal*0.06
+            sob = signal/sqrt(signal+sysError**2 + background+totSysError**2)
+            t3sig = 9*(signal + background) / ( signal**2 - 9*(sysError**2 + totSysError**2))
+        else:
+            # gaussian significance
+            sob = signal/sqrt(background+totSysError**2)
+            if arguments['--2sigma']:
+                t3sig = 4.*background/(signal**2-4.*totSysError**2)
+            else:
+                t3sig = 9.*background/(signal**2-9.*totSysError**2)
+    return sob,t3sig,valid
+
+def poissonZ(t,s,b,syserr):
+
+    # poisson significance with gaussian uncertainty on background after a
+    # dwell time t (days), for rates s and b and systematic syserr per day
+    with np.errstate(all='ignore'):
+        B_hat = 0.5*(b*t-(syserr*t)**2+sqrt((b*t)**2-2*syserr*t*(syserr*t)**2+4*(s*t+b*t)*(syserr*t)**2+(syserr*t)**4))
+        Z = sqrt(-2*((s*t+b*t)*np.log(B_hat/(s*t+b*t))-(b*t-B_hat)**2/(2*(syserr*t)**2)-B_hat+s*t+b*t))
+    return Z
 
-def poissonSig(x,par):
-    B_hat = bhat(x,par)
-    Z = sqrt(-2*((par[0]*x[0]+par[2]*x[0])*log(B_hat/(par[0]*x[0]+par[2]*x[0]))-pow(par[2]*x[0]-B_hat,2)/(2*pow(par[1]*x[0],2))-B_hat+par[0]*x[0]+par[2]*x[0]))
+def poissonpoissonZ(t,s,b,syserr):
+
+    # poisson significance with poisson uncertainty on background after a
+    # dwell time t (days)
+    with np.errstate(all='ignore'):
+        Z = sqrt(2*((s*t+b*t)*np.log((s*t+b*t)*(b*t + (t*syserr)**2)/((b*t)**2+(s*t+b*t)*(t*syserr)**2))-(b*t)**2/(syserr*t)**2 * np.log(1 + ((t*syserr)**2*t*s/(b*t*(b*t + (t*syserr)**2))))))
     return Z
 
+def solveDwellTime(Z,s,b,syserr,nsigma,tmin=1e-3,tmax=1e7,iterations=80):
+
+    # the dwell time at which the significance Z(t,s,b,syserr) reaches
+    # nsigma, by bisection in log(t) over [tmin,tmax] for whole arrays of
+    # cells at once. Returns the times and a flag for each cell which is
+    # False where the root is not bracketed or the bisection did not
+    # converge (the time is then nan).
+    s,b,syserr = np.broadcast_arrays(*[np.asarray(_x,dtype=float) for _x in (s,b,syserr)])
+    lo = np.full(s.shape,float(tmin))
+    hi = np.full(s.shape,float(tmax))
+    bracketed = (Z(lo,s,b,syserr)<nsigma) & (Z(hi,s,b,syserr)>=nsigma)
+    for i in range(iterations):
+        mid = sqrt(lo*hi)
+        above = Z(mid,s,b,syserr)>=nsigma
+        hi = np.where(above,mid,hi)
+        lo = np.where(above,lo,mid)
+    with np.errstate(all='ignore'):
+        converged = bracketed & (np.absolute(Z(hi,s,b,syserr)-nsigma)<1e-6*nsigma)
+    return np.where(converged,hi,np.nan),converged
+
+def dwellTime(s,b,syserr):
+
+    # the time to nsigma (3, or 2 with --2sigma) for arrays of signal and
+    # background rates and background systematics, with the statistics
+    # selected on the command line, and whether each time converged
+    nsigma = 2. if arguments['--2sigma'] else 3.
+    if arguments['--poisson']:
+        # poisson with gaussian uncertainties
+        return solveDwellTime(poissonZ,s,b,syserr,nsigma)
+    elif arguments['--poissonpoisson']:
+        # poisson with poisson uncertainties
+        return solveDwellTime(poissonpoissonZ,s,b,syserr,nsigma)
+    # gaussian: s*t/sqrt(b*t+(syserr*t)**2) = nsigma has a closed form
+    s,b,syserr = np.broadcast_arrays(*[np.asarray(_x,dtype=float) for _x in (s,b,syserr)])
+    with np.errstate(all='ignore'):
+        t = nsigma**2*b/(s**2-nsigma**2*syserr**2)
+    converged = np.isfinite(t) & (t>0)
+    return np.where(converged,t,np.nan),converged
+
 def poissonTime(s,b,syserr):
     
     # with gaussian uncertainty on background
-    Zfunc = TF1("Zfunc",poissonSig,0.1,100,3)
-    Zfunc.SetParameter(0,s)
-    Zfunc.SetParameter(1,syserr)
-    Zfunc.SetParameter(2,b)
-    Zfunc.SetParName(0,"sig")
-    Zfunc.SetParName(1,"syserr")
-    Zfunc.SetParName(2,"bg")
-    t3sigma = Zfunc.GetX(3.)
-    return t3sigma
+    return float(solveDwellTime(poissonZ,s,b,syserr,3.)[0])
 
 def poissonpoissonTime(s,b,syserr):
-        # with poisson uncertainty on background
-    Z = TF1("Z","sqrt(2*(([0]*x+[2]*x)*log(([0]*x+[2]*x)*([2]*x + pow(x*[1],2))/(pow([2]*x,2)+([0]*x+[2]*x)*pow(x*[1],2)))-pow([2]*x,2)/pow([1]*x,2) * log(1 + (pow(x*[1],2)*x*[0]/([2]*x*([2]*x + pow(x*[1],2)))))))",0,50)
-    Z.SetNpx(500)
-    Z.SetParameter(0,s)
-    Z.SetParameter(1,syserr)
-    Z.SetParameter(2,b)
-    t3sigma = Z.GetX(3.)
-    return t3sigma
+    # with poisson uncertainty on background
+    return float(solveDwellTime(poissonpoissonZ,s,b,syserr,3.)[0])
 
 def gaussianTime(s,b,syserr):
-    sigma = TF1("sigma","[0]*x/sqrt([2]*x+pow((x*[1]),2))",0,1000)
-    sigma.SetNpx(10000)
-    sigma.SetParameter(0,s)
-    sigma.SetParameter(1,syserr)
-    sigma.SetParameter(2,b)
-    t3sigma = sigma.GetX(3.)
+    t3sigma = 9.*b/(s**2-9.*syserr**2)
     return t3sigma
 
 def ClTime(s,b,syserr):
@@ -0,0 +1,163 @@
+import json
+from ROOT import RDF
+from .globals import *
+from .planning import *
+from .runner import *
+from .progress import *
+
+# Synthetic stand-in for the RAT simulation and BONSAI reconstruction.
+# --synthesize writes, for every run of the jobs (-e events per run and -N
+# runs, or the event plan), a reconstructed_root_files run file with an
+# 'output' tree holding the branches the analysis reads and a 'runSummary'
+# tree, so that -M, --coincidences, --sensitivity, --triggers and
+# --backgrounds can be run and timed without RAT. The primaries of each run
+# have Poisson timestamps (us, restarting with each run as for RAT) at the
+# rate of their event type. IBD-like event types give a prompt event and,
+# for the captured neutrons, a delayed event close in time and space; the
+# others give uncorrelated singles. The run seeds of the jobs are used, so
+# the files are reproducible.
+
+# the distributions of the synthetic events, which --synthConfig=<file>
+# (a JSON dict) can override
+synthModel = {
+    'nXPerMeV':          4.,    # mean nX per MeV of visible energy
+    'estimatorScale':    {'n9':1.,'n100':1.5,'n400':2.},  # mean of each estimator relative to nX
+    'extraHits':         3.,    # mean number of hits beyond nX
+    'promptShape':       3.,    # gamma distributed prompt energy (MeV)
+    'promptScale':       1.2,
+    'delayedMeV':        4.8,   # mean visible energy of a neutron capture
+    'delayedResolution': 0.15,  # relative
+    'captureEfficiency': 0.9,   # fraction of the prompts with a delayed event
+    'captureTime':       30.,   # us
+    'captureDistance':   300.,  # rms per axis (mm)
+    'singlesMeV':        1.5,   # mean of the exponential singles energy
+    'vertexResolution':  100.,  # rms per axis (mm)
+    'goodnessA':         5.,    # beta distributed position goodness
+    'goodnessB':         2.,
+}
+# the event types with correlated prompt and delayed events
+pairProcesses = ['pn_ibd','A_Z','FASTNEUTRONS','RADIOGENIC']
+
+def pairEvents(_tag):
+
+    return any(_p in _tag for _p in pairProcesses)
+
+def synthesisModel():
+
+    model = dict(synthModel)
+    if arguments['--synthConfig']:
+        with open(arguments['--synthConfig']) as f:
+            model.update(json.load(f))
+    return model
+
+def estimatorNames(model):
+
+    # the energy estimators written, always including --energyEst
+    names = dict(model['estimatorScale'])
+    names.setdefault(energyEstimator,1.)
+    return names
+
+def synthColumns(rng,energy,vertex,model):
+
+    # the reconstructed branches of events with the given visible energies
+    # (MeV) and true vertices (mm)
+    rPMT = float(arguments['--rPMT'])
+    cols = {}
+    meanNX = model['nXPerMeV']*np.maximum(energy,0.)
+    for _e,scale in estimatorNames(model).items():
+        cols['%s_Bonsai'%(_e)] = rng.poisson(scale*meanNX).astype(np.int32)
+    cols['nhits'] = (cols['%s_Bonsai'%(energyEstimator)]+rng.poisson(model['extraHits'],len(energy))).astype(np.int32)
+    reco = vertex+rng.normal(0.,model['vertexResolution'],vertex.shape)
+    for i,_c in enumerate(('x_Bonsai','y_Bonsai','z_Bonsai')):
+        cols[_c] = np.ascontiguousarray(reco[:,i])
+    cols['closestPMT_Bonsai'] = rPMT-sqrt((reco**2).sum(axis=1))
+    cols['positionGoodness_Bonsai'] = rng.beta(model['goodnessA'],model['goodnessB'],len(energy))
+    return cols
+
+def uniformVertices(rng,n):
+
+    # true vertices uniform in the sphere of the PMT radius
+    rPMT = float(arguments['--rPMT'])
+    direction = rng.normal(size=(n,3))
+    direction /= sqrt((direction**2).sum(axis=1))[:,None]
+    return direction*(rPMT*rng.random(n)**(1./3))[:,None]
+
+def synthEvents(rng,_tag,n,t0,rate,model):
+
+    # the events of n primaries following the clock t0 (us). Returns the
+    # columns, in the order of the primaries, and the clock of the last one.
+    t = t0+np.cumsum(rng.exponential(1e6/rate,n))
+    vertex = uniformVertices(rng,n)
+    if not pairEvents(_tag):
+        energy = rng.exponential(model['singlesMeV'],n)
+        cols = synthColumns(rng,energy,vertex,model)
+        cols['timestamp'] = t
+        return cols,t[-1]
+    prompt = synthColumns(rng,rng.gamma(model['promptShape'],model['promptScale'],n),vertex,model)
+    prompt['timestamp'] = t
+    captured = np.flatnonzero(rng.random(n)<model['captureEfficiency'])
+    energy = model['delayedMeV']*(1+model['delayedResolution']*rng.standard_normal(len(captured)))
+    delayed = synthColumns(rng,energy,vertex[captured]+rng.normal(0.,model['captureDistance'],(len(captured),3)),model)
+    delayed['timestamp'] = t[captured]+rng.exponential(model['captureTime'],len(captured))
+    # each delayed event follows its prompt
+    order = np.argsort(np.concatenate((2*np.arange(n),2*captured+1)),kind='stable')
+    cols = {_c:np.ascontiguousarray(np.concatenate((prompt[_c],delayed[_c]))[order]) for _c in prompt}
+    return cols,t[-1]
+
+def writeRunFile(file,cols,n):
+
+    RDF.FromNumpy(cols).Snapshot('output',file)
+    opts = RDF.RSnapshotOptions()
+    opts.fMode = 'UPDATE'
+    RDF.FromNumpy({'nEvents':np.array([n],dtype=np.int32)}).Snapshot('runSummary',file,'',opts)
+    return 0
+
+def synthesizeRun(run,model):
+
+    # writes the run file of a run, in parts of at most the --chunkMB
+    # budget of events (run<name>_<part>.root after the first). The first
+    # part is renamed into place last, so that an interrupted run is redone.
+    _tag,script,name,output,log,seed = run
+    rng = np.random.default_rng(int(seed))
+    rate = singlespersec if 'singles' in _tag else rates[_tag][0]
+    events = plannedEvents(_tag)[0]
+    chunk = max(1,int(float(arguments['--chunkMB'])*2**20/(8*(len(estimatorNames(model))+7))))
+    if pairEvents(_tag):
+        # up to two events per primary
+        chunk = max(1,chunk//2)
+    outdir = f"reconstructed_root_files{additionalString}/{_tag}".replace(" ","")
+    os.makedirs(outdir,exist_ok=True)
+    t0 = 0.
+    for part,start in enumerate(range(0,events,chunk)):
+        n = min(chunk,events-start)
+        cols,t0 = synthEvents(rng,_tag,n,t0,rate,model)
+        file = "%s/run%s_%d.root"%(outdir,name,part) if part else "%s/run%s.root.tmp"%(outdir,name)
+        writeRunFile(file,cols,n)
+        detail(2,'Wrote %d events of %s to %s'%(len(cols['timestamp']),_tag,file))
+    os.replace("%s/run%s.root.tmp"%(outdir,name),"%s/run%s.root"%(outdir,name))
+    return 0
+
+def synthesize():
+
+    # writes the synthetic run files of every run of the jobs, skipping the
+    # runs whose file exists
+    runs = localRuns()
+    if duplicateSeeds(runs):
+        return 1
+    model = synthesisModel()
+    todo = []
+    for run in runs:
+        _tag = run[0]
+        rate = singlespersec if 'singles' in _tag else rates[_tag][0]
+        if rate<=0 or plannedEvents(_tag)[0]<=0:
+            detail(1,'Skipping %s, no events at its rate'%(_tag))
+            continue
+        if not os.path.exists(f"reconstructed_root_files{additionalString}/{_tag}/run{run[2]}.root".replace(" ","")):
+            todo.append(run)
+    print('Synthesizing %d of %d runs (%d primaries)'%(len(todo),len(runs),sum(plannedEvents(_r[0])[0] for _r in todo)))
+    progress = startProgress('Synthesizing',len(todo),'runs')
+    for run in todo:
+        synthesizeRun(run,model)
+        advanceProgress(progress)
+    finishProgress(progress)
+    return 0
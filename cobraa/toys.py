@@ -0,0 +1,93 @@
+from .globals import *
+
+# Toy Monte Carlo of the sensitivity. Each pseudo-experiment draws the true
+# rate of the signal and of every background from its nominal rate with a
+# nuisance factor (log-normal by default, or Gaussian with --toyNuisance
+# gauss) whose width combines the statistical error of the maps and the
+# systematic uncertainty of the component. The toys are drawn as arrays of
+# shape (toys,)+(shape of the rates), so there is no loop over toys.
+
+# the quantiles (%) reported for the toys
+toyQuantiles = [2.5,16,50,84,97.5]
+# the exposures (months) of the significance table
+toyExposures = [1,3,6,9,12,18,24,30]
+
+def toyPercentiles(x,q):
+
+    # the nearest-rank percentiles of the toys (axis 0), which stay
+    # infinite rather than nan where the toys are
+    ranks = np.rint(np.array(q)/100.*(len(x)-1)).astype(int)
+    return np.partition(x,ranks,axis=0)[ranks]
+
+def nuisanceDraws(rng,rate,relError,shape):
+
+    # the rates drawn with a nuisance factor of mean 1 and relative standard
+    # deviation relError
+    z = rng.standard_normal(shape)
+    if arguments['--toyNuisance']=='gauss':
+        return np.maximum(rate*(1+relError*z),0.)
+    sigma = sqrt(np.log(1+relError**2))
+    return rate*np.exp(sigma*z-sigma**2/2)
+
+def toyRates(rng,components,ntoys):
+
+    # the true rates of each component, from its (rate, statistical error,
+    # systematic uncertainty), for ntoys pseudo-experiments
+    drawn = {}
+    for _c,(rate,statError,sysError) in components.items():
+        rate = np.asarray(rate,dtype=float)
+        relError = np.divide(sqrt(statError**2+sysError**2),rate,out=np.zeros(rate.shape),where=rate>0)
+        drawn[_c] = nuisanceDraws(rng,rate,relError,(ntoys,)+rate.shape)
+    return drawn
+
+def toyDwellTimes(rng,components,totSysError,ntoys):
+
+    # the dwell time of each toy: the time the analysis (with its nominal
+    # systematic) would need to reach the significance for the toy's true
+    # rates. Not converged toys are nan.
+    # imported here as sensitivity.py imports this module
+    from .sensitivity import dwellTime
+    drawn = toyRates(rng,components,ntoys)
+    signal = drawn.pop('signal')
+    background = sum(drawn.values())
+    t,converged = dwellTime(signal,background,totSysError)
+    return t,signal,background
+
+def optimumToys(components,totSysError,index,ntoys):
+
+    # prints the quantiles of the dwell time and of the significance after
+    # each exposure at the optimal cell
+    rng = np.random.default_rng(0)
+    components = {_c:tuple(np.asarray(_x)[index] for _x in components[_c]) for _c in components}
+    syserr = np.asarray(totSysError)[index]
+    t,signal,background = toyDwellTimes(rng,components,syserr,ntoys)
+    nominal = sum(components[_c][0] for _c in components if _c!='signal')
+    print('\nToy Monte Carlo at the optimum (%d toys, %s nuisances):'%(ntoys,arguments['--toyNuisance']))
+    print('quantiles (%%):           %s'%(' '.join('%10.1f'%(_q) for _q in toyQuantiles)))
+    if np.count_nonzero(np.isnan(t)):
+        print('(%d toys without a dwell time are counted as infinite)'%(np.count_nonzero(np.isnan(t))))
+    print('days to discovery:       %s'%(' '.join('%10.1f'%(_t) for _t in toyPercentiles(np.where(np.isnan(t),np.inf,t),toyQuantiles))))
+    for months in toyExposures:
+        # observed counts of each toy, tested against the nominal
+        # background with its systematic
+        days = months*30.
+        observed = rng.poisson((signal+background)*days)
+        Z = (observed-nominal*days)/sqrt(nominal*days+(syserr*days)**2)
+        print('%2d-month significance:   %s   P(Z>3): %.3f'%(months,' '.join('%10.2f'%(_z) for _z in toyPercentiles(Z,toyQuantiles)),np.mean(Z>3)))
+    return 0
+
+def gridToys(components,totSysError,ntoys):
+
+    # the 16%, 50% and 84% quantiles of the dwell time in every cell of the
+    # scan, evaluated in blocks of cells to bound the size of the toy arrays
+    rng = np.random.default_rng(0)
+    shape = np.shape(totSysError)
+    flat = {_c:tuple(np.broadcast_to(_x,shape).reshape(-1) for _x in components[_c]) for _c in components}
+    syserr = np.asarray(totSysError).reshape(-1)
+    quantiles = np.empty((3,syserr.size))
+    block = max(1,int(4e6//ntoys))
+    for start in range(0,syserr.size,block):
+        stop = min(start+block,syserr.size)
+        t,signal,background = toyDwellTimes(rng,{_c:tuple(_x[start:stop] for _x in flat[_c]) for _c in flat},syserr[start:stop],ntoys)
+        quantiles[:,start:stop] = toyPercentiles(np.where(np.isnan(t),np.inf,t),[16,50,84])
+    return [_q.reshape(shape) for _q in quantiles]
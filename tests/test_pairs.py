@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Regression test of the pair engine (streamPairs() and coincidenceCounts())
+# against the TTree::Draw scan of --drawScan: both fill the maps of a small
+# synthetic run file and the --cellLog counts must agree cell by cell. The
+# run is dense enough that neighbouring pairs fall within dT, so the
+# multiplicity veto is exercised, and the pair engine streams it in chunks
+# of a few hundred events, so pairs straddle the chunk boundaries.
+
+ROOT = pytest.importorskip('ROOT')
+
+# the package reads its options from the command line when imported
+_argv = sys.argv
+sys.argv = ['cobraa.py','--maxNXdelayed','7','--maxNXprompt','7','--maxFid','0.3',
+            '--dTmax','140','--dRmax','1.9','--gmax','0.1','--maxEpmax','20']
+from cobraa.coincidence import *
+from cobraa.synthesize import *
+sys.argv = _argv
+
+# about 100 us between primaries, so that the multiplicity cut vetoes
+# some of the pairs of each cell but not all
+synthRate = 1e4
+synthPrimaries = 3000
+
+@pytest.fixture(scope='module')
+def runfile(tmp_path_factory):
+
+    cols,_ = synthEvents(np.random.default_rng(7),'pn_ibd',synthPrimaries,0.,synthRate,synthesisModel())
+    file = str(tmp_path_factory.mktemp('synth')/'run0.root')
+    writeRunFile(file,cols,synthPrimaries)
+    return file
+
+def cellCounts(logfile,_tag):
+
+    counts = {}
+    with open(logfile) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['tag']==_tag:
+                cell = tuple(record[_c] for _c in ('delayed','dT','maxEp','g','dR','fid','prompt'))
+                counts[cell] = record['count']
+    return counts
+
+def fillCounts(monkeypatch,tmp_path,runfile,_tag,drawScan,chunkMB):
+
+    # the cell counts of the maps of the run file filled by one engine
+    logfile = str(tmp_path/('%s.jsonl'%(_tag)))
+    monkeypatch.setattr(sys.modules['cobraa.progress'],'cellLogFd',None)
+    monkeypatch.setitem(arguments,'--cellLog',logfile)
+    monkeypatch.setitem(arguments,'--drawScan',drawScan)
+    monkeypatch.setitem(arguments,'--timeline',False)
+    monkeypatch.setitem(arguments,'--chunkMB',chunkMB)
+    outfile = TFile(str(tmp_path/('%s.root'%(_tag))),'RECREATE')
+    obtainCoincidences(runfile,_tag,outfile,synthRate)
+    outfile.Close()
+    os.close(sys.modules['cobraa.progress'].cellLogFd)
+    return cellCounts(logfile,_tag)
+
+def test_chunks(monkeypatch,runfile):
+
+    # the small budget splits the run file into many chunks
+    monkeypatch.setitem(arguments,'--chunkMB','0.01')
+    chunks = [len(_c['timestamp']) for _c in iterateColumns(runfile,coincidenceBranches)]
+    assert len(chunks)>10
+    assert sum(chunks)==ROOT.TFile(runfile).Get('output').GetEntries()
+
+def test_engines(monkeypatch,tmp_path,runfile):
+
+    draw = fillCounts(monkeypatch,tmp_path,runfile,'pn_ibd_draw',True,'512')
+    chunked = fillCounts(monkeypatch,tmp_path,runfile,'pn_ibd_chunked',False,'0.01')
+    whole = fillCounts(monkeypatch,tmp_path,runfile,'pn_ibd_whole',False,'512')
+    grid = cutGrid()
+    assert len(draw)==len(grid['delayed'])*len(grid['dT'])*len(grid['maxEp'])*len(grid['g'])*len(grid['dR'])*len(grid['fid'])*len(grid['prompt'])
+    assert sum(draw.values())>0
+    for cell in draw:
+        assert chunked[cell]==draw[cell],cell
+        assert whole[cell]==draw[cell],cell
+    assert set(chunked)==set(draw)
+    assert set(whole)==set(draw)
+
+def test_veto(runfile):
+
+    # a good part of the candidate pairs have another one within the dT
+    # cuts, which the multiplicity cut has to veto
+    grid = cutGrid()
+    cols = readColumns(runfile,coincidenceBranches)
+    pairs = extractPairs(cols,previousEventColumns(cols),grid)
+    gaps = np.diff(pairs['timestamp'])
+    assert len(gaps)>100
+    assert 0.2<np.mean(gaps<cutValue(min(grid['dT'])))<0.8